@@ -0,0 +1,253 @@
+"""
+Background advisory pipeline
+
+/diagnosis/predict no longer waits for the LLM: a prediction whose advisory
+is not already stored is saved with ai_advisory = NULL (pending) and handed
+to this pipeline. Each generation runs under a concurrency limit, a
+per-call timeout and a small retry budget, behind a circuit breaker that
+fails fast while the API is down. The result is written to
+Prediction.ai_advisory, where GET /diagnosis/history/{id} exposes it.
+Predictions waiting on the same advisory share one in-flight call.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from backend import database
+from backend.advisory_store import advisory_store
+from backend.config import settings
+from backend.executors import io_executor
+from backend.models import Prediction
+from ml.api_reasoner import generate_ai_advisory_async, stream_ai_advisory
+
+logger = logging.getLogger(__name__)
+
+ADVISORY_FAILED_PREFIX = "AI advisory generation failed"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_timeout` seconds; then lets a single trial call through
+    (half-open) and closes again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_running):
+            raise CircuitOpenError("advisory service unavailable (circuit open)")
+        if state == "half_open":
+            self._trial_running = True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def release(self):
+        # A half-open trial that was abandoned (e.g. client disconnected)
+        self._trial_running = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._trial_running = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+class AdvisoryPipeline:
+    def __init__(self, max_concurrency: int, timeout: float, max_attempts: int, breaker: CircuitBreaker):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.breaker = breaker
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight: dict = {}
+        self._tasks: set = set()
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+
+    def schedule(self, prediction_id: int, disease: str, crop: str, stage: str, confidence: float):
+        """Fill the advisory of a saved prediction in the background"""
+        task = asyncio.create_task(self._fill(prediction_id, disease, crop, stage, confidence))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stream(self, prediction_id: int, disease: str, crop: str, stage: str, confidence: float):
+        """
+        Yield the advisory of a saved prediction in chunks straight from the
+        LLM (or in one chunk if it is already stored), then persist it. Same
+        limiter, timeout and circuit breaker as the background path; if the
+        consumer goes away mid-stream, generation continues in the background.
+        """
+        key = advisory_store.key(disease, crop, stage, confidence)
+        content = await io_executor.run(advisory_store.read_stored, key)
+        if content is None and key in self._in_flight:
+            content = await asyncio.shield(self._in_flight[key])
+
+        if content is None:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            parts = []
+            try:
+                self.breaker.before_call()
+                async with self._semaphore:
+                    async for chunk in stream_ai_advisory(
+                        disease, crop, advisory_store.prompt_confidence(key), stage, timeout=self.timeout
+                    ):
+                        parts.append(chunk)
+                        yield chunk
+            except (GeneratorExit, asyncio.CancelledError):
+                # Consumer went away mid-stream; finish it the non-streaming way
+                self.breaker.release()
+                self.schedule(prediction_id, disease, crop, stage, confidence)
+                raise
+            except Exception as e:
+                if not isinstance(e, CircuitOpenError):
+                    self.breaker.record_failure()
+                self._failed += 1
+                await io_executor.run(
+                    update_prediction_advisory, prediction_id, f"{ADVISORY_FAILED_PREFIX}: {e}"
+                )
+                raise
+
+            self.breaker.record_success()
+            content = "".join(parts).strip()
+            await io_executor.run(advisory_store.save, key, content)
+        else:
+            yield content
+
+        self._completed += 1
+        await io_executor.run(update_prediction_advisory, prediction_id, content)
+
+    async def resume_pending(self, limit: int = 500):
+        """Re-schedule predictions left pending by a previous process"""
+        pending = await io_executor.run(load_pending_predictions, limit)
+        for prediction_id, disease, stage, confidence in pending:
+            self.schedule(prediction_id, disease, "Unknown", stage, confidence)
+        if pending:
+            logger.info(f"Resumed {len(pending)} pending advisories")
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "scheduled": len(self._tasks),
+            "max_concurrency": self.max_concurrency,
+            "timeout_s": self.timeout,
+            "completed": self._completed,
+            "failed": self._failed,
+            "timeouts": self._timeouts,
+            "circuit": self.breaker.state,
+        }
+
+    async def _fill(self, prediction_id, disease, crop, stage, confidence):
+        key = advisory_store.key(disease, crop, stage, confidence)
+        try:
+            shared = self._in_flight.get(key)
+            if shared is None:
+                shared = asyncio.ensure_future(self._resolve(key, disease, crop, stage))
+                self._in_flight[key] = shared
+                shared.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            content = await asyncio.shield(shared)
+            self._completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Advisory for prediction {prediction_id} failed: {e}")
+            self._failed += 1
+            content = f"{ADVISORY_FAILED_PREFIX}: {e}"
+
+        await io_executor.run(update_prediction_advisory, prediction_id, content)
+
+    async def _resolve(self, key, disease, crop, stage) -> str:
+        content = await io_executor.run(advisory_store.read_stored, key)
+        if content is not None:
+            return content
+
+        content = await self._generate(disease, crop, advisory_store.prompt_confidence(key), stage)
+        await io_executor.run(advisory_store.save, key, content)
+        return content
+
+    async def _generate(self, disease, crop, confidence, stage) -> str:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(min(2 ** attempt, 10))
+            self.breaker.before_call()
+            try:
+                async with self._semaphore:
+                    content = await asyncio.wait_for(
+                        generate_ai_advisory_async(disease, crop, confidence, stage, timeout=self.timeout),
+                        self.timeout
+                    )
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                self.breaker.record_failure()
+                last_error = TimeoutError(f"no response within {self.timeout:.0f}s")
+            except Exception as e:
+                self.breaker.record_failure()
+                last_error = e
+            else:
+                self.breaker.record_success()
+                return content
+        raise last_error
+
+
+def update_prediction_advisory(prediction_id: int, content: str):
+    db = database.SessionLocal()
+    try:
+        db.query(Prediction).filter(Prediction.id == prediction_id).update(
+            {Prediction.ai_advisory: content}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def load_pending_predictions(limit: int):
+    db = database.SessionLocal()
+    try:
+        rows = db.query(Prediction).filter(
+            Prediction.ai_advisory.is_(None),
+            Prediction.is_unknown == False
+        ).order_by(Prediction.id.desc()).limit(limit).all()
+        return [(row.id, row.disease_name, row.disease_stage, row.confidence_score) for row in rows]
+    finally:
+        db.close()
+
+
+advisory_pipeline = AdvisoryPipeline(
+    settings.ADVISORY_MAX_CONCURRENCY,
+    settings.ADVISORY_TIMEOUT_S,
+    settings.ADVISORY_MAX_ATTEMPTS,
+    CircuitBreaker(settings.ADVISORY_BREAKER_FAILURES, settings.ADVISORY_BREAKER_RESET_S)
+)
@@ -0,0 +1,210 @@
+"""
+Persistent advisory store
+
+LLM advisories depend only on (disease, crop, stage, confidence), so they
+are stored in the `advisories` table and mirrored in an in-process dict,
+keyed on (disease, crop, stage, confidence bucket, prompt version). The
+predict path reads the dict in microseconds and only calls the LLM on a
+miss; a background precompute fills every class/stage/bucket combination
+after startup and after each retrain.
+"""
+import logging
+import math
+import threading
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from backend import database
+from backend.config import settings
+from backend.models import Advisory
+from ml.agro_intelligence import assess_disease_intelligence
+from ml.api_reasoner import ADVISORY_PROMPT_VERSION, advisory_available, generate_ai_advisory
+
+logger = logging.getLogger(__name__)
+
+
+class AdvisoryStore:
+    def __init__(self, bucket_width: float, prompt_version: int = ADVISORY_PROMPT_VERSION):
+        # Buckets are kept in hundredths so keys compare exactly in SQL
+        self.bucket_step = max(1, round(bucket_width * 100))
+        self.prompt_version = prompt_version
+        self._entries: dict = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._precompute_thread: Optional[threading.Thread] = None
+        self._hits = 0
+        self._db_hits = 0
+        self._generated = 0
+
+    def bucket(self, confidence: float) -> int:
+        """Lower edge of the confidence bucket, in hundredths"""
+        hundredths = min(100, max(0, math.floor(confidence * 100 + 1e-6)))
+        return hundredths - hundredths % self.bucket_step
+
+    def key(self, disease: str, crop: str, stage: str, confidence: float) -> tuple:
+        return (disease, crop, stage, self.bucket(confidence), self.prompt_version)
+
+    def lookup(self, disease: str, crop: str, stage: str, confidence: float) -> Optional[str]:
+        """In-memory read only; safe to call on the event loop"""
+        with self._lock:
+            content = self._entries.get(self.key(disease, crop, stage, confidence))
+            if content is not None:
+                self._hits += 1
+            return content
+
+    def get_or_generate(self, disease: str, crop: str, stage: str, confidence: float) -> str:
+        """
+        Blocking: memory, then the DB, then the LLM. The prompt gets the bucket's
+        lower edge as its confidence so every request in a bucket shares one advisory.
+        """
+        content = self.lookup(disease, crop, stage, confidence)
+        if content is not None:
+            return content
+
+        key = self.key(disease, crop, stage, confidence)
+        content = self.read_stored(key)
+        if content is not None:
+            return content
+
+        content = generate_ai_advisory(
+            disease=disease, crop=crop, confidence=self.prompt_confidence(key), severity=stage
+        )
+        self.save(key, content)
+        return content
+
+    @staticmethod
+    def prompt_confidence(key) -> float:
+        return key[3] / 100
+
+    def read_stored(self, key) -> Optional[str]:
+        """Blocking: memory, then the DB"""
+        with self._lock:
+            content = self._entries.get(key)
+        if content is not None:
+            return content
+
+        content = self._read(key)
+        if content is not None:
+            with self._lock:
+                self._entries[key] = content
+                self._db_hits += 1
+        return content
+
+    def save(self, key, content: str):
+        # Without an API key the reply is a fixed notice, not an advisory worth storing
+        if not advisory_available():
+            return
+        self._write(key, content)
+        with self._lock:
+            self._entries[key] = content
+            self._generated += 1
+
+    def load(self):
+        """Mirror every stored advisory of the current prompt version in memory"""
+        db = database.SessionLocal()
+        try:
+            rows = db.query(Advisory).filter(Advisory.prompt_version == self.prompt_version).all()
+            entries = {
+                (row.disease_name, row.crop, row.disease_stage, row.confidence_bucket, row.prompt_version):
+                    row.content
+                for row in rows
+            }
+        finally:
+            db.close()
+
+        with self._lock:
+            self._entries.update(entries)
+            self._loaded = True
+        logger.info(f"Loaded {len(entries)} stored advisories")
+
+    def combinations(self, class_names, crop: str, threshold: float):
+        """Every (disease, crop, stage, confidence) a known prediction can map to"""
+        lowest = self.bucket(threshold or 0.0)
+        for disease in class_names:
+            for lower in range(lowest, 101, self.bucket_step):
+                upper = min(lower + self.bucket_step, 101) - 1
+                stages = {
+                    assess_disease_intelligence(confidence / 100, coverage)[0]
+                    for confidence in (lower, upper) for coverage in (0.0, 1.0)
+                }
+                for stage in sorted(stages):
+                    yield disease, crop, stage, lower / 100
+
+    def precompute(self, class_names, crop: str = "Unknown", threshold: float = 0.0):
+        if not self._loaded:
+            self.load()
+        if not advisory_available():
+            logger.info("Skipping advisory precompute: OPENAI_API_KEY is not set")
+            return
+
+        generated = 0
+        for disease, crop_name, stage, confidence in self.combinations(class_names, crop, threshold):
+            if self.lookup(disease, crop_name, stage, confidence) is not None:
+                continue
+            try:
+                self.get_or_generate(disease, crop_name, stage, confidence)
+                generated += 1
+            except Exception as e:
+                logger.warning(f"Advisory precompute failed for {disease}/{stage}: {e}")
+        logger.info(f"Advisory precompute finished: {generated} generated")
+
+    def schedule_precompute(self, class_names, crop: str = "Unknown", threshold: float = 0.0):
+        """Run precompute on a background thread unless one is already running"""
+        if not settings.ADVISORY_PRECOMPUTE or not class_names:
+            return
+        with self._lock:
+            if self._precompute_thread is not None and self._precompute_thread.is_alive():
+                return
+            self._precompute_thread = threading.Thread(
+                target=self.precompute, args=(list(class_names), crop, threshold),
+                name="advisory-precompute", daemon=True
+            )
+            self._precompute_thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "prompt_version": self.prompt_version,
+                "bucket_width": self.bucket_step / 100,
+                "hits": self._hits,
+                "db_hits": self._db_hits,
+                "generated": self._generated,
+                "precompute_running": (
+                    self._precompute_thread is not None and self._precompute_thread.is_alive()
+                ),
+            }
+
+    def _read(self, key) -> Optional[str]:
+        disease, crop, stage, bucket, prompt_version = key
+        db = database.SessionLocal()
+        try:
+            row = db.query(Advisory).filter(
+                Advisory.disease_name == disease,
+                Advisory.crop == crop,
+                Advisory.disease_stage == stage,
+                Advisory.confidence_bucket == bucket,
+                Advisory.prompt_version == prompt_version
+            ).first()
+            return row.content if row else None
+        finally:
+            db.close()
+
+    def _write(self, key, content: str):
+        disease, crop, stage, bucket, prompt_version = key
+        db = database.SessionLocal()
+        try:
+            db.add(Advisory(
+                disease_name=disease, crop=crop, disease_stage=stage,
+                confidence_bucket=bucket, prompt_version=prompt_version, content=content
+            ))
+            db.commit()
+        except IntegrityError:
+            # Another worker stored the same key first; keep theirs
+            db.rollback()
+        finally:
+            db.close()
+
+
+advisory_store = AdvisoryStore(settings.ADVISORY_CONFIDENCE_BUCKET)
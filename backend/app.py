@@ -1,10 +1,18 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from backend.config import settings
 from backend.database import init_db
 from backend.ml_service import ml_service
+from backend.executors import executor_stats, shutdown_executors
+from backend.inference_batcher import inference_batcher, label_batcher
+from backend.result_cache import result_cache
+from backend.gradcam_cache import gradcam_cache
+from backend.edge_sync import prototype_sync
+from backend.advisory_store import advisory_store
+from backend.advisory_pipeline import advisory_pipeline
 from backend.routers import auth, diagnosis, admin
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -16,12 +24,24 @@ async def lifespan(app: FastAPI):
     try:
         ml_service.initialize()
         print("ML models loaded successfully")
+        
+        advisory_store.schedule_precompute(ml_service.class_names, threshold=ml_service.threshold)
     except Exception as e:
         print(f"Warning: ML models failed to initialize: {e}")
         print("Some endpoints may not work until models are available")
     
+    await inference_batcher.start()
+    await label_batcher.start()
+    try:
+        await advisory_pipeline.resume_pending()
+    except Exception as e:
+        print(f"Warning: could not resume pending advisories: {e}")
     yield
     print("Shutting down AgroAI Backend...")
+    await inference_batcher.stop()
+    await label_batcher.stop()
+    await advisory_pipeline.stop()
+    shutdown_executors()
 
 
 # Create FastAPI app
@@ -63,8 +83,37 @@ def health_check():
     return {
         "status": "healthy",
         "ml_models": ml_status,
+        "executors": executor_stats(),
+        "inference_batcher": inference_batcher.stats(),
+        "label_batcher": label_batcher.stats(),
+        "cascade": ml_service.cascade.stats() if ml_service.cascade is not None else None,
+        "result_cache": result_cache.stats(),
+        "gradcam_cache": gradcam_cache.stats(),
+        "edge_sync": prototype_sync.stats(),
+        "advisory_store": advisory_store.stats(),
+        "advisory_pipeline": advisory_pipeline.stats(),
+        "version": settings.VERSION
+    }
+
+
+@app.get("/health/live")
+def liveness_check():
+    """Liveness: the process is up and serving HTTP"""
+    return {"status": "alive", "version": settings.VERSION}
+
+
+@app.get("/health/ready")
+def readiness_check():
+    """Readiness: models loaded and warmed up; route traffic only when this returns 200"""
+    ready = ml_service.is_ready
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "model_version": ml_service.model_version,
+        "warmup": ml_service.warmup_status,
+        "queue_depth": inference_batcher.queue_depth + executor_stats()["ml"]["queued"],
         "version": settings.VERSION
     }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
 
 if __name__ == "__main__":
     import uvicorn
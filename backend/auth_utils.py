@@ -50,10 +50,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
+def authenticate_token(token: str, db: Session) -> User:
+    """Resolve a bearer token to an active user; raises 401 / 400 like the HTTP dependency"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -78,6 +76,13 @@ def get_current_user(
     return user
 
 
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> User:
+    return authenticate_token(token, db)
+
+
 def get_current_active_user(
     current_user: User = Depends(get_current_user)
 ) -> User:
@@ -18,21 +18,87 @@ class Settings:
     # ML Model Paths
     ENCODER_PATH: str = os.getenv("ENCODER_PATH", "ml/encoder_supcon.pth")
     TRAIN_DATA_DIR: str = os.getenv("TRAIN_DATA_DIR", "data/fewshot/train")
+    PROTOTYPE_ARTIFACT_PATH: str = os.getenv(
+        "PROTOTYPE_ARTIFACT_PATH", os.path.join(os.path.dirname(ENCODER_PATH), "prototypes.pt")
+    )
     OPEN_SET_THRESHOLD: Optional[float] = None
+    # Classification embedding backend: eager | torchscript | onnx | int8
+    # (export with python -m ml.export_encoder or python -m ml.quantize_encoder)
+    INFERENCE_BACKEND: str = os.getenv("INFERENCE_BACKEND", "eager")
+    PROTOTYPES_PER_CLASS: int = int(os.getenv("PROTOTYPES_PER_CLASS", "1"))
+    # Low-res early-exit cascade (calibrate with python -m ml.calibrate_cascade)
+    CASCADE_ENABLED: bool = os.getenv("CASCADE_ENABLED", "false").lower() in ("1", "true", "yes")
+    CASCADE_ARTIFACT_PATH: str = os.getenv(
+        "CASCADE_ARTIFACT_PATH", os.path.join(os.path.dirname(ENCODER_PATH), "cascade.pt")
+    )
     
     # File Upload
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "data/processed")
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
     ALLOWED_EXTENSIONS: set = {".jpg", ".jpeg", ".png", ".JPG", ".JPEG", ".PNG"}
+    # POST /diagnosis/batch: images per request, images in flight at once and
+    # predictions inserted per DB transaction
+    BATCH_UPLOAD_MAX_FILES: int = int(os.getenv("BATCH_UPLOAD_MAX_FILES", "500"))
+    BATCH_UPLOAD_CONCURRENCY: int = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", "16"))
+    BATCH_DB_FLUSH_SIZE: int = int(os.getenv("BATCH_DB_FLUSH_SIZE", "32"))
+    # POST /diagnosis/predict/tiled (drone / canopy frames)
+    TILED_MAX_UPLOAD_SIZE: int = int(os.getenv("TILED_MAX_UPLOAD_SIZE", str(50 * 1024 * 1024)))
+    TILED_MAX_TILES: int = int(os.getenv("TILED_MAX_TILES", "2048"))
+    TILE_BATCH_SIZE: int = int(os.getenv("TILE_BATCH_SIZE", "16"))
+    # /diagnosis/live WebSocket: max bytes per frame, and the perceptual-hash
+    # distance (bits out of 64) below which a frame reuses the previous label
+    LIVE_MAX_FRAME_SIZE: int = int(os.getenv("LIVE_MAX_FRAME_SIZE", str(2 * 1024 * 1024)))
+    LIVE_DEDUP_DISTANCE: int = int(os.getenv("LIVE_DEDUP_DISTANCE", "5"))
+    # Edge deployment: bundles built by python -m ml.edge_bundle, and how many
+    # past model versions /diagnosis/edge/prototypes can send deltas against
+    EDGE_BUNDLE_DIR: str = os.getenv("EDGE_BUNDLE_DIR", os.path.join(os.path.dirname(ENCODER_PATH), "edge"))
+    EDGE_SYNC_HISTORY: int = int(os.getenv("EDGE_SYNC_HISTORY", "32"))
+    
+    # Result cache keyed by upload sha256 + model version (0 entries disables it;
+    # set RESULT_CACHE_DIR to also keep results on disk across restarts)
+    RESULT_CACHE_SIZE: int = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+    RESULT_CACHE_DIR: Optional[str] = os.getenv("RESULT_CACHE_DIR") or None
     
     # Grad-CAM Output
     GRADCAM_OUTPUT_DIR: str = os.getenv("GRADCAM_OUTPUT_DIR", "data/processed/gradcam")
+    # Overlays are rendered on first access and cached here (LRU by file count)
+    GRADCAM_CACHE_DIR: str = os.getenv("GRADCAM_CACHE_DIR", os.path.join(GRADCAM_OUTPUT_DIR, "cache"))
+    GRADCAM_CACHE_MAX_ENTRIES: int = int(os.getenv("GRADCAM_CACHE_MAX_ENTRIES", "2000"))
     
     # OpenAI API (for AI reasoning)
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
+    # Advisories are stored per (disease, crop, stage, confidence bucket, prompt version)
+    ADVISORY_CONFIDENCE_BUCKET: float = float(os.getenv("ADVISORY_CONFIDENCE_BUCKET", "0.05"))
+    ADVISORY_PRECOMPUTE: bool = os.getenv("ADVISORY_PRECOMPUTE", "true").lower() in ("1", "true", "yes")
+    # Background advisory generation (predict returns with the advisory pending)
+    ADVISORY_MAX_CONCURRENCY: int = int(os.getenv("ADVISORY_MAX_CONCURRENCY", "4"))
+    ADVISORY_TIMEOUT_S: float = float(os.getenv("ADVISORY_TIMEOUT_S", "20"))
+    ADVISORY_MAX_ATTEMPTS: int = int(os.getenv("ADVISORY_MAX_ATTEMPTS", "2"))
+    ADVISORY_BREAKER_FAILURES: int = int(os.getenv("ADVISORY_BREAKER_FAILURES", "5"))
+    ADVISORY_BREAKER_RESET_S: float = float(os.getenv("ADVISORY_BREAKER_RESET_S", "30"))
     
     # Device
     DEVICE: str = os.getenv("DEVICE", "cpu")
+    TORCH_NUM_THREADS: Optional[int] = int(os.getenv("TORCH_NUM_THREADS")) if os.getenv("TORCH_NUM_THREADS") else None
+    
+    # Execution pools (CPU-bound ML stages vs blocking I/O)
+    ML_EXECUTOR_WORKERS: int = int(os.getenv("ML_EXECUTOR_WORKERS", "2"))
+    ML_EXECUTOR_MAX_QUEUE: int = int(os.getenv("ML_EXECUTOR_MAX_QUEUE", "32"))
+    IO_EXECUTOR_WORKERS: int = int(os.getenv("IO_EXECUTOR_WORKERS", "16"))
+    IO_EXECUTOR_MAX_QUEUE: int = int(os.getenv("IO_EXECUTOR_MAX_QUEUE", "256"))
+    # After a failed model load, requests get 503 for this long before the next attempt
+    ML_INIT_RETRY_S: float = float(os.getenv("ML_INIT_RETRY_S", "30"))
+    
+    # Dynamic micro-batching for the encoder
+    BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", "16"))
+    BATCH_MAX_WAIT_MS: float = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+    
+    # Startup warmup (0 iterations disables it)
+    WARMUP_ITERATIONS: int = int(os.getenv("WARMUP_ITERATIONS", "2"))
+    WARMUP_BATCH_SIZES: list = [
+        int(size) for size in os.getenv("WARMUP_BATCH_SIZES", "1,2,4,8,16").split(",") if size.strip()
+    ]
     
     # CORS
     CORS_ORIGINS: list = [
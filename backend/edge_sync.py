@@ -0,0 +1,125 @@
+"""
+Versioned prototype table for edge devices
+
+An edge bundle (python -m ml.edge_bundle) ships the encoder together with
+the prototype rows of one model version. After /admin/train or a report
+approval only the prototypes change, so devices resync through
+GET /diagnosis/edge/prototypes instead of downloading a new bundle: the
+response's ETag is the model version, and a device that sends its current
+version in If-None-Match gets a 304 if nothing changed, or just the class
+rows whose content changed since that version. Per-class row hashes of the
+last EDGE_SYNC_HISTORY versions are kept to compute those deltas; older or
+unknown versions get the full table.
+"""
+import base64
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from backend.config import settings
+from ml.edge_bundle import EDGE_BUNDLE_FORMAT, class_rows, row_hash
+
+logger = logging.getLogger(__name__)
+
+
+class PrototypeSync:
+    def __init__(self, history_size: int):
+        self.history_size = max(1, history_size)
+        self._history: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._current: Optional[dict] = None
+        self._full = 0
+        self._deltas = 0
+        self._not_modified = 0
+
+    @property
+    def version(self) -> Optional[str]:
+        with self._lock:
+            return self._current["version"] if self._current else None
+
+    def record(self, bank, model_version: str, encoder_version: str, threshold: float, margin_threshold: float):
+        """Publish the prototype bank that model_version serves"""
+        rows = class_rows(bank)
+        hashes = {name: row_hash(matrix) for name, matrix in rows.items()}
+        with self._lock:
+            self._current = {
+                "version": model_version,
+                "encoder_version": encoder_version,
+                "class_names": list(bank.class_names),
+                "embedding_dim": bank.embedding_dim,
+                "threshold": float(threshold),
+                "margin_threshold": float(margin_threshold),
+                "rows": rows,
+                "hashes": hashes,
+            }
+            self._history[model_version] = hashes
+            self._history.move_to_end(model_version)
+            while len(self._history) > self.history_size:
+                self._history.popitem(last=False)
+        logger.info(f"Edge prototype table at version {model_version}")
+
+    def not_modified(self, since: Optional[str]) -> bool:
+        with self._lock:
+            unchanged = self._current is not None and since == self._current["version"]
+            if unchanged:
+                self._not_modified += 1
+            return unchanged
+
+    def table(self, since: Optional[str] = None) -> Optional[dict]:
+        """
+        The current table, or only the classes changed since `since` when that
+        version is still in the history and used the same encoder
+        """
+        with self._lock:
+            current = self._current
+            if current is None:
+                return None
+            base = self._history.get(since) if since else None
+            if base is not None and not since.startswith(f"{current['encoder_version']}-"):
+                base = None
+
+            if base is None:
+                changed = current["class_names"]
+                removed = []
+                self._full += 1
+            else:
+                changed = [name for name in current["class_names"] if base.get(name) != current["hashes"][name]]
+                removed = [name for name in base if name not in current["hashes"]]
+                self._deltas += 1
+
+        return {
+            "format": EDGE_BUNDLE_FORMAT,
+            "version": current["version"],
+            "encoder_version": current["encoder_version"],
+            "base_version": since if base is not None else None,
+            "delta": base is not None,
+            "class_names": current["class_names"],
+            "embedding_dim": current["embedding_dim"],
+            "dtype": "float16",
+            "threshold": current["threshold"],
+            "margin_threshold": current["margin_threshold"],
+            "rows": {
+                name: {
+                    "count": len(current["rows"][name]),
+                    "hash": current["hashes"][name],
+                    "data": base64.b64encode(current["rows"][name].astype("<f2").tobytes()).decode("ascii"),
+                }
+                for name in changed
+            },
+            "removed": removed,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self._current["version"] if self._current else None,
+                "history": len(self._history),
+                "history_size": self.history_size,
+                "full": self._full,
+                "deltas": self._deltas,
+                "not_modified": self._not_modified,
+            }
+
+
+prototype_sync = PrototypeSync(settings.EDGE_SYNC_HISTORY)
@@ -0,0 +1,95 @@
+"""
+Execution pools for blocking work
+
+CPU-bound ML stages (decode, inference, Grad-CAM) run on `ml_executor`,
+blocking I/O (file writes, DB commits, LLM calls) runs on `io_executor`.
+Async handlers await them so the event loop stays free to serve other requests.
+"""
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturatedError(RuntimeError):
+    pass
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool and await its result"""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                logger.warning(f"{self.name} executor saturated ({self._pending} pending)")
+                raise ExecutorSaturatedError(f"{self.name} executor is saturated")
+            self._pending += 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._pool, self._call, functools.partial(fn, *args, **kwargs)
+            )
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+
+    def _call(self, func):
+        with self._lock:
+            self._running += 1
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self._pending - self._running, 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": max(self._pending - self._running, 0),
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+ml_executor = BoundedExecutor("ml", settings.ML_EXECUTOR_WORKERS, settings.ML_EXECUTOR_MAX_QUEUE)
+io_executor = BoundedExecutor("io", settings.IO_EXECUTOR_WORKERS, settings.IO_EXECUTOR_MAX_QUEUE)
+
+
+def executor_stats() -> dict:
+    return {
+        "ml": ml_executor.stats(),
+        "io": io_executor.stats(),
+    }
+
+
+def shutdown_executors():
+    ml_executor.shutdown()
+    io_executor.shutdown()
@@ -0,0 +1,103 @@
+"""
+On-demand Grad-CAM overlays
+
+/diagnosis/predict only stores the raw Grad-CAM grid (Prediction.cam_grid);
+the overlay is rendered the first time GET /diagnosis/gradcam/{id} asks for
+it, for the requested size / alpha / colormap, and the encoded JPEG is kept
+in GRADCAM_CACHE_DIR. The cache holds at most GRADCAM_CACHE_MAX_ENTRIES
+files and evicts the least recently served ones.
+"""
+import logging
+import os
+import threading
+
+import cv2
+
+from backend.config import settings
+from ml.gradcam import render_overlay
+from ml.ingest import overlay_base
+
+logger = logging.getLogger(__name__)
+
+COLORMAPS = {
+    "jet": cv2.COLORMAP_JET,
+    "turbo": cv2.COLORMAP_TURBO,
+    "inferno": cv2.COLORMAP_INFERNO,
+    "viridis": cv2.COLORMAP_VIRIDIS,
+    "hot": cv2.COLORMAP_HOT,
+}
+
+
+class GradcamCache:
+    def __init__(self, cache_dir: str, max_entries: int):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._renders = 0
+        self._evictions = 0
+
+    def path(self, prediction_id: int, size: int, alpha: float, colormap: str) -> str:
+        return os.path.join(
+            self.cache_dir, f"{prediction_id}_{size}_{round(alpha * 100)}_{colormap}.jpg"
+        )
+
+    def get_or_render(self, prediction_id: int, image_path: str, cam_grid,
+                      size: int, alpha: float, colormap: str) -> str:
+        """Blocking: return the path of the rendered overlay, rendering it on a miss"""
+        path = self.path(prediction_id, size, alpha, colormap)
+        try:
+            # Touch on every hit so eviction drops the least recently served files
+            os.utime(path)
+            with self._lock:
+                self._hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+
+        overlay = render_overlay(overlay_base(image_path, size), cam_grid, alpha, COLORMAPS[colormap])
+        ok, encoded = cv2.imencode(".jpg", overlay)
+        if not ok:
+            raise ValueError("Could not encode Grad-CAM overlay")
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._renders += 1
+        self._evict()
+        return path
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cache_dir": self.cache_dir,
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "renders": self._renders,
+                "evictions": self._evictions,
+            }
+
+    def _evict(self):
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".jpg")]
+        except OSError:
+            return
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:excess]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                self._evictions += 1
+
+
+gradcam_cache = GradcamCache(settings.GRADCAM_CACHE_DIR, settings.GRADCAM_CACHE_MAX_ENTRIES)
@@ -0,0 +1,169 @@
+"""
+Dynamic micro-batching in front of the shared encoder
+
+Concurrent requests submit preprocessed [1, 3, H, W] tensors; the batcher
+collects up to BATCH_MAX_SIZE items or waits at most BATCH_MAX_WAIT_MS,
+runs one batched forward + similarity matmul on the ML executor and fans
+the per-image results back out to the awaiting requests. Up to
+max_in_flight batches (one per ML executor worker by default) run at
+once; while all are busy, new requests keep filling the next batch.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+import torch
+
+from backend.config import settings
+from backend.executors import ml_executor
+from backend.ml_service import ml_service
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBatcher:
+    def __init__(self, handler, max_batch_size: int, max_wait_ms: float, max_in_flight: int = None):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_in_flight = max_in_flight or ml_executor.max_workers
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        self._in_flight = set()
+        self._batches = 0
+        self._items = 0
+        self._size_counts = Counter()
+        self._latencies_ms = deque(maxlen=1000)
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._in_flight):
+            task.cancel()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def submit(self, item):
+        """Queue one input and wait for its result from the next batch"""
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.max_in_flight)
+        while True:
+            # Take a slot before collecting, so a batch is never held back
+            # after it was formed; while every slot is busy the queue grows
+            # and the next batch is fuller.
+            await slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                slots.release()
+                raise
+            task = asyncio.create_task(self._run_batch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _run_batch(self, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+
+        start = time.perf_counter()
+        try:
+            results = await ml_executor.run(self.handler, items)
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Inference batch of {len(items)} failed: {e}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        self._batches += 1
+        self._items += len(items)
+        self._size_counts[len(items)] += 1
+        self._latencies_ms.append(latency_ms)
+
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies_ms)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)], 2)
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": len(self._in_flight),
+            "queue_depth": self.queue_depth,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+            "batch_size_counts": dict(sorted(self._size_counts.items())),
+            "latency_ms_p50": percentile(0.50),
+            "latency_ms_p99": percentile(0.99),
+        }
+
+
+def classify_batch(tensors):
+    """Run fused classification + Grad-CAM for a list of [1, 3, H, W] tensors"""
+    classifier = ml_service.get_classifier()
+    return classifier.predict_batch_with_cam(
+        torch.cat(tensors), ml_service.get_gradcam(), ml_service.get_threshold()
+    )
+
+
+def label_batch(tensors):
+    """Classification only (no Grad-CAM) for a list of [1, 3, H, W] tensors"""
+    return ml_service.get_classifier().predict_batch(torch.cat(tensors), ml_service.get_threshold())
+
+
+inference_batcher = InferenceBatcher(
+    classify_batch, settings.BATCH_MAX_SIZE, settings.BATCH_MAX_WAIT_MS
+)
+
+# Live camera frames only need labels, so they skip the Grad-CAM backward
+label_batcher = InferenceBatcher(
+    label_batch, settings.BATCH_MAX_SIZE, settings.BATCH_MAX_WAIT_MS
+)
@@ -1,11 +1,34 @@
 import torch
+import torch.nn.functional as F
 import os
-from typing import Dict, Tuple
-from ml.encoder import Encoder
+import threading
+import time
+from typing import Dict, List, Tuple
+from ml.encoder import Encoder, load_encoder
 from ml.classifier import PrototypeClassifier
+from ml.gradcam import GradCAM
+from ml.inference_backends import EagerBackend, load_inference_backend
+from ml.embedding_cache import embed_dataset, embed_files
 from ml.prototypes import compute_prototypes
-from ml.threshold import compute_open_set_threshold
+from ml.prototype_bank import PrototypeBank
+from ml.prototype_stats import PrototypeStats
+from ml.artifacts import (
+    dataset_manifest_hash, load_prototype_artifact, save_prototype_artifact,
+    prototype_version, load_cascade_artifact
+)
+from ml.cascade import CascadeStage, low_res_transform
+from ml.threshold import own_class_similarities
+from ml.transforms import train_transform
 from backend.config import settings
+from backend.result_cache import result_cache
+from backend.edge_sync import prototype_sync
+
+OPEN_SET_PERCENTILE = 0.5
+
+
+def prototype_settings_key() -> str:
+    return f"percentile={OPEN_SET_PERCENTILE};sub_prototypes={settings.PROTOTYPES_PER_CLASS}"
+
 
 class MLService:
     _instance = None
@@ -23,17 +46,61 @@ class MLService:
                 print("CUDA not available, using CPU")
                 self.device = "cpu"
             
+            if settings.TORCH_NUM_THREADS:
+                torch.set_num_threads(settings.TORCH_NUM_THREADS)
+            
+            self.encoder: Encoder = None
+            self.gradcam: GradCAM = None
+            self.inference_backend = None
             self.classifier: PrototypeClassifier = None
             self.prototypes: Dict = None
+            self.prototype_bank: PrototypeBank = None
             self.class_names: Tuple = None
             self.threshold: float = None
+            self.encoder_hash: str = None
+            self.prototype_version: str = None
+            # Running class sums/counts + similarity histogram (mean prototypes only)
+            self.prototype_stats: PrototypeStats = None
+            self.cascade: CascadeStage = None
+            self._update_lock = threading.RLock()
+            self.warmup_status: str = "pending"
+            self.init_failed_at: float = None
             self._initialized = True
     
     def initialize(self):
-        if self.classifier is not None:
-            print("ML models already initialized")
-            return
-        
+        # Request handlers may all hit a cold service at once; load exactly once
+        with self._update_lock:
+            if self.classifier is not None:
+                print("ML models already initialized")
+                return
+            
+            retry_in = self.init_retry_in()
+            if retry_in > 0:
+                raise RuntimeError(f"ML models failed to load; next attempt in {retry_in:.0f}s")
+            try:
+                self._load_models()
+            except Exception:
+                # Don't let every request re-run a load that just failed
+                self.init_failed_at = time.monotonic()
+                raise
+            self.init_failed_at = None
+            
+            # Lazy initialization from a request must also end in a ready (warm) service
+            batch_sizes = sorted({min(size, settings.BATCH_MAX_SIZE) for size in settings.WARMUP_BATCH_SIZES})
+            print(f"Warming up inference path (batch sizes {batch_sizes})")
+            try:
+                self.warmup(batch_sizes, settings.WARMUP_ITERATIONS)
+            except Exception as e:
+                print(f"Warning: warmup failed: {e}")
+            print(f"Warmup {self.warmup_status}")
+    
+    def init_retry_in(self) -> float:
+        """Seconds until initialize() may retry after a failed load (0 if it may run now)"""
+        if self.init_failed_at is None:
+            return 0.0
+        return max(0.0, settings.ML_INIT_RETRY_S - (time.monotonic() - self.init_failed_at))
+    
+    def _load_models(self):
         print("Initializing ML models...")
         
         encoder_path = settings.ENCODER_PATH
@@ -45,26 +112,183 @@ class MLService:
         if not os.path.exists(train_dir):
             raise FileNotFoundError(f"Training data directory not found at {train_dir}")
         
-        # Compute open-set threshold
-        print("Computing open-set threshold...")
-        self.threshold = compute_open_set_threshold(
-            encoder_path, train_dir, self.device, percentile=0.5
-        )
-        print(f"Open-set threshold: {self.threshold:.3f}")
+        print("Loading shared encoder...")
+        gradcam = self._load_encoder(encoder_path)
         
-        print("Computing prototypes...")
-        self.prototypes, self.class_names = compute_prototypes(
-            encoder_path, train_dir, self.device
-        )
+        self._load_or_build_prototypes(encoder_path, train_dir)
+        prototype_bank = PrototypeBank(self.prototypes, self.class_names, self.device)
         print(f"Loaded {len(self.class_names)} disease classes")
+        print(f"Open-set threshold: {self.threshold:.3f}")
+        
+        if settings.CASCADE_ENABLED:
+            self._load_cascade(train_dir)
         
         print("Initializing classifier...")
-        self.classifier = PrototypeClassifier(
-            encoder_path, self.prototypes, self.class_names, self.device
+        classifier = PrototypeClassifier(
+            self.encoder, prototype_bank, self.class_names, self.device,
+            backend=self.inference_backend, cascade=self.cascade
         )
         
+        # Publish together: a non-None classifier means the rest is loaded too
+        self.prototype_version = prototype_version(prototype_bank)
+        self.prototype_bank, self.gradcam, self.classifier = prototype_bank, gradcam, classifier
+        self._publish_edge_prototypes()
+        
         print("ML models initialized successfully!")
     
+    def _load_or_build_prototypes(self, encoder_path: str, train_dir: str):
+        # Prototypes and threshold are persisted next to the encoder and only
+        # rebuilt when the checkpoint, the training set or the settings change.
+        artifact_path = settings.PROTOTYPE_ARTIFACT_PATH
+        manifest_hash = dataset_manifest_hash(train_dir)
+        
+        artifact = load_prototype_artifact(artifact_path, self.encoder_hash, manifest_hash, prototype_settings_key())
+        if artifact is not None:
+            print(f"Loaded prototype artifact from {artifact_path}")
+            self.prototypes = {k: v.to(self.device) for k, v in artifact["prototypes"].items()}
+            self.class_names = artifact["class_names"]
+            self.threshold = artifact["threshold"]
+            if artifact.get("stats") is not None:
+                self.prototype_stats = PrototypeStats.from_state_dict(artifact["stats"])
+            return
+        
+        print("Prototype artifact missing or stale, computing prototypes...")
+        self.prototypes, self.class_names, self.threshold, self.prototype_stats = self._build_prototypes(train_dir)
+        self._save_prototype_artifact(manifest_hash)
+    
+    def _build_prototypes(self, train_dir: str):
+        # Training images are embedded through the on-disk embedding cache,
+        # so only images that are new or changed go through the encoder.
+        embeddings, labels, class_names = embed_dataset(self.encoder, train_dir, self.device, train_transform)
+        
+        stats = None
+        if settings.PROTOTYPES_PER_CLASS == 1:
+            stats = PrototypeStats.from_embeddings(embeddings, labels, class_names)
+            prototypes, _ = stats.prototypes()
+            prototypes = {k: v.to(self.device) for k, v in prototypes.items()}
+        else:
+            prototypes, _ = compute_prototypes(
+                self.encoder, train_dir, self.device, settings.PROTOTYPES_PER_CLASS
+            )
+        
+        # Compute open-set threshold against the same prototypes
+        print("Computing open-set threshold...")
+        similarities = own_class_similarities(
+            PrototypeBank(prototypes, class_names, self.device), embeddings, labels
+        )
+        threshold = torch.quantile(similarities, OPEN_SET_PERCENTILE / 100).item()
+        if stats is not None:
+            stats.histogram.add(similarities)
+        
+        return prototypes, class_names, threshold, stats
+    
+    def _save_prototype_artifact(self, manifest_hash: str):
+        artifact_path = settings.PROTOTYPE_ARTIFACT_PATH
+        try:
+            save_prototype_artifact(
+                artifact_path, self.prototypes, self.class_names, self.threshold,
+                self.encoder_hash, manifest_hash, prototype_settings_key(),
+                stats=self.prototype_stats.state_dict() if self.prototype_stats is not None else None
+            )
+            print(f"Saved prototype artifact to {artifact_path}")
+        except OSError as e:
+            print(f"Warning: could not save prototype artifact: {e}")
+    
+    def _load_cascade(self, train_dir: str):
+        artifact = load_cascade_artifact(settings.CASCADE_ARTIFACT_PATH, self.encoder_hash)
+        if artifact is None:
+            print(f"Warning: no calibrated cascade for this encoder at {settings.CASCADE_ARTIFACT_PATH}; "
+                  "cascade disabled")
+            return
+        
+        # Bounds stay as calibrated; low-res prototypes follow the training set
+        if (artifact["manifest_hash"] != dataset_manifest_hash(train_dir)
+                or artifact["class_names"] != list(self.class_names)):
+            print("Training set changed since calibration, recomputing low-res prototypes...")
+            bank = self._low_res_bank(artifact["size"], train_dir)
+        else:
+            bank = PrototypeBank(artifact["prototypes"], artifact["class_names"], self.device)
+        
+        self.cascade = CascadeStage(
+            bank, artifact["min_score"], artifact["min_margin"], artifact["size"], artifact["escalation_rate"]
+        )
+        print(f"Cascade enabled at {self.cascade.size}px "
+              f"(calibrated escalation rate {self.cascade.calibrated_escalation_rate:.1%})")
+    
+    def _low_res_bank(self, size: int, train_dir: str) -> PrototypeBank:
+        prototypes, class_names = compute_prototypes(
+            self.encoder, train_dir, self.device, transform=low_res_transform(size)
+        )
+        return PrototypeBank(prototypes, class_names, self.device)
+    
+    def _load_encoder(self, encoder_path: str) -> GradCAM:
+        # One encoder instance is shared by classification and Grad-CAM;
+        # GradCAM hooks are registered once here, never per request.
+        # The GradCAM is returned so callers publish it with the classifier.
+        self.encoder = load_encoder(encoder_path, self.device)
+        self.encoder_hash = self.encoder.checkpoint_hash
+        gradcam = GradCAM(self.encoder, self.encoder.feature_extractor[-1])
+        
+        with torch.no_grad():
+            self.encoder(torch.zeros(1, 3, 224, 224, device=self.device))
+        
+        try:
+            self.inference_backend = load_inference_backend(
+                settings.INFERENCE_BACKEND, self.encoder, encoder_path, self.encoder_hash,
+                self.device, settings.TORCH_NUM_THREADS
+            )
+        except Exception as e:
+            print(f"Warning: {settings.INFERENCE_BACKEND} inference backend unavailable ({e}); using eager")
+            self.inference_backend = EagerBackend(self.encoder)
+        print(f"Inference backend: {self.inference_backend.name}")
+        return gradcam
+    
+    @property
+    def encoder_version(self) -> str:
+        return self.encoder_hash[:16] if self.encoder_hash else None
+    
+    @property
+    def model_version(self) -> str:
+        if self.encoder_hash is None or self.prototype_version is None:
+            return None
+        return f"{self.encoder_version}-{self.prototype_version}"
+    
+    @property
+    def is_ready(self) -> bool:
+        return self.classifier is not None and self.warmup_status in ("done", "skipped")
+    
+    def warmup(self, batch_sizes, iterations: int = 1):
+        """
+        Run synthetic batches through the request path (grad-enabled forward,
+        prototype scoring and a Grad-CAM backward) at every batch size the
+        batcher can produce, so allocator growth and kernel selection happen
+        before the first real request.
+        """
+        if iterations <= 0 or not batch_sizes:
+            self.warmup_status = "skipped"
+            return
+        
+        self.warmup_status = "running"
+        try:
+            gradcam = self.get_gradcam()
+            for _ in range(iterations):
+                for batch_size in batch_sizes:
+                    images = torch.randn(batch_size, 3, 224, 224, device=self.device)
+                    if self.inference_backend.name != "eager":
+                        self.inference_backend.embed(images)
+                    with torch.enable_grad():
+                        if self.cascade is not None:
+                            low_res = self.encoder(self.cascade.downscale(images))
+                            gradcam.grids_from_score(low_res.sum())
+                        embeddings = self.encoder(images)
+                        self.prototype_bank.decide(embeddings.detach(), self.threshold)
+                        winners = self.prototype_bank.matrix[:1].expand(batch_size, -1)
+                        gradcam.grids_from_score((F.normalize(embeddings, dim=1) * winners).sum())
+        except Exception:
+            self.warmup_status = "failed"
+            raise
+        self.warmup_status = "done"
+    
     def get_classifier(self) -> PrototypeClassifier:
         if self.classifier is None:
             self.initialize()
@@ -74,20 +298,90 @@ class MLService:
         if self.threshold is None:
             self.initialize()
         return self.threshold
+    
+    def get_gradcam(self) -> GradCAM:
+        if self.gradcam is None:
+            self.initialize()
+        return self.gradcam
 
     def retrain_model(self):
-        print("Retraining model with new data...")
-        self.classifier = None
-        encoder_path = settings.ENCODER_PATH
-        train_dir = settings.TRAIN_DATA_DIR
-        self.prototypes, self.class_names = compute_prototypes(
-            encoder_path, train_dir, self.device
+        """Rebuild prototypes and threshold from the whole training directory"""
+        with self._update_lock:
+            print("Retraining model with new data...")
+            encoder_path = settings.ENCODER_PATH
+            train_dir = settings.TRAIN_DATA_DIR
+            if self.encoder is None:
+                self.gradcam = self._load_encoder(encoder_path)
+            
+            prototypes, class_names, threshold, stats = self._build_prototypes(train_dir)
+            print(f"Reloaded {len(class_names)} disease classes")
+            
+            cascade = self.cascade
+            if cascade is not None:
+                cascade = cascade.with_bank(self._low_res_bank(cascade.size, train_dir))
+            self._swap_model(prototypes, class_names, threshold, stats, cascade)
+            self._save_prototype_artifact(dataset_manifest_hash(train_dir))
+            print("Classifier updated successfully")
+    
+    def add_training_images(self, class_name: str, image_paths: List[str]):
+        """
+        Fold images just added to TRAIN_DATA_DIR/<class_name> into the model.
+        Only these images are embedded: the class mean comes from running
+        sums and counts, and the threshold is read from the similarity
+        histogram, so the cost does not grow with the training set.
+        Similarities of older images are not re-scored against the moved
+        prototype; the next full rebuild (retrain_model, or startup once the
+        training set changed) recomputes everything exactly.
+        """
+        with self._update_lock:
+            if self.classifier is None or self.prototype_stats is None:
+                # Not loaded yet, or sub-prototypes (k-means has no running form)
+                return self.retrain_model()
+            
+            print(f"Adding {len(image_paths)} images to {class_name}...")
+            embeddings = embed_files(self.encoder, image_paths, self.device, train_transform)
+            stats = self.prototype_stats.copy()
+            stats.add(class_name, embeddings)
+            prototypes, class_names = stats.prototypes()
+            prototypes = {k: v.to(self.device) for k, v in prototypes.items()}
+            
+            prototype_bank = PrototypeBank(prototypes, class_names, self.device)
+            labels = torch.full((len(embeddings),), class_names.index(class_name), dtype=torch.long)
+            stats.histogram.add(own_class_similarities(prototype_bank, embeddings, labels))
+            threshold = stats.histogram.quantile(OPEN_SET_PERCENTILE / 100)
+            
+            cascade = self.cascade
+            if cascade is not None:
+                # Low-res prototypes are rebuilt from cached low-res embeddings
+                cascade = cascade.with_bank(self._low_res_bank(cascade.size, settings.TRAIN_DATA_DIR))
+            self._swap_model(prototypes, class_names, threshold, stats, cascade, prototype_bank)
+            print(f"Classifier updated incrementally ({len(class_names)} classes, threshold {threshold:.3f})")
+    
+    def _swap_model(self, prototypes, class_names, threshold, stats, cascade, prototype_bank=None):
+        # Build the new bank/classifier first and swap them in, so requests
+        # in flight never observe a missing classifier.
+        if prototype_bank is None:
+            prototype_bank = PrototypeBank(prototypes, class_names, self.device)
+        classifier = PrototypeClassifier(
+            self.encoder, prototype_bank, class_names, self.device,
+            backend=self.inference_backend, cascade=cascade
         )
-        print(f"Reloaded {len(self.class_names)} disease classes")
+        self.prototypes, self.class_names = prototypes, class_names
+        self.prototype_bank = prototype_bank
+        self.prototype_version = prototype_version(prototype_bank)
+        self.threshold = threshold
+        self.prototype_stats = stats
+        self.cascade = cascade
+        self.classifier = classifier
         
-        self.classifier = PrototypeClassifier(
-            encoder_path, self.prototypes, self.class_names, self.device
+        # Cached results are keyed by model version; drop the stale ones now
+        result_cache.retain_version(self.model_version)
+        self._publish_edge_prototypes()
+
+    def _publish_edge_prototypes(self):
+        prototype_sync.record(
+            self.prototype_bank, self.model_version, self.encoder_version,
+            self.threshold, self.classifier.margin_threshold
         )
-        print("Classifier updated successfully")
 
 ml_service = MLService()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from backend.database import Base
@@ -36,6 +36,7 @@ class Prediction(Base):
     recommended_action = Column(String(100))
     estimated_yield_loss = Column(String(50))
     gradcam_path = Column(String(500))
+    cam_grid = Column(JSON)  # raw Grad-CAM grid; the overlay is rendered on demand
     cam_coverage = Column(Float)
     ai_advisory = Column(Text)
     notes = Column(Text)
@@ -76,3 +77,22 @@ class ReportedCase(Base):
     # Relationships
     prediction = relationship("Prediction")
     user = relationship("User")
+
+
+class Advisory(Base):
+    __tablename__ = "advisories"
+    __table_args__ = (
+        UniqueConstraint(
+            "disease_name", "crop", "disease_stage", "confidence_bucket", "prompt_version",
+            name="uq_advisory_key"
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    disease_name = Column(String(255), nullable=False)
+    crop = Column(String(100), nullable=False)
+    disease_stage = Column(String(50), nullable=False)
+    confidence_bucket = Column(Integer, nullable=False)  # lower edge, in hundredths
+    prompt_version = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,142 @@
+"""
+Content-addressed cache of /diagnosis/predict results
+
+Keys are (model_version, sha256 of the upload bytes), so a re-submitted
+photo skips decoding, inference and the Grad-CAM backward.
+Entries live in a bounded in-memory LRU, optionally backed by JSON files
+under RESULT_CACHE_DIR/<model_version>/. Because the model version is part
+of the key, a retrain that changes the prototypes can never serve a stale
+result; MLService drops entries of older versions when it swaps models.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(self, max_entries: int, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_version: Optional[str] = None
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, image_sha256: str, model_version: str) -> Optional[dict]:
+        if not self.enabled or model_version is None:
+            return None
+
+        key = (model_version, image_sha256)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None and self._artifacts_exist(result):
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return dict(result)
+            self._entries.pop(key, None)
+
+        result = self._read_disk(image_sha256, model_version)
+        if result is not None and self._artifacts_exist(result):
+            self._remember(key, result)
+            with self._lock:
+                self._disk_hits += 1
+            return dict(result)
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, image_sha256: str, model_version: str, result: dict):
+        if not self.enabled or model_version is None:
+            return
+        self._remember((model_version, image_sha256), dict(result))
+        self._write_disk(image_sha256, model_version, result)
+
+    def retain_version(self, model_version: str):
+        """Drop every entry that was not produced by model_version"""
+        with self._lock:
+            if model_version == self._model_version:
+                return
+            previous, self._model_version = self._model_version, model_version
+            for key in [key for key in self._entries if key[0] != model_version]:
+                del self._entries[key]
+
+        if previous is not None:
+            logger.info(f"Model version changed ({previous} -> {model_version}); result cache invalidated")
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for name in os.listdir(self.disk_dir):
+                if name != model_version:
+                    shutil.rmtree(os.path.join(self.disk_dir, name), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_dir": self.disk_dir,
+                "model_version": self._model_version,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": round((self._hits + self._disk_hits) / lookups, 4) if lookups else None,
+            }
+
+    def _remember(self, key, result: dict):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _artifacts_exist(result: dict) -> bool:
+        # A cached (pre-rendered) Grad-CAM path is only useful while the file is still there
+        gradcam_path = result.get("gradcam_path")
+        return not gradcam_path or os.path.exists(gradcam_path)
+
+    def _disk_path(self, image_sha256: str, model_version: str) -> str:
+        return os.path.join(self.disk_dir, model_version, f"{image_sha256}.json")
+
+    def _read_disk(self, image_sha256: str, model_version: str) -> Optional[dict]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(image_sha256, model_version)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable result cache entry: {e}")
+            return None
+
+    def _write_disk(self, image_sha256: str, model_version: str, result: dict):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(image_sha256, model_version)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write result cache entry: {e}")
+
+
+result_cache = ResultCache(settings.RESULT_CACHE_SIZE, settings.RESULT_CACHE_DIR)
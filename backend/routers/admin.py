@@ -7,6 +7,7 @@ from typing import List, Optional
 from backend.database import get_db
 from backend.models import User, Prediction, DiseaseHistory
 from backend.auth_utils import get_current_admin_user
+from backend.advisory_store import advisory_store
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -243,42 +244,66 @@ async def train_new_disease(
     Train the model on a new disease class (Admin Only).
     Workflow:
     1. Save uploaded images to data/fewshot/train/{disease_name}
-    2. Trigger MLService to re-compute prototypes
+    2. Fold the new images into the prototypes and threshold
     """
     import os
-    import shutil
     from backend.config import settings
     from backend.ml_service import ml_service
+    from backend.executors import ml_executor, io_executor, ExecutorSaturatedError
+    from backend.uploads import upload_extension, stage_upload, publish_upload, discard_upload
 
     # 1. Prepare Directory
     # Sanitize disease name (simple alphanumeric check or replace spaces)
     safe_name = "".join(c for c in disease_name if c.isalnum() or c in (' ', '_', '-')).strip()
     class_dir = os.path.join(settings.TRAIN_DATA_DIR, safe_name)
     
-    if os.path.exists(class_dir):
-        # Optional: Decide if we want to add to existing or error out
-        # For now, let's allow adding to existing
-        pass
-    else:
-        os.makedirs(class_dir)
-
-    saved_count = 0
-    for file in files:
-        if file.filename:
-            file_path = os.path.join(class_dir, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            saved_count += 1
-    
-    if saved_count == 0:
-        raise HTTPException(status_code=400, detail="No valid files saved.")
-
-    # 2. Trigger Retraining
+    # Adding to an existing class is allowed
+    created_dir = not os.path.exists(class_dir)
+    os.makedirs(class_dir, exist_ok=True)
+
+    # Stream every upload to a temp file first (size and magic-byte checked)
+    # and publish them only once all are valid, so a bad file never leaves a
+    # half-added class behind in the training set.
+    staged = []
+    try:
+        for file in files:
+            if file.filename:
+                filename = os.path.basename(file.filename)
+                upload_extension(file)
+                tmp_path, _, _ = await io_executor.run(stage_upload, file, class_dir)
+                staged.append((tmp_path, os.path.join(class_dir, filename)))
+        
+        if not staged:
+            raise HTTPException(status_code=400, detail="No valid files saved.")
+    except Exception as e:
+        for tmp_path, _ in staged:
+            discard_upload(tmp_path)
+        if created_dir and not os.listdir(class_dir):
+            os.rmdir(class_dir)
+        if isinstance(e, ExecutorSaturatedError):
+            raise HTTPException(status_code=503, detail=str(e))
+        raise
+
+    # Overwritten files still count in the running sums; those need a full rebuild
+    dest_paths = [dest_path for _, dest_path in staged]
+    replaced = len(set(dest_paths)) < len(dest_paths) or any(os.path.exists(path) for path in dest_paths)
+
+    for tmp_path, dest_path in staged:
+        publish_upload(tmp_path, dest_path)
+    saved_count = len(staged)
+
+    # 2. Update the model (off the event loop); only the new images are embedded
     try:
-        ml_service.retrain_model()
+        if replaced:
+            await ml_executor.run(ml_service.retrain_model)
+        else:
+            await ml_executor.run(ml_service.add_training_images, safe_name, dest_paths)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
 
+    # New classes get their advisories generated in the background
+    advisory_store.schedule_precompute(ml_service.class_names, threshold=ml_service.threshold)
+
     return {
         "message": f"Successfully trained new disease: {safe_name}",
         "images_added": saved_count,
@@ -351,7 +376,7 @@ def approve_report(
     """
     Approve a report:
     1. Move image to few-shot training set (under correct_label)
-    2. Retrain model (update prototypes)
+    2. Fold it into the prototypes and threshold
     3. Update report status
     """
     import os
@@ -381,6 +406,7 @@ def approve_report(
     # We copy instead of move to keep the prediction record valid
     filename = os.path.basename(source_path)
     dest_path = os.path.join(dest_dir, filename)
+    replaced = os.path.exists(dest_path)
     
     try:
         shutil.copy2(source_path, dest_path)
@@ -397,9 +423,12 @@ def approve_report(
         
     db.commit()
     
-    # Trigger Retraining
+    # Update the model with just this image (a replaced file needs a full rebuild)
     try:
-        ml_service.retrain_model()
+        if replaced:
+            ml_service.retrain_model()
+        else:
+            ml_service.add_training_images(safe_label, [dest_path])
     except Exception as e:
         # Note: We don't rollback DB here because the manual work was done, 
         # but we warn the admin.
@@ -407,6 +436,7 @@ def approve_report(
             "message": "Report approved and image saved, BUT model update failed.",
             "error": str(e)
         }
+    advisory_store.schedule_precompute(ml_service.class_names, threshold=ml_service.threshold)
         
     return {"message": f"Report approved. Image added to '{safe_label}' and model updated."}
 
@@ -2,32 +2,45 @@
 Diagnosis Router - Main endpoint for disease detection
 Integrates all ML components: classification, Grad-CAM, AI reasoning, intelligence
 """
+import io
 import os
+import base64
+import binascii
+import json
+import math
+import time
 import uuid
-import cv2
+import asyncio
+import zipfile
+from collections import Counter
 import numpy as np
 import torch
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Header, Response, WebSocket, status
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from PIL import Image
 from pydantic import BaseModel
-from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Union
 import logging
 
 logger = logging.getLogger(__name__)
 
+from backend import database
 from backend.database import get_db
 from backend.models import Prediction, DiseaseHistory
-from backend.auth_utils import get_current_active_user
+from backend.auth_utils import get_current_active_user, authenticate_token
 from backend.ml_service import ml_service
 from backend.config import settings
-from ml.gradcam import GradCAM
-from ml.encoder import Encoder
-from ml.transforms import inference_transform
+from backend.executors import ml_executor, io_executor, ExecutorSaturatedError
+from backend.inference_batcher import inference_batcher, label_batcher
+from backend.uploads import IMAGE_SIGNATURES, upload_extension, store_upload, stage_upload, discard_upload
+from backend.result_cache import result_cache
+from backend.advisory_store import advisory_store
+from backend.advisory_pipeline import advisory_pipeline
+from backend.gradcam_cache import gradcam_cache, COLORMAPS
+from backend.edge_sync import prototype_sync
+from ml.ingest import ingest_image, ingest_frame, hash_distance, InvalidImageError
 from ml.agro_intelligence import assess_disease_intelligence
-from ml.api_reasoner import generate_ai_advisory
+from ml.tiling import TILE_SIZE, TILE_OVERLAP, classify_tiles, decode_for_tiling, tile_grid
 
 router = APIRouter(prefix="/diagnosis", tags=["Disease Diagnosis"])
 
@@ -47,104 +60,307 @@ class DiagnosisResponse(BaseModel):
     gradcam_path: str
     cam_coverage: float
     ai_advisory: str
+    advisory_status: str
     image_filename: str
 
 
-def save_uploaded_file(file: UploadFile, user_id: int) -> tuple[str, str]:
-    """Save uploaded file and return (file_path, filename)"""
-    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-    
-    # Generate unique filename
-    file_ext = os.path.splitext(file.filename)[1]
-    if file_ext.lower() not in settings.ALLOWED_EXTENSIONS:
-        logger.warning(f"Invalid file extension: {file_ext}")
+class EmbeddingDiagnosisRequest(BaseModel):
+    # 128 floats, or base64 of their little-endian float32 / float16 bytes
+    embedding: Union[List[float], str]
+    encoder_version: str
+    # Grad-CAM coverage computed on device, if any (only affects Late staging)
+    cam_coverage: float = 0.0
+    notes: Optional[str] = None
+
+
+class TileResult(BaseModel):
+    row: int
+    column: int
+    x: int
+    y: int
+    disease_name: str
+    confidence_score: float
+    is_unknown: bool
+
+
+class TiledDiagnosisResponse(BaseModel):
+    image_width: int
+    image_height: int
+    tile_size: int
+    stride: int
+    rows: int
+    columns: int
+    tiles: List[TileResult]
+    disease_map: List[List[str]]
+    counts: dict
+    tiles_per_second: float
+
+
+async def ensure_ml_service():
+    """Load the ML models on first use; 503 while they cannot be loaded"""
+    if ml_service.classifier is not None:
+        return
+    retry_in = ml_service.init_retry_in()
+    if retry_in > 0:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid file type. Allowed: {', '.join(settings.ALLOWED_EXTENSIONS)}"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Model not ready",
+            headers={"Retry-After": str(math.ceil(retry_in))}
         )
-    
-    filename = f"{user_id}_{uuid.uuid4()}{file_ext}"
-    file_path = os.path.join(settings.UPLOAD_DIR, filename)
-    
     try:
-        # Save file directly
-        with open(file_path, "wb") as buffer:
-            content = file.file.read()
-            if len(content) > settings.MAX_UPLOAD_SIZE:
-                logger.warning("File too large upload attempt")
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"File too large. Max size: {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB"
-                )
-            buffer.write(content)
-            
-        # Verify it's a real image using PIL
-        try:
-            with Image.open(file_path) as img:
-                img.verify()
-        except Exception:
-            logger.error(f"Invalid image file uploaded: {file.filename}")
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid image file. The file is corrupted or not a valid image."
-            )
-            
+        await ml_executor.run(ml_service.initialize)
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     except Exception as e:
-        logger.error(f"File upload error: {str(e)}")
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        raise e
-    
-    logger.info(f"File saved successfully: {filename}")
-    return file_path, filename
+        logger.error(f"ML models failed to initialize: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Model not ready",
+            headers={"Retry-After": str(math.ceil(settings.ML_INIT_RETRY_S))}
+        )
 
 
-def generate_gradcam(image_path: str, prototype: torch.Tensor, user_id: int) -> tuple[str, float]:
-    """Generate Grad-CAM visualization and return (gradcam_path, cam_coverage)"""
-    os.makedirs(settings.GRADCAM_OUTPUT_DIR, exist_ok=True)
-    
-    device = ml_service.device
-    
-    # Load model
-    model = Encoder()
-    model.load_state_dict(torch.load(settings.ENCODER_PATH, map_location=device))
-    model.to(device)
-    model.eval()
-    
-    # Get target layer
-    target_layer = model.feature_extractor[-1]
-    cam_generator = GradCAM(model, target_layer)
-    
-    # Load and preprocess image
-    image = Image.open(image_path).convert("RGB")
-    input_tensor = inference_transform(image).unsqueeze(0).to(device)
+async def require_ml_service(current_user = Depends(get_current_active_user)):
+    """Route dependency: authenticate first, so anonymous requests never trigger a model load"""
+    await ensure_ml_service()
+    return current_user
+
+
+def save_uploaded_file(file: UploadFile, user_id: int) -> tuple[str, str, str]:
+    """Stream the upload to disk and return (file_path, filename, sha256)"""
+    file_ext = upload_extension(file)
+    filename = f"{user_id}_{uuid.uuid4()}{file_ext}"
+    file_path, sha256 = store_upload(file, settings.UPLOAD_DIR, filename)
+    return file_path, filename, sha256
+
+
+def decode_upload(image_path: str, device: str):
+    """
+    CPU-bound stage: the only decode of the upload on the predict path.
+    Returns the model input tensor; invalid images are rejected here.
+    """
+    try:
+        return ingest_image(image_path, device)
+    except InvalidImageError as e:
+        logger.error(f"Invalid image file uploaded: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid image file. The file is corrupted or not a valid image."
+        )
+
+
+def update_disease_history(db: Session, disease_name: str, confidence_score: float, disease_stage: str):
+    apply_disease_history(db, disease_name, 1, confidence_score, Counter([disease_stage]))
+
+
+def apply_disease_history(db: Session, disease_name: str, detections: int, confidence_sum: float,
+                          stage_counts: Counter):
+    """Add `detections` predictions of one disease to its history row in a single update"""
+    history = db.query(DiseaseHistory).filter(
+        DiseaseHistory.disease_name == disease_name
+    ).first()
     
-    # Generate CAM using prototype similarity
-    cam = cam_generator.generate_from_prototype(input_tensor, prototype)
+    if history:
+        history.avg_confidence = (
+            (history.avg_confidence * history.total_detections + confidence_sum)
+            / (history.total_detections + detections)
+        )
+        history.total_detections += detections
+        history.early_stage_count += stage_counts["Early"]
+        history.mid_stage_count += stage_counts["Mid"]
+        history.late_stage_count += stage_counts["Late"]
+    else:
+        history = DiseaseHistory(
+            disease_name=disease_name,
+            total_detections=detections,
+            avg_confidence=confidence_sum / detections,
+            early_stage_count=stage_counts["Early"],
+            mid_stage_count=stage_counts["Mid"],
+            late_stage_count=stage_counts["Late"]
+        )
+        db.add(history)
+
+
+def save_prediction(db: Session, prediction: Prediction) -> Prediction:
+    """Blocking I/O stage: persist the prediction and update disease history"""
+    db.add(prediction)
+    db.commit()
+    db.refresh(prediction)
     
-    # Filter background noise (thresholding)
-    cam[cam < 0.4] = 0
+    if not prediction.is_unknown:
+        update_disease_history(
+            db, prediction.disease_name, prediction.confidence_score, prediction.disease_stage
+        )
+        db.commit()
     
-    # Calculate coverage (percentage of image with high activation)
-    cam_coverage = float((cam > 0.0).sum() / cam.size)
+    return prediction
+
+
+def store_prediction(prediction: Prediction) -> int:
+    """save_prediction on its own session, for handlers that outlive the request's one"""
+    db = database.SessionLocal()
+    try:
+        return save_prediction(db, prediction).id
+    finally:
+        db.close()
+
+
+def save_prediction_batch(predictions: list) -> list:
+    """
+    Blocking I/O stage for /batch: insert all predictions in one transaction
+    with one DiseaseHistory update per disease. Returns the new ids.
+    """
+    db = database.SessionLocal()
+    try:
+        db.add_all(predictions)
+        db.flush()
+        prediction_ids = [prediction.id for prediction in predictions]
+        
+        totals = {}
+        for prediction in predictions:
+            if prediction.is_unknown:
+                continue
+            detections, confidence_sum, stage_counts = totals.get(
+                prediction.disease_name, (0, 0.0, Counter())
+            )
+            stage_counts[prediction.disease_stage] += 1
+            totals[prediction.disease_name] = (
+                detections + 1, confidence_sum + prediction.confidence_score, stage_counts
+            )
+        for disease_name, (detections, confidence_sum, stage_counts) in totals.items():
+            apply_disease_history(db, disease_name, detections, confidence_sum, stage_counts)
+        
+        db.commit()
+        return prediction_ids
+    finally:
+        db.close()
+
+
+async def classify_upload(image_path: str, classifier, threshold: float):
+    """
+    Decode the stored upload once (this also rejects files that are not
+    decodable images) and run fused classification + Grad-CAM, micro-batched
+    with concurrent requests. Returns (disease_name, confidence_score,
+    cam_grid, cam_coverage); the overlay itself is rendered on demand.
+    """
+    input_tensor = await ml_executor.run(decode_upload, image_path, classifier.device)
+    disease_name, confidence_score, margin, cam, cam_coverage = await inference_batcher.submit(
+        input_tensor
+    )
+    print(f"DEBUG: Prediction: {disease_name}, Confidence: {confidence_score:.4f}, Margin: {margin:.4f}, Threshold: {threshold:.4f}")
+    cam_grid = cam.round(4).tolist() if cam is not None else None
+    return disease_name, confidence_score, cam_grid, cam_coverage
+
+
+def assess_result(disease_name: str, confidence_score: float, cam_coverage: float) -> tuple[str, str, str]:
+    """Disease intelligence assessment: (disease_stage, recommended_action, estimated_yield_loss)"""
+    if disease_name == "UNKNOWN":
+        return "Unknown", "Monitor Only", "Unknown"
+    return assess_disease_intelligence(confidence_score, cam_coverage)
+
+
+async def run_diagnosis(image_path: str, classifier, threshold: float) -> dict:
+    """
+    Model pipeline for one stored upload: classification + Grad-CAM and the
+    intelligence assessment. The advisory is resolved separately.
+    """
+    # 1+2. Fused classification + Grad-CAM (raw grid + coverage only)
+    disease_name, confidence_score, cam_grid, cam_coverage = await classify_upload(
+        image_path, classifier, threshold
+    )
     
-    # Create visualization
-    img_array = np.array(image.resize((224, 224)))
-    img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-    heatmap = cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET)
-    overlay = cv2.addWeighted(img_bgr, 0.6, heatmap, 0.4, 0)
+    # 3. Disease Intelligence Assessment
+    disease_stage, recommended_action, estimated_yield_loss = assess_result(
+        disease_name, confidence_score, cam_coverage
+    )
     
-    # Save Grad-CAM
-    gradcam_filename = f"{user_id}_{uuid.uuid4()}_gradcam.jpg"
-    gradcam_path = os.path.join(settings.GRADCAM_OUTPUT_DIR, gradcam_filename)
-    cv2.imwrite(gradcam_path, overlay)
+    return diagnosis_result(
+        disease_name, confidence_score, disease_stage, recommended_action, estimated_yield_loss,
+        cam_grid, cam_coverage
+    )
+
+
+async def cached_diagnosis(image_path: str, image_sha256: str, classifier, threshold: float,
+                           model_version: str) -> dict:
+    """run_diagnosis behind the result cache: re-submitted photos reuse the stored result"""
+    result = await io_executor.run(result_cache.get, image_sha256, model_version)
+    if result is not None:
+        logger.info(f"Result cache hit for {image_sha256[:16]} ({model_version})")
+        return result
     
-    return gradcam_path, cam_coverage
+    result = await run_diagnosis(image_path, classifier, threshold)
+    await io_executor.run(result_cache.put, image_sha256, model_version, result)
+    return result
+
+
+def diagnosis_result(disease_name, confidence_score, disease_stage, recommended_action,
+                     estimated_yield_loss, cam_grid, cam_coverage) -> dict:
+    return {
+        "disease_name": disease_name,
+        "confidence_score": confidence_score,
+        "is_unknown": disease_name == "UNKNOWN",
+        "disease_stage": disease_stage,
+        "recommended_action": recommended_action,
+        "estimated_yield_loss": estimated_yield_loss,
+        "cam_grid": cam_grid,
+        "cam_coverage": cam_coverage
+    }
+
 
+def gradcam_url(prediction_id: int, result: dict) -> Optional[str]:
+    if result.get("cam_grid") is None and not result.get("gradcam_path"):
+        return None
+    return f"{settings.API_V1_PREFIX}/diagnosis/gradcam/{prediction_id}"
 
-@router.post("/predict", response_model=DiagnosisResponse, status_code=status.HTTP_201_CREATED)
+
+def stored_advisory(result: dict) -> Optional[str]:
+    """Empty for UNKNOWN, the stored advisory if there is one, else None (pending)"""
+    if result["is_unknown"]:
+        return ""
+    return advisory_store.lookup(
+        result["disease_name"], "Unknown", result["disease_stage"], result["confidence_score"]
+    )
+
+
+def build_prediction(user_id: int, image_path: str, filename: str, result: dict,
+                     ai_advisory: Optional[str], notes: Optional[str]) -> Prediction:
+    return Prediction(
+        user_id=user_id,
+        image_path=image_path,
+        image_filename=filename,
+        disease_name=result["disease_name"] if not result["is_unknown"] else None,
+        confidence_score=result["confidence_score"],
+        is_unknown=result["is_unknown"],
+        disease_stage=result["disease_stage"],
+        recommended_action=result["recommended_action"],
+        estimated_yield_loss=result["estimated_yield_loss"],
+        gradcam_path=result.get("gradcam_path"),
+        cam_grid=result.get("cam_grid"),
+        cam_coverage=result["cam_coverage"],
+        ai_advisory=ai_advisory,
+        notes=notes
+    )
+
+
+def prediction_response(prediction_id: int, filename: str, result: dict, ai_advisory: Optional[str]) -> dict:
+    return {
+        "prediction_id": prediction_id,
+        "disease_name": result["disease_name"],
+        "confidence_score": result["confidence_score"],
+        "is_unknown": result["is_unknown"],
+        "disease_stage": result["disease_stage"],
+        "recommended_action": result["recommended_action"],
+        "estimated_yield_loss": result["estimated_yield_loss"],
+        "gradcam_path": gradcam_url(prediction_id, result) or "",
+        "cam_coverage": result["cam_coverage"],
+        "ai_advisory": ai_advisory or "",
+        "advisory_status": "pending" if ai_advisory is None else "ready",
+        "image_filename": filename
+    }
+
+
+@router.post(
+    "/predict", response_model=DiagnosisResponse, status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(require_ml_service)]
+)
 async def predict_disease(
     file: UploadFile = File(...),
     notes: Optional[str] = None,
@@ -154,138 +370,706 @@ async def predict_disease(
     """
     Main disease prediction endpoint
     Integrates: classification, open-set detection, Grad-CAM, AI reasoning, intelligence
+    
+    Blocking stages are awaited on the ML / I/O executors so the event loop
+    keeps serving other requests on this worker.
     """
     
-    # Initialize ML service if needed
     classifier = ml_service.get_classifier()
     threshold = ml_service.get_threshold()
     
-    # Save uploaded file
-    image_path, filename = save_uploaded_file(file, current_user.id)
+    # Stream the upload to disk (bounded memory, magic-byte and size checks)
+    try:
+        image_path, filename, image_sha256 = await io_executor.run(
+            save_uploaded_file, file, current_user.id
+        )
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     
     try:
-        # 1. Disease Classification
-        disease_name, confidence_score = classifier.predict(image_path, threshold)
-        print(f"DEBUG: Prediction: {disease_name}, Confidence: {confidence_score:.4f}, Threshold: {threshold:.4f}")
-        is_unknown = (disease_name == "UNKNOWN")
+        # Re-submitted photos reuse the stored result of the same model version
+        result = await cached_diagnosis(
+            image_path, image_sha256, classifier, threshold, ml_service.model_version
+        )
         
-        # 2. Generate Grad-CAM (only if not unknown)
-        gradcam_path = None
-        cam_coverage = 0.0
+        # 4. AI Advisory (only if not unknown): stored advisories are read
+        # in-process; anything else is generated in the background and the
+        # prediction is saved with ai_advisory = NULL (pending) meanwhile.
+        ai_advisory = stored_advisory(result)
         
-        if not is_unknown:
-            # Find disease label index
-            disease_label = None
-            for idx, name in enumerate(classifier.class_names):
-                if name == disease_name:
-                    disease_label = idx
-                    break
-            
-            if disease_label is not None:
-                # Retrieve the specific prototype for this class
-                prototype = ml_service.prototypes[disease_label]
-                
-                gradcam_path, cam_coverage = generate_gradcam(
-                    image_path, prototype, current_user.id
-                )
+        # 5+6. Save prediction and update disease history
+        prediction = build_prediction(current_user.id, image_path, filename, result, ai_advisory, notes)
+        prediction = await io_executor.run(save_prediction, db, prediction)
         
-        # 3. Disease Intelligence Assessment
-        if is_unknown:
-            disease_stage = "Unknown"
-            recommended_action = "Monitor Only"
-            estimated_yield_loss = "Unknown"
-        else:
-            disease_stage, recommended_action, estimated_yield_loss = assess_disease_intelligence(
-                confidence_score, cam_coverage
+        if ai_advisory is None:
+            advisory_pipeline.schedule(
+                prediction.id, result["disease_name"], "Unknown", result["disease_stage"],
+                result["confidence_score"]
             )
         
-        # 4. AI Advisory (only if not unknown)
-        ai_advisory = ""
-        if not is_unknown:
-            try:
-                ai_advisory = generate_ai_advisory(
-                    disease=disease_name,
-                    crop="Unknown",
-                    confidence=confidence_score,
-                    severity=disease_stage
-                )
-            except Exception as e:
-                ai_advisory = f"AI advisory generation failed: {str(e)}"
-        
-        # 5. Save prediction to database
-        prediction = Prediction(
-            user_id=current_user.id,
-            image_path=image_path,
-            image_filename=filename,
-            disease_name=disease_name if not is_unknown else None,
-            confidence_score=confidence_score,
-            is_unknown=is_unknown,
-            disease_stage=disease_stage,
-            recommended_action=recommended_action,
-            estimated_yield_loss=estimated_yield_loss,
-            gradcam_path=gradcam_path,
-            cam_coverage=cam_coverage,
-            ai_advisory=ai_advisory,
-            notes=notes
+        return prediction_response(prediction.id, filename, result, ai_advisory)
+    
+    except Exception as e:
+        # Clean up uploaded file on error
+        if os.path.exists(image_path):
+            os.remove(image_path)
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, ExecutorSaturatedError):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e)
+            )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Prediction failed: {str(e)}"
         )
-        
-        db.add(prediction)
-        db.commit()
-        db.refresh(prediction)
-        
-        # 6. Update disease history (if not unknown)
-        if not is_unknown:
-            history = db.query(DiseaseHistory).filter(
-                DiseaseHistory.disease_name == disease_name
-            ).first()
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/predict/stream", dependencies=[Depends(require_ml_service)])
+async def predict_disease_stream(
+    file: UploadFile = File(...),
+    notes: Optional[str] = None,
+    current_user = Depends(get_current_active_user)
+):
+    """
+    Streaming variant of /predict (Server-Sent Events)
+    
+    Emits one event per completed stage instead of a single JSON body:
+    accepted -> classification -> assessment -> gradcam -> advisory_token*
+    (or advisory when it is already stored, advisory_failed on error) -> done.
+    Upload validation and overload still fail with a plain 400 / 503 before
+    the stream starts; later failures are reported as an `error` event.
+    """
+    
+    classifier = ml_service.get_classifier()
+    threshold = ml_service.get_threshold()
+    user_id = current_user.id
+    
+    try:
+        image_path, filename, image_sha256 = await io_executor.run(
+            save_uploaded_file, file, user_id
+        )
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    
+    async def events():
+        saved = False
+        try:
+            yield sse_event("accepted", {"image_filename": filename})
             
-            if history:
-                history.total_detections += 1
-                history.avg_confidence = (
-                    (history.avg_confidence * (history.total_detections - 1) + confidence_score) 
-                    / history.total_detections
+            model_version = ml_service.model_version
+            result = await io_executor.run(result_cache.get, image_sha256, model_version)
+            if result is None:
+                disease_name, confidence_score, cam_grid, cam_coverage = await classify_upload(
+                    image_path, classifier, threshold
                 )
-                if disease_stage == "Early":
-                    history.early_stage_count += 1
-                elif disease_stage == "Mid":
-                    history.mid_stage_count += 1
-                elif disease_stage == "Late":
-                    history.late_stage_count += 1
-            else:
-                history = DiseaseHistory(
-                    disease_name=disease_name,
-                    total_detections=1,
-                    avg_confidence=confidence_score,
-                    early_stage_count=1 if disease_stage == "Early" else 0,
-                    mid_stage_count=1 if disease_stage == "Mid" else 0,
-                    late_stage_count=1 if disease_stage == "Late" else 0
+                disease_stage, recommended_action, estimated_yield_loss = assess_result(
+                    disease_name, confidence_score, cam_coverage
                 )
-                db.add(history)
+                result = diagnosis_result(
+                    disease_name, confidence_score, disease_stage, recommended_action,
+                    estimated_yield_loss, cam_grid, cam_coverage
+                )
+                await io_executor.run(result_cache.put, image_sha256, model_version, result)
+            
+            yield sse_event("classification", {
+                "disease_name": result["disease_name"],
+                "confidence_score": result["confidence_score"],
+                "is_unknown": result["is_unknown"]
+            })
+            yield sse_event("assessment", {
+                "disease_stage": result["disease_stage"],
+                "recommended_action": result["recommended_action"],
+                "estimated_yield_loss": result["estimated_yield_loss"],
+                "cam_coverage": result["cam_coverage"]
+            })
             
-            db.commit()
+            ai_advisory = stored_advisory(result)
+            prediction = build_prediction(user_id, image_path, filename, result, ai_advisory, notes)
+            prediction_id = await io_executor.run(store_prediction, prediction)
+            saved = True
+            
+            yield sse_event("gradcam", {
+                "prediction_id": prediction_id,
+                "gradcam_url": gradcam_url(prediction_id, result)
+            })
+            
+            # Advisory tokens are forwarded as the LLM produces them
+            if ai_advisory is not None:
+                yield sse_event("advisory", {"content": ai_advisory})
+            else:
+                try:
+                    async for chunk in advisory_pipeline.stream(
+                        prediction_id, result["disease_name"], "Unknown", result["disease_stage"],
+                        result["confidence_score"]
+                    ):
+                        yield sse_event("advisory_token", {"content": chunk})
+                except Exception as e:
+                    logger.warning(f"Streamed advisory for prediction {prediction_id} failed: {e}")
+                    yield sse_event("advisory_failed", {"detail": str(e)})
+            
+            yield sse_event("done", {"prediction_id": prediction_id})
         
-        return {
-            "prediction_id": prediction.id,
-            "disease_name": disease_name,
-            "confidence_score": confidence_score,
-            "is_unknown": is_unknown,
-            "disease_stage": disease_stage,
-            "recommended_action": recommended_action,
-            "estimated_yield_loss": estimated_yield_loss,
-            "gradcam_path": gradcam_path or "",
-            "cam_coverage": cam_coverage,
-            "ai_advisory": ai_advisory,
-            "image_filename": filename
-        }
+        except Exception as e:
+            # Clean up uploaded file unless a prediction references it
+            if not saved and os.path.exists(image_path):
+                os.remove(image_path)
+            if isinstance(e, HTTPException):
+                detail = e.detail
+            elif isinstance(e, ExecutorSaturatedError):
+                detail = str(e)
+            else:
+                logger.error(f"Streaming prediction failed: {e}")
+                detail = f"Prediction failed: {str(e)}"
+            yield sse_event("error", {"detail": detail})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def parse_embedding(embedding: Union[List[float], str], dim: int) -> torch.Tensor:
+    """Decode a client embedding to a [1, dim] tensor, rejecting bad shapes and values"""
+    if isinstance(embedding, str):
+        try:
+            raw = base64.b64decode(embedding, validate=True)
+        except binascii.Error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid base64 embedding")
+        dtypes = {4 * dim: "<f4", 2 * dim: "<f2"}
+        if len(raw) not in dtypes:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Embedding must be {dim} float32 or float16 values"
+            )
+        values = np.frombuffer(raw, dtype=dtypes[len(raw)]).astype(np.float32)
+    else:
+        values = np.asarray(embedding, dtype=np.float32)
+    
+    if values.shape != (dim,):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Embedding must have {dim} values, got {values.size}"
+        )
+    if not np.isfinite(values).all() or not values.any():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Embedding has invalid values")
+    return torch.from_numpy(values).unsqueeze(0)
+
+
+@router.post(
+    "/predict/embedding", response_model=DiagnosisResponse, status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(require_ml_service)]
+)
+async def predict_disease_from_embedding(
+    request: EmbeddingDiagnosisRequest,
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Disease prediction from an embedding computed on the client
+    
+    For edge clients that run the encoder locally: only the embedding (and
+    the encoder version that produced it) is sent, and the open-set
+    prototype matching runs here. Embeddings from another encoder version
+    are rejected with 409. There is no image, so there is no Grad-CAM; the
+    photo can be attached later with POST /diagnosis/predict/{id}/image.
+    """
+    
+    classifier = ml_service.get_classifier()
+    threshold = ml_service.get_threshold()
+    
+    if request.encoder_version != ml_service.encoder_version:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Embedding was produced by encoder {request.encoder_version}; "
+                   f"this server runs {ml_service.encoder_version}"
+        )
+    if not 0.0 <= request.cam_coverage <= 1.0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="cam_coverage must be in [0, 1]")
     
+    embedding = parse_embedding(request.embedding, classifier.bank.embedding_dim)
+    disease_name, confidence_score, margin = classifier.predict_embeddings(
+        embedding.to(classifier.device), threshold
+    )[0]
+    logger.debug(
+        f"Embedding prediction: {disease_name}, confidence {confidence_score:.4f}, "
+        f"margin {margin:.4f}, threshold {threshold:.4f}"
+    )
+    
+    cam_coverage = request.cam_coverage if disease_name != "UNKNOWN" else 0.0
+    disease_stage, recommended_action, estimated_yield_loss = assess_result(
+        disease_name, confidence_score, cam_coverage
+    )
+    result = diagnosis_result(
+        disease_name, confidence_score, disease_stage, recommended_action, estimated_yield_loss,
+        None, cam_coverage
+    )
+    
+    ai_advisory = stored_advisory(result)
+    # image_path is NOT NULL; "" marks a prediction whose photo has not been uploaded
+    prediction = build_prediction(current_user.id, "", None, result, ai_advisory, request.notes)
+    try:
+        prediction = await io_executor.run(save_prediction, db, prediction)
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    
+    if ai_advisory is None:
+        advisory_pipeline.schedule(
+            prediction.id, result["disease_name"], "Unknown", result["disease_stage"],
+            result["confidence_score"]
+        )
+    
+    return prediction_response(prediction.id, "", result, ai_advisory)
+
+
+@router.post("/predict/{prediction_id}/image")
+def attach_prediction_image(
+    prediction_id: int,
+    file: UploadFile = File(...),
+    current_user = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Deferred photo upload for a prediction made with /predict/embedding"""
+    prediction = db.query(Prediction).filter(
+        Prediction.id == prediction_id,
+        Prediction.user_id == current_user.id
+    ).first()
+    
+    if not prediction:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Prediction not found"
+        )
+    if prediction.image_path:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Prediction already has an image"
+        )
+    
+    image_path, filename, _ = save_uploaded_file(file, current_user.id)
+    
+    # Only the first of concurrent attaches may claim the prediction
+    updated = db.query(Prediction).filter(
+        Prediction.id == prediction_id,
+        Prediction.image_path == ""
+    ).update(
+        {Prediction.image_path: image_path, Prediction.image_filename: filename},
+        synchronize_session=False
+    )
+    db.commit()
+    if not updated:
+        discard_upload(image_path)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Prediction already has an image"
+        )
+    
+    return {"prediction_id": prediction_id, "image_filename": filename}
+
+
+def batch_sources(files: Optional[List[UploadFile]], archive: Optional[UploadFile]):
+    """
+    Validate a /batch request before streaming starts. Returns (sources,
+    zip_file): uploads as-is, or the image members of the zip archive.
+    """
+    sources = list(files or [])
+    zip_file = None
+    if archive is not None:
+        if os.path.splitext(archive.filename or "")[1].lower() != ".zip":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid archive type. Allowed: .zip"
+            )
+        try:
+            zip_file = zipfile.ZipFile(archive.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid archive. The file is corrupted or not a zip archive."
+            )
+        sources += [
+            info for info in zip_file.infolist()
+            if not info.is_dir()
+            and not os.path.basename(info.filename).startswith(".")
+            and not info.filename.startswith("__MACOSX/")
+            and os.path.splitext(info.filename)[1].lower() in settings.ALLOWED_EXTENSIONS
+        ]
+    
+    if not sources or len(sources) > settings.BATCH_UPLOAD_MAX_FILES:
+        if zip_file is not None:
+            zip_file.close()
+        if not sources:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No images to diagnose")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many images. Max per batch: {settings.BATCH_UPLOAD_MAX_FILES}"
+        )
+    return sources, zip_file
+
+
+def save_batch_source(source, zip_file: Optional[zipfile.ZipFile], user_id: int) -> tuple[str, str, str]:
+    """Stream one upload or zip member to disk; same checks as /predict"""
+    if zip_file is None:
+        return save_uploaded_file(source, user_id)
+    with zip_file.open(source) as member:
+        return save_uploaded_file(
+            UploadFile(member, filename=os.path.basename(source.filename)), user_id
+        )
+
+
+async def diagnose_batch_item(index: int, source, zip_file, classifier, threshold: float,
+                              model_version: str, user_id: int):
+    """One /batch image: store, then cached result or micro-batched inference"""
+    name = source.filename
+    image_path = None
+    try:
+        image_path, filename, image_sha256 = await io_executor.run(
+            save_batch_source, source, zip_file, user_id
+        )
+        result = await cached_diagnosis(image_path, image_sha256, classifier, threshold, model_version)
+        return index, name, image_path, filename, result, None
     except Exception as e:
-        # Clean up uploaded file on error
-        if os.path.exists(image_path):
+        if image_path and os.path.exists(image_path):
             os.remove(image_path)
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        return index, name, None, None, None, detail
+
+
+@router.post("/batch", dependencies=[Depends(require_ml_service)])
+async def predict_disease_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    notes: Optional[str] = None,
+    current_user = Depends(get_current_active_user)
+):
+    """
+    Batch disease prediction for field surveys: many `files` and/or a zip `archive`
+    
+    Streams one NDJSON line per image as results complete (the /predict
+    response plus `index` and `filename`, or `error` for a rejected image),
+    then a final summary line. At most BATCH_UPLOAD_CONCURRENCY images are
+    in flight, so their forwards share micro-batches on the encoder while
+    memory stays bounded; predictions are inserted BATCH_DB_FLUSH_SIZE at a
+    time with one DiseaseHistory update per disease per insert.
+    """
+    
+    classifier = ml_service.get_classifier()
+    threshold = ml_service.get_threshold()
+    model_version = ml_service.model_version
+    user_id = current_user.id
+    
+    sources, zip_file = batch_sources(files, archive)
+    
+    async def results():
+        pending = set()
+        completed = []
+        next_index = 0
+        succeeded = failed = 0
+        try:
+            while next_index < len(sources) or pending:
+                while next_index < len(sources) and len(pending) < settings.BATCH_UPLOAD_CONCURRENCY:
+                    pending.add(asyncio.create_task(diagnose_batch_item(
+                        next_index, sources[next_index], zip_file, classifier, threshold,
+                        model_version, user_id
+                    )))
+                    next_index += 1
+                
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, name, image_path, filename, result, error = task.result()
+                    if error is not None:
+                        failed += 1
+                        yield json.dumps({"index": index, "filename": name, "error": error}) + "\n"
+                    else:
+                        completed.append((index, name, image_path, filename, result))
+                
+                finished = next_index == len(sources) and not pending
+                if completed and (len(completed) >= settings.BATCH_DB_FLUSH_SIZE or finished):
+                    flushed, completed = completed, []
+                    advisories = [stored_advisory(result) for _, _, _, _, result in flushed]
+                    predictions = [
+                        build_prediction(user_id, image_path, filename, result, ai_advisory, notes)
+                        for (_, _, image_path, filename, result), ai_advisory in zip(flushed, advisories)
+                    ]
+                    prediction_ids = await io_executor.run(save_prediction_batch, predictions)
+                    
+                    for (index, name, _, filename, result), ai_advisory, prediction_id in zip(
+                        flushed, advisories, prediction_ids
+                    ):
+                        if ai_advisory is None:
+                            advisory_pipeline.schedule(
+                                prediction_id, result["disease_name"], "Unknown", result["disease_stage"],
+                                result["confidence_score"]
+                            )
+                        succeeded += 1
+                        response = prediction_response(prediction_id, filename, result, ai_advisory)
+                        yield json.dumps({"index": index, "filename": name, **response}) + "\n"
+            
+            yield json.dumps({"summary": {"total": len(sources), "succeeded": succeeded, "failed": failed}}) + "\n"
+        
+        except Exception as e:
+            logger.error(f"Batch prediction failed: {e}")
+            yield json.dumps({"error": f"Batch prediction failed: {str(e)}"}) + "\n"
+        
+        finally:
+            # Client went away or the batch failed: stop the remaining work and
+            # drop uploads that never made it into a prediction
+            for task in pending:
+                task.cancel()
+            for _, _, image_path, _, _ in completed:
+                if os.path.exists(image_path):
+                    os.remove(image_path)
+            if zip_file is not None:
+                zip_file.close()
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+def diagnose_tiles(image_path: str, classifier, threshold: float, tile_size: int, overlap: float) -> dict:
+    """CPU-bound stage for /predict/tiled: decode the frame once and classify every tile"""
+    try:
+        image = decode_for_tiling(image_path)
+    except InvalidImageError as e:
+        logger.error(f"Invalid image file uploaded: {e}")
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Prediction failed: {str(e)}"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid image file. The file is corrupted or not a valid image."
         )
+    
+    xs, ys, _, _ = tile_grid(image.width, image.height, tile_size, overlap)
+    if len(xs) * len(ys) > settings.TILED_MAX_TILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many tiles ({len(xs) * len(ys)}). Max: {settings.TILED_MAX_TILES}; use a larger tile_size"
+        )
+    
+    start = time.perf_counter()
+    tiles, xs, ys, tile_size, stride = classify_tiles(
+        classifier, image, threshold, tile_size, overlap, settings.TILE_BATCH_SIZE
+    )
+    elapsed = time.perf_counter() - start
+    
+    names = [name for _, _, name, _ in tiles]
+    return {
+        "image_width": image.width,
+        "image_height": image.height,
+        "tile_size": tile_size,
+        "stride": stride,
+        "rows": len(ys),
+        "columns": len(xs),
+        "tiles": [
+            {
+                "row": i // len(xs),
+                "column": i % len(xs),
+                "x": x,
+                "y": y,
+                "disease_name": name,
+                "confidence_score": score,
+                "is_unknown": name == "UNKNOWN"
+            }
+            for i, (x, y, name, score) in enumerate(tiles)
+        ],
+        "disease_map": [names[row * len(xs):(row + 1) * len(xs)] for row in range(len(ys))],
+        "counts": dict(Counter(names).most_common()),
+        "tiles_per_second": round(len(tiles) / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+
+@router.post(
+    "/predict/tiled", response_model=TiledDiagnosisResponse,
+    dependencies=[Depends(require_ml_service)]
+)
+async def predict_disease_tiled(
+    file: UploadFile = File(...),
+    tile_size: int = Query(TILE_SIZE, ge=64, le=4096),
+    overlap: float = Query(TILE_OVERLAP, ge=0.0, le=0.75),
+    current_user = Depends(get_current_active_user)
+):
+    """
+    Tiled disease mapping for drone / high-resolution canopy frames
+    
+    Splits the frame into overlapping tile_size px tiles (leaf scale in the
+    source image), classifies each against the prototype bank and returns a
+    per-tile disease map with aggregate counts. Nothing is stored: the upload
+    is only staged for the duration of the request.
+    """
+    
+    classifier = ml_service.get_classifier()
+    threshold = ml_service.get_threshold()
+    
+    upload_extension(file)
+    tmp_path = None
+    try:
+        tmp_path, _, _ = await io_executor.run(
+            stage_upload, file, settings.UPLOAD_DIR, settings.TILED_MAX_UPLOAD_SIZE
+        )
+        return await ml_executor.run(diagnose_tiles, tmp_path, classifier, threshold, tile_size, overlap)
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    finally:
+        if tmp_path is not None:
+            discard_upload(tmp_path)
+
+
+def websocket_user_id(token: str) -> int:
+    db = database.SessionLocal()
+    try:
+        return authenticate_token(token, db).id
+    finally:
+        db.close()
+
+
+@router.websocket("/live")
+async def live_diagnosis(websocket: WebSocket, token: str = ""):
+    """
+    Live camera diagnosis over a WebSocket (/diagnosis/live?token=<access token>)
+    
+    Authenticates once, then accepts binary JPEG/PNG frames and answers each
+    classified frame with {"type": "result", ...}. A frame within
+    LIVE_DEDUP_DISTANCE bits of the last classified frame's perceptual hash
+    reuses its label instead of running the encoder, and when frames arrive
+    faster than they are classified only the newest is kept. Nothing is
+    stored until the client sends {"type": "capture", "notes": ...}, which
+    runs the full /predict pipeline on the newest frame and saves a Prediction.
+    """
+    try:
+        user_id = await io_executor.run(websocket_user_id, token)
+    except (HTTPException, ExecutorSaturatedError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    try:
+        await ensure_ml_service()
+    except HTTPException:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    await websocket.accept()
+    
+    classifier = ml_service.get_classifier()
+    threshold = ml_service.get_threshold()
+    
+    send_lock = asyncio.Lock()
+    frame_ready = asyncio.Event()
+    state = {
+        "pending": None, "newest": None, "hash": None, "label": None, "score": None,
+        "received": 0, "classified": 0, "duplicates": 0, "dropped": 0
+    }
+    
+    async def send(payload: dict):
+        async with send_lock:
+            await websocket.send_json(payload)
+    
+    async def classify_frames():
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            sequence, frame = state["pending"]
+            start = time.perf_counter()
+            try:
+                input_tensor, frame_hash = await ml_executor.run(ingest_frame, frame, classifier.device)
+                duplicate = (
+                    state["hash"] is not None
+                    and hash_distance(frame_hash, state["hash"]) <= settings.LIVE_DEDUP_DISTANCE
+                )
+                if duplicate:
+                    state["duplicates"] += 1
+                else:
+                    label, score, _ = await label_batcher.submit(input_tensor)
+                    state.update(hash=frame_hash, label=label, score=score)
+                    state["classified"] += 1
+            except Exception as e:
+                # Keep the stream alive; one bad frame only costs its own result
+                if isinstance(e, InvalidImageError):
+                    detail = "Invalid image file. The file is corrupted or not a valid image."
+                else:
+                    detail = str(e)
+                await send({"type": "error", "frame": sequence, "detail": detail})
+                continue
+            
+            state["newest"] = frame
+            await send({
+                "type": "result",
+                "frame": sequence,
+                "disease_name": state["label"],
+                "confidence_score": state["score"],
+                "is_unknown": state["label"] == "UNKNOWN",
+                "duplicate": duplicate,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1)
+            })
+    
+    async def capture(notes: Optional[str]):
+        frame = state["newest"]
+        if frame is None:
+            await send({"type": "error", "detail": "No frame to capture yet"})
+            return
+        
+        extension = ".png" if frame.startswith(IMAGE_SIGNATURES[1]) else ".jpg"
+        upload = UploadFile(io.BytesIO(frame), filename=f"capture{extension}")
+        image_path = None
+        try:
+            image_path, filename, image_sha256 = await io_executor.run(save_uploaded_file, upload, user_id)
+            result = await cached_diagnosis(
+                image_path, image_sha256, classifier, threshold, ml_service.model_version
+            )
+            ai_advisory = stored_advisory(result)
+            prediction = build_prediction(user_id, image_path, filename, result, ai_advisory, notes)
+            prediction_id = await io_executor.run(store_prediction, prediction)
+        except Exception as e:
+            if image_path and os.path.exists(image_path):
+                os.remove(image_path)
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            await send({"type": "error", "detail": f"Capture failed: {detail}"})
+            return
+        
+        if ai_advisory is None:
+            advisory_pipeline.schedule(
+                prediction_id, result["disease_name"], "Unknown", result["disease_stage"],
+                result["confidence_score"]
+            )
+        await send({"type": "captured", **prediction_response(prediction_id, filename, result, ai_advisory)})
+    
+    worker = asyncio.create_task(classify_frames())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            frame = message.get("bytes")
+            if frame is not None:
+                state["received"] += 1
+                if len(frame) > settings.LIVE_MAX_FRAME_SIZE or not frame.startswith(IMAGE_SIGNATURES):
+                    await send({
+                        "type": "error", "frame": state["received"],
+                        "detail": "Frames must be JPEG or PNG images under "
+                                  f"{settings.LIVE_MAX_FRAME_SIZE / 1024 / 1024}MB"
+                    })
+                    continue
+                if frame_ready.is_set():
+                    state["dropped"] += 1
+                state["pending"] = (state["received"], frame)
+                frame_ready.set()
+                continue
+            
+            try:
+                command = json.loads(message.get("text") or "")
+            except ValueError:
+                command = {}
+            if command.get("type") == "capture":
+                await capture(command.get("notes"))
+            elif command.get("type") == "stats":
+                await send({"type": "stats", **{
+                    key: state[key] for key in ("received", "classified", "duplicates", "dropped")
+                }})
+            else:
+                await send({"type": "error", "detail": "Unknown command. Use capture or stats"})
+    finally:
+        worker.cancel()
 
 
 @router.get("/history")
@@ -309,7 +1093,7 @@ def get_prediction_detail(
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """Get detailed prediction information"""
+    """Get detailed prediction information; ai_advisory is null while the advisory is pending"""
     prediction = db.query(Prediction).filter(
         Prediction.id == prediction_id,
         Prediction.user_id == current_user.id
@@ -327,10 +1111,16 @@ def get_prediction_detail(
 @router.get("/gradcam/{prediction_id}")
 def get_gradcam_image(
     prediction_id: int,
+    size: int = Query(224, ge=64, le=1024),
+    alpha: float = Query(0.4, ge=0.0, le=1.0),
+    colormap: str = "jet",
     current_user = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """Get Grad-CAM visualization image"""
+    """
+    Get Grad-CAM visualization image
+    Rendered from the stored CAM grid on first access, then served from the cache
+    """
     prediction = db.query(Prediction).filter(
         Prediction.id == prediction_id,
         Prediction.user_id == current_user.id
@@ -342,13 +1132,31 @@ def get_gradcam_image(
             detail="Prediction not found"
         )
     
-    if not prediction.gradcam_path or not os.path.exists(prediction.gradcam_path):
+    if colormap not in COLORMAPS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid colormap. Allowed: {', '.join(COLORMAPS)}"
+        )
+    
+    if prediction.cam_grid is not None and prediction.image_path and os.path.exists(prediction.image_path):
+        try:
+            gradcam_path = gradcam_cache.get_or_render(
+                prediction.id, prediction.image_path, prediction.cam_grid, size, alpha, colormap
+            )
+        except InvalidImageError as e:
+            logger.error(f"Could not render Grad-CAM for prediction {prediction.id}: {e}")
+            gradcam_path = None
+    else:
+        # Predictions made before on-demand rendering have a pre-rendered overlay
+        gradcam_path = prediction.gradcam_path
+    
+    if not gradcam_path or not os.path.exists(gradcam_path):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Grad-CAM image not available"
         )
     
-    return FileResponse(prediction.gradcam_path, media_type="image/jpeg")
+    return FileResponse(gradcam_path, media_type="image/jpeg")
 
 
 @router.get("/image/{prediction_id}")
@@ -379,6 +1187,84 @@ def get_uploaded_image(
     return FileResponse(prediction.image_path, media_type="image/jpeg")
 
 
+def etag_version(if_none_match: Optional[str]) -> Optional[str]:
+    """Model version a device sent back in If-None-Match (first tag only)"""
+    if not if_none_match:
+        return None
+    tag = if_none_match.split(",")[0].strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    return tag.strip('"') or None
+
+
+def latest_edge_bundle(encoder_version: str) -> Optional[str]:
+    """Newest bundle in EDGE_BUNDLE_DIR built for the running encoder"""
+    if not os.path.isdir(settings.EDGE_BUNDLE_DIR):
+        return None
+    prefix = f"edge_bundle-{encoder_version}-"
+    paths = [
+        os.path.join(settings.EDGE_BUNDLE_DIR, name)
+        for name in os.listdir(settings.EDGE_BUNDLE_DIR)
+        if name.startswith(prefix) and name.endswith(".zip")
+    ]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+@router.get("/edge/prototypes", dependencies=[Depends(require_ml_service)])
+async def get_edge_prototypes(
+    if_none_match: Optional[str] = Header(None),
+    current_user = Depends(get_current_active_user)
+):
+    """
+    Prototype table for edge devices, versioned by ETag
+    
+    Send the version of the table (or bundle) the device holds in
+    If-None-Match: 304 if it is current, otherwise only the class rows that
+    changed since that version (delta=true), or the full table if that
+    version is unknown. Rows are base64 little-endian float16, one row of
+    embedding_dim values per prototype. A different encoder_version means
+    the device needs a new bundle from /diagnosis/edge/bundle.
+    """
+    
+    since = etag_version(if_none_match)
+    if prototype_sync.not_modified(since):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": f'"{since}"'})
+    
+    table = prototype_sync.table(since)
+    if table is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Model not ready")
+    return JSONResponse(table, headers={"ETag": f'"{table["version"]}"'})
+
+
+@router.get("/edge/bundle", dependencies=[Depends(require_ml_service)])
+async def get_edge_bundle(
+    if_none_match: Optional[str] = Header(None),
+    current_user = Depends(get_current_active_user)
+):
+    """
+    Download the edge bundle (TorchScript Lite encoder + float16 prototypes)
+    
+    Bundles are built offline with python -m ml.edge_bundle. The ETag is the
+    bundle's model version; its prototypes may be older than the server's,
+    in which case /diagnosis/edge/prototypes brings them up to date.
+    """
+    
+    bundle_path = latest_edge_bundle(ml_service.encoder_version)
+    if bundle_path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No edge bundle for encoder {ml_service.encoder_version}"
+        )
+    
+    version = os.path.basename(bundle_path)[len("edge_bundle-"):-len(".zip")]
+    if etag_version(if_none_match) == version:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": f'"{version}"'})
+    return FileResponse(
+        bundle_path, media_type="application/zip",
+        filename=os.path.basename(bundle_path), headers={"ETag": f'"{version}"'}
+    )
+
+
 class ReportRequest(BaseModel):
     prediction_id: int
     proposed_label: Optional[str] = None
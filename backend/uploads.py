@@ -0,0 +1,98 @@
+"""
+Streaming upload storage shared by /diagnosis/predict and /admin/train
+
+Uploads are copied in fixed-size chunks to a hidden temp file next to their
+destination while being hashed and size-checked, then published with an
+atomic rename. Peak memory per upload is one chunk, whatever the file size,
+and a rejected or interrupted upload never leaves a partial file behind.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile, status
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Leading bytes of the formats allowed by settings.ALLOWED_EXTENSIONS
+IMAGE_SIGNATURES = (
+    b"\xff\xd8\xff",          # JPEG
+    b"\x89PNG\r\n\x1a\n",     # PNG
+)
+SIGNATURE_LENGTH = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+
+def upload_extension(file: UploadFile) -> str:
+    file_ext = os.path.splitext(file.filename or "")[1]
+    if file_ext.lower() not in settings.ALLOWED_EXTENSIONS:
+        logger.warning(f"Invalid file extension: {file_ext}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid file type. Allowed: {', '.join(settings.ALLOWED_EXTENSIONS)}"
+        )
+    return file_ext
+
+
+def stage_upload(file: UploadFile, dest_dir: str, max_size: Optional[int] = None) -> tuple[str, str, int]:
+    """
+    Stream the upload into a temp file in dest_dir and return
+    (tmp_path, sha256, size). Aborts as soon as the body exceeds max_size
+    (default MAX_UPLOAD_SIZE) or does not start with a JPEG/PNG signature.
+    """
+    max_size = max_size or settings.MAX_UPLOAD_SIZE
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            header = file.file.read(SIGNATURE_LENGTH)
+            if not header.startswith(IMAGE_SIGNATURES):
+                logger.warning(f"Rejected upload without an image signature: {file.filename}")
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid image file. The file is corrupted or not a valid image."
+                )
+
+            chunk = header
+            while chunk:
+                size += len(chunk)
+                if size > max_size:
+                    logger.warning("File too large upload attempt")
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"File too large. Max size: {max_size / 1024 / 1024}MB"
+                    )
+                digest.update(chunk)
+                buffer.write(chunk)
+                chunk = file.file.read(settings.UPLOAD_CHUNK_SIZE)
+    except Exception:
+        discard_upload(tmp_path)
+        raise
+
+    return tmp_path, digest.hexdigest(), size
+
+
+def publish_upload(tmp_path: str, dest_path: str) -> str:
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+
+def discard_upload(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def store_upload(file: UploadFile, dest_dir: str, filename: str) -> tuple[str, str]:
+    """Stage, validate and atomically publish one upload; returns (file_path, sha256)"""
+    tmp_path, sha256, _ = stage_upload(file, dest_dir)
+    file_path = publish_upload(tmp_path, os.path.join(dest_dir, filename))
+    logger.info(f"File saved successfully: {filename} (sha256 {sha256[:16]})")
+    return file_path, sha256
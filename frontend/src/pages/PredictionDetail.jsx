@@ -33,7 +33,7 @@ export default function PredictionDetail() {
         console.error('Failed to load uploaded image:', error)
       }
 
-      if (response.data.gradcam_path) {
+      if (response.data.cam_grid || response.data.gradcam_path) {
         try {
           const gradcamResponse = await api.get(`/diagnosis/gradcam/${id}`, {
             responseType: 'blob'
@@ -1,5 +1,5 @@
 import os
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 
 api_key = os.getenv("OPENAI_API_KEY", "")
 if not api_key:
@@ -11,18 +11,18 @@ if not api_key:
         api_key = ""
 
 client = OpenAI(api_key=api_key) if api_key else None
+# Used by the background advisory pipeline, which applies its own timeouts and retries
+async_client = AsyncOpenAI(api_key=api_key, max_retries=0) if api_key else None
 
-def generate_ai_advisory(
-    disease,
-    crop,
-    confidence,
-    severity
-):
-    
-    if not client or not api_key:
-        return "AI advisory feature requires OPENAI_API_KEY to be set in environment variables."
+# Bump whenever the prompt or model below changes; stored advisories are keyed on it
+ADVISORY_PROMPT_VERSION = 1
+ADVISORY_MODEL = "gpt-4o-mini"
 
-    prompt = f"""
+def advisory_available():
+    return bool(client and api_key)
+
+def build_advisory_prompt(disease, crop, confidence, severity):
+    return f"""
 You are an expert agricultural plant pathologist.
 
 Disease detected: {disease}
@@ -44,13 +44,58 @@ Respond ONLY for this disease.
 Avoid generic explanations.
 """
 
+def _advisory_messages(prompt):
+    return [
+        {"role": "system", "content": "You are an agricultural advisory AI."},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_ai_advisory(
+    disease,
+    crop,
+    confidence,
+    severity
+):
+    
+    if not advisory_available():
+        return "AI advisory feature requires OPENAI_API_KEY to be set in environment variables."
+
+    prompt = build_advisory_prompt(disease, crop, confidence, severity)
+
     response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an agricultural advisory AI."},
-            {"role": "user", "content": prompt}
-        ],
+        model=ADVISORY_MODEL,
+        messages=_advisory_messages(prompt),
         temperature=0.4
     )
 
     return response.choices[0].message.content.strip()
+
+async def generate_ai_advisory_async(disease, crop, confidence, severity, timeout=None):
+    if not async_client or not api_key:
+        return "AI advisory feature requires OPENAI_API_KEY to be set in environment variables."
+
+    response = await async_client.chat.completions.create(
+        model=ADVISORY_MODEL,
+        messages=_advisory_messages(build_advisory_prompt(disease, crop, confidence, severity)),
+        temperature=0.4,
+        timeout=timeout
+    )
+
+    return response.choices[0].message.content.strip()
+
+async def stream_ai_advisory(disease, crop, confidence, severity, timeout=None):
+    """Yield the advisory text in chunks as the model produces it"""
+    if not async_client or not api_key:
+        yield "AI advisory feature requires OPENAI_API_KEY to be set in environment variables."
+        return
+
+    stream = await async_client.chat.completions.create(
+        model=ADVISORY_MODEL,
+        messages=_advisory_messages(build_advisory_prompt(disease, crop, confidence, severity)),
+        temperature=0.4,
+        timeout=timeout,
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import torch
+
+# Bump when the artifact layout or the way prototypes/threshold are computed changes
+PROTOTYPE_ARTIFACT_VERSION = 3
+CASCADE_ARTIFACT_VERSION = 1
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dataset_manifest_hash(data_dir):
+    # Hash of (relative path, size, mtime) for every file in the dataset;
+    # stat-only, so it stays cheap as the training set grows.
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(data_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            rel_path = os.path.relpath(path, data_dir).replace(os.sep, "/")
+            digest.update(f"{rel_path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def prototype_version(prototype_bank):
+    # Content hash of the prototype table; changes whenever prototypes or classes change
+    digest = hashlib.sha256()
+    digest.update("\0".join(prototype_bank.class_names).encode("utf-8"))
+    digest.update(prototype_bank.matrix.detach().cpu().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def load_prototype_artifact(path, encoder_hash, manifest_hash, settings_key):
+    """Return the stored artifact if it matches the encoder, dataset and settings, else None"""
+    if not os.path.exists(path):
+        return None
+
+    try:
+        artifact = torch.load(path, map_location="cpu")
+    except Exception as e:
+        print(f"Ignoring unreadable prototype artifact {path}: {e}")
+        return None
+
+    if (
+        artifact.get("version") != PROTOTYPE_ARTIFACT_VERSION
+        or artifact.get("encoder_hash") != encoder_hash
+        or artifact.get("manifest_hash") != manifest_hash
+        or artifact.get("settings_key") != settings_key
+    ):
+        return None
+
+    return artifact
+
+
+def load_served_prototypes(model, encoder_hash, artifact_path, train_dir):
+    """The prototypes and threshold MLService serves: its artifact if built for this encoder"""
+    # Imported here: ml.prototypes -> ml.embedding_cache imports this module
+    from ml.prototype_bank import PrototypeBank
+    from ml.prototypes import compute_prototypes
+    from ml.threshold import compute_open_set_threshold
+
+    if os.path.exists(artifact_path):
+        artifact = torch.load(artifact_path, map_location="cpu")
+        if artifact.get("version") == PROTOTYPE_ARTIFACT_VERSION and artifact.get("encoder_hash") == encoder_hash:
+            print(f"Using served prototypes from {artifact_path}")
+            return artifact["prototypes"], artifact["class_names"], artifact["threshold"]
+        print(f"{artifact_path} is outdated or was built for another encoder; recomputing")
+
+    print("Computing prototypes and threshold...")
+    prototypes, class_names = compute_prototypes(model, train_dir, "cpu")
+    threshold = compute_open_set_threshold(
+        model, train_dir, "cpu", bank=PrototypeBank(prototypes, class_names, "cpu")
+    )
+    return prototypes, class_names, threshold
+
+
+def save_prototype_artifact(path, prototypes, class_names, threshold, encoder_hash, manifest_hash, settings_key,
+                            stats=None):
+    artifact = {
+        "version": PROTOTYPE_ARTIFACT_VERSION,
+        "encoder_hash": encoder_hash,
+        "manifest_hash": manifest_hash,
+        "settings_key": settings_key,
+        "prototypes": {int(k): v.detach().cpu() for k, v in prototypes.items()},
+        "class_names": list(class_names),
+        "threshold": float(threshold),
+        # PrototypeStats.state_dict() for incremental updates (mean prototypes only)
+        "stats": stats,
+    }
+
+    # Write to a temp file and rename so a crash never leaves a torn artifact
+    tmp_path = f"{path}.tmp"
+    torch.save(artifact, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_cascade_artifact(path, encoder_hash):
+    """Return the calibrated low-res cascade if it was built from this encoder, else None"""
+    if not os.path.exists(path):
+        return None
+
+    try:
+        artifact = torch.load(path, map_location="cpu")
+    except Exception as e:
+        print(f"Ignoring unreadable cascade artifact {path}: {e}")
+        return None
+
+    if artifact.get("version") != CASCADE_ARTIFACT_VERSION or artifact.get("encoder_hash") != encoder_hash:
+        return None
+
+    return artifact
+
+
+def save_cascade_artifact(path, prototypes, class_names, size, min_score, min_margin,
+                          escalation_rate, encoder_hash, manifest_hash):
+    artifact = {
+        "version": CASCADE_ARTIFACT_VERSION,
+        "encoder_hash": encoder_hash,
+        "manifest_hash": manifest_hash,
+        "size": int(size),
+        "min_score": float(min_score),
+        "min_margin": float(min_margin),
+        "escalation_rate": float(escalation_rate),
+        "prototypes": {int(k): v.detach().cpu() for k, v in prototypes.items()},
+        "class_names": list(class_names),
+    }
+
+    tmp_path = f"{path}.tmp"
+    torch.save(artifact, tmp_path)
+    os.replace(tmp_path, path)
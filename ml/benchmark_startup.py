@@ -0,0 +1,38 @@
+import time
+import torch
+from ml.encoder import Encoder, load_encoder
+
+def time_call(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), sum(timings) / len(timings)
+
+def benchmark_startup(repeats=5):
+    device = "cpu"
+    encoder_path = "ml/encoder_supcon.pth"
+
+    print(f"Encoder construction benchmark ({repeats} runs each, device={device})")
+    print("-" * 50)
+
+    best, mean = time_call(lambda: load_encoder(encoder_path, device), repeats)
+    print(f"Checkpoint load, no pretrained init:  best {best * 1000:8.1f} ms | mean {mean * 1000:8.1f} ms")
+
+    def pretrained_then_load():
+        model = Encoder(pretrained=True)
+        model.load_state_dict(torch.load(encoder_path, map_location=device))
+
+    try:
+        best_old, mean_old = time_call(pretrained_then_load, repeats)
+    except Exception as e:
+        print(f"ImageNet init + checkpoint load:      failed ({e.__class__.__name__}: {e})")
+        print("The previous construction path does not work without network access or a cached download.")
+        return
+
+    print(f"ImageNet init + checkpoint load:      best {best_old * 1000:8.1f} ms | mean {mean_old * 1000:8.1f} ms")
+    print(f"Speed-up per Encoder: {mean_old / mean:.1f}x")
+
+if __name__ == "__main__":
+    benchmark_startup()
@@ -0,0 +1,89 @@
+import argparse
+import glob
+import random
+import time
+
+import torch
+from PIL import Image
+
+from ml.classifier import PrototypeClassifier
+from ml.encoder import load_encoder
+from ml.prototype_bank import PrototypeBank
+from ml.prototypes import compute_prototypes
+from ml.threshold import compute_open_set_threshold
+from ml.tiling import classify_tiles, decode_for_tiling, tile_grid
+
+
+def synthetic_frame(image_dir, width, height, leaf_size, seed=0):
+    """Paste random leaf photos side by side to stand in for a drone frame"""
+    paths = sorted(glob.glob(f"{image_dir}/*/*"))
+    rng = random.Random(seed)
+    frame = Image.new("RGB", (width, height), (90, 70, 50))
+    for y in range(0, height, leaf_size):
+        for x in range(0, width, leaf_size):
+            with Image.open(rng.choice(paths)) as leaf:
+                frame.paste(leaf.convert("RGB").resize((leaf_size, leaf_size)), (x, y))
+    return frame
+
+
+def benchmark_tiling(encoder_path, train_dir, image_path, image_dir, width, height, tile_size, overlap,
+                     batch_sizes, repeats, threads):
+    device = "cpu"
+    if threads:
+        torch.set_num_threads(threads)
+
+    encoder = load_encoder(encoder_path, device)
+    print("Computing prototypes and threshold...")
+    prototypes, class_names = compute_prototypes(encoder, train_dir, device)
+    bank = PrototypeBank(prototypes, class_names, device)
+    threshold = compute_open_set_threshold(encoder, train_dir, device, bank=bank)
+    classifier = PrototypeClassifier(encoder, bank, class_names, device=device)
+
+    start = time.perf_counter()
+    if image_path:
+        image = decode_for_tiling(image_path)
+    else:
+        image = synthetic_frame(image_dir, width, height, tile_size)
+    print(f"Frame {image.width}x{image.height} ready in {time.perf_counter() - start:.2f}s")
+
+    xs, ys, size, stride = tile_grid(image.width, image.height, tile_size, overlap)
+    num_tiles = len(xs) * len(ys)
+    print(f"Tiled inference benchmark: {len(ys)}x{len(xs)} = {num_tiles} tiles of {size}px "
+          f"(stride {stride}), {torch.get_num_threads()} threads, device={device}")
+    print("-" * 60)
+
+    for batch_size in batch_sizes:
+        classify_tiles(classifier, image, threshold, tile_size, overlap, batch_size)  # warm up
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            tiles = classify_tiles(classifier, image, threshold, tile_size, overlap, batch_size)[0]
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"batch {batch_size:4d}: best {best:6.2f}s | {num_tiles / best:7.1f} tiles/s")
+
+    labels = {}
+    for _, _, label, _ in tiles:
+        labels[label] = labels.get(label, 0) + 1
+    print(f"Tile labels: {dict(sorted(labels.items(), key=lambda item: -item[1]))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tiled inference throughput on CPU")
+    parser.add_argument("--encoder", default="ml/encoder_supcon.pth")
+    parser.add_argument("--train-dir", default="data/fewshot/train")
+    parser.add_argument("--image", help="frame to tile (default: synthetic mosaic of test leaves)")
+    parser.add_argument("--image-dir", default="data/fewshot/test")
+    parser.add_argument("--width", type=int, default=5472)
+    parser.add_argument("--height", type=int, default=3648)
+    parser.add_argument("--tile-size", type=int, default=512)
+    parser.add_argument("--overlap", type=float, default=0.25)
+    parser.add_argument("--batch-sizes", default="8,16,32,64")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    benchmark_tiling(
+        args.encoder, args.train_dir, args.image, args.image_dir, args.width, args.height, args.tile_size, args.overlap,
+        [int(size) for size in args.batch_sizes.split(",")], args.repeats, args.threads
+    )
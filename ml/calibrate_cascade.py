@@ -0,0 +1,166 @@
+import argparse
+import os
+import sys
+import torch
+from torch.utils.data import DataLoader
+from torchvision.datasets import ImageFolder
+
+from ml.agro_intelligence import assess_disease_intelligence
+from ml.artifacts import file_sha256, dataset_manifest_hash, save_cascade_artifact
+from ml.cascade import LOW_RES_SIZE, downscale, low_res_transform
+from ml.classifier import PrototypeClassifier
+from ml.encoder import load_encoder
+from ml.evaluate import compute_metrics
+from ml.gradcam import GradCAM
+from ml.prototype_bank import PrototypeBank
+from ml.prototypes import compute_prototypes
+from ml.threshold import compute_open_set_threshold
+from ml.transforms import inference_transform
+
+
+def disease_stage(name, score, cam_coverage):
+    # Same staging as the diagnosis endpoints (backend.routers.diagnosis.assess_result)
+    if name == "UNKNOWN":
+        return "Unknown"
+    return assess_disease_intelligence(score, cam_coverage)[0]
+
+
+def diagnose_full_and_low_res(model, bank, low_bank, test_dir, threshold, size, batch_size=32):
+    """
+    Run every test image through the full 224px path and through the low-res
+    stage exactly as served (label, score, margin and a Grad-CAM from the same
+    pass), so early exits can be checked for the same label and the same
+    disease stage, which also depends on the CAM coverage.
+    Returns (true labels, full labels, full stages, low labels, low scores, low margins, low stages).
+    """
+    gradcam = GradCAM(model, model.feature_extractor[-1])
+    full_classifier = PrototypeClassifier(model, bank, bank.class_names)
+    low_classifier = PrototypeClassifier(model, low_bank, bank.class_names)
+    loader = DataLoader(ImageFolder(test_dir, transform=inference_transform), batch_size=batch_size)
+
+    def label(name):
+        return bank.class_names.index(name) if name != "UNKNOWN" else -1
+
+    labels, full_labels, full_stages = [], [], []
+    low_labels, low_scores, low_margins, low_stages = [], [], [], []
+    for images, batch_labels in loader:
+        labels.append(batch_labels)
+        for name, score, _, _, coverage in full_classifier.predict_batch_with_cam(images, gradcam, threshold):
+            full_labels.append(label(name))
+            full_stages.append(disease_stage(name, score, coverage))
+        low_results = low_classifier.predict_batch_with_cam(downscale(images, size), gradcam, threshold)
+        for name, score, margin, _, coverage in low_results:
+            low_labels.append(label(name))
+            low_scores.append(score)
+            low_margins.append(margin)
+            low_stages.append(disease_stage(name, score, coverage))
+
+    return (
+        torch.cat(labels), torch.tensor(full_labels), full_stages,
+        torch.tensor(low_labels), torch.tensor(low_scores), torch.tensor(low_margins), low_stages
+    )
+
+
+def search_bounds(low_labels, low_scores, low_margins, agrees, min_agreement, steps=50):
+    """
+    Grid search over score/margin quantiles for the bounds that let the most
+    images exit early while the accepted low-res results still agree with the
+    full-resolution ones (agrees: per-image bool) at least min_agreement of
+    the time.
+    """
+    known = low_labels >= 0
+    if not known.any():
+        return None
+
+    quantiles = torch.linspace(0, 1, steps + 1)
+    score_candidates = torch.quantile(low_scores[known], quantiles).unique()
+    margin_candidates = torch.quantile(low_margins[known], quantiles).unique()
+
+    best = None
+    for min_score in score_candidates.tolist():
+        for min_margin in margin_candidates.tolist():
+            accepted = known & (low_scores >= min_score) & (low_margins >= min_margin)
+            if not accepted.any():
+                continue
+            agreement = agrees[accepted].float().mean().item()
+            if agreement < min_agreement:
+                continue
+            escalation_rate = 1.0 - accepted.float().mean().item()
+            if best is None or escalation_rate < best["escalation_rate"]:
+                best = {
+                    "min_score": min_score,
+                    "min_margin": min_margin,
+                    "agreement": agreement,
+                    "escalation_rate": escalation_rate,
+                }
+    return best
+
+
+def calibrate_cascade(encoder_path, train_dir, test_dir, output_path, size=LOW_RES_SIZE,
+                      min_agreement=0.99, percentile=0.5):
+    device = "cpu"
+    model = load_encoder(encoder_path, device)
+
+    print("Computing full-resolution prototypes and threshold...")
+    prototypes, class_names = compute_prototypes(model, train_dir, device)
+    bank = PrototypeBank(prototypes, class_names, device)
+    threshold = compute_open_set_threshold(model, train_dir, device, percentile=percentile, bank=bank)
+
+    print(f"Computing {size}px prototypes...")
+    low_prototypes, _ = compute_prototypes(model, train_dir, device, transform=low_res_transform(size))
+    low_bank = PrototypeBank(low_prototypes, class_names, device)
+
+    print(f"Calibrating on {test_dir}...")
+    labels, full_labels, full_stages, low_labels, low_scores, low_margins, low_stages = diagnose_full_and_low_res(
+        model, bank, low_bank, test_dir, threshold, size
+    )
+    # Early exits must match the full path in label and in disease stage (which
+    # drives the recommended action and the advisory)
+    same_label = low_labels == full_labels
+    same_stage = torch.tensor([low == full for low, full in zip(low_stages, full_stages)])
+
+    bounds = search_bounds(low_labels, low_scores, low_margins, same_label & same_stage, min_agreement)
+    if bounds is None:
+        print(f"No bounds reach {min_agreement * 100:.1f}% agreement; cascade would escalate everything")
+        return False
+
+    accepted = (low_labels >= 0) & (low_scores >= bounds["min_score"]) & (low_margins >= bounds["min_margin"])
+    cascade_labels = torch.where(accepted, low_labels, full_labels)
+
+    def names(decided):
+        return [bank.name(label) if label >= 0 else "UNKNOWN" for label in decided.tolist()]
+
+    y_true = [bank.name(label) for label in labels.tolist()]
+    full_metrics = compute_metrics(y_true, names(full_labels))
+    cascade_metrics = compute_metrics(y_true, names(cascade_labels))
+
+    print(f"\nmin score {bounds['min_score']:.4f} | min margin {bounds['min_margin']:.4f}")
+    print(f"Agreement with full path on early exits: {bounds['agreement'] * 100:.2f}% "
+          f"(label {same_label[accepted].float().mean().item() * 100:.2f}%, "
+          f"stage {same_stage[accepted].float().mean().item() * 100:.2f}%)")
+    print(f"Escalation rate: {bounds['escalation_rate'] * 100:.2f}%")
+    print(f"Open-set accuracy: full {full_metrics['accuracy'] * 100:.2f}% | "
+          f"cascade {cascade_metrics['accuracy'] * 100:.2f}%")
+
+    save_cascade_artifact(
+        output_path, low_prototypes, class_names, size, bounds["min_score"], bounds["min_margin"],
+        bounds["escalation_rate"], file_sha256(encoder_path), dataset_manifest_hash(train_dir)
+    )
+    print(f"\nCascade saved to {output_path}; enable with CASCADE_ENABLED=true")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the low-resolution early-exit cascade")
+    parser.add_argument("--encoder", default="ml/encoder_supcon.pth")
+    parser.add_argument("--train-dir", default="data/fewshot/train")
+    parser.add_argument("--test-dir", default="data/fewshot/test")
+    parser.add_argument("--output", default=None, help="defaults to cascade.pt next to the encoder")
+    parser.add_argument("--size", type=int, default=LOW_RES_SIZE)
+    parser.add_argument("--min-agreement", type=float, default=0.99,
+                        help="required label and stage agreement of early exits with the full-resolution path")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(os.path.dirname(args.encoder), "cascade.pt")
+    if not calibrate_cascade(args.encoder, args.train_dir, args.test_dir, output, args.size, args.min_agreement):
+        sys.exit(1)
@@ -0,0 +1,64 @@
+import threading
+from torchvision import transforms
+from torchvision.transforms import functional as TF
+
+from ml.transforms import inference_transform
+
+LOW_RES_SIZE = 128
+
+
+def low_res_transform(size=LOW_RES_SIZE):
+    # Downscale the normalized 224px tensor exactly like the serving path,
+    # so low-res prototypes and low-res queries see the same pixels.
+    return transforms.Compose([inference_transform, transforms.Resize(size, antialias=True)])
+
+
+def downscale(images, size=LOW_RES_SIZE):
+    return TF.resize(images, [size, size], antialias=True)
+
+
+class CascadeStage:
+    """
+    Cheap first stage of the classifier: the same encoder on a downscaled
+    image, scored against its own low-res prototype bank. A result is kept
+    only when it is known and clears the calibrated score and margin bounds;
+    everything else escalates to the full 224px path.
+    """
+
+    def __init__(self, bank, min_score, min_margin, size=LOW_RES_SIZE, calibrated_escalation_rate=None):
+        self.bank = bank
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.size = size
+        self.calibrated_escalation_rate = calibrated_escalation_rate
+        self._lock = threading.Lock()
+        self._images = 0
+        self._escalated = 0
+
+    def with_bank(self, bank):
+        """Same calibrated bounds over new low-res prototypes (e.g. after retraining)"""
+        return CascadeStage(bank, self.min_score, self.min_margin, self.size, self.calibrated_escalation_rate)
+
+    def downscale(self, images):
+        return downscale(images, self.size)
+
+    def accepts(self, labels, scores, margins):
+        return (labels >= 0) & (scores >= self.min_score) & (margins >= self.min_margin)
+
+    def record(self, images, escalated):
+        with self._lock:
+            self._images += images
+            self._escalated += escalated
+
+    def stats(self):
+        with self._lock:
+            images, escalated = self._images, self._escalated
+        return {
+            "size": self.size,
+            "min_score": self.min_score,
+            "min_margin": self.min_margin,
+            "images": images,
+            "escalated": escalated,
+            "escalation_rate": escalated / images if images else None,
+            "calibrated_escalation_rate": self.calibrated_escalation_rate,
+        }
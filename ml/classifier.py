@@ -2,55 +2,173 @@ import torch
 import torch.nn.functional as F
 from PIL import Image
 
-from ml.encoder import Encoder
+from ml.encoder import resolve_encoder
+from ml.gradcam import threshold_cam, upsample_cam
+from ml.inference_backends import EagerBackend
+from ml.ingest import ingest_image
+from ml.prototype_bank import PrototypeBank
 from ml.transforms import inference_transform
 
 
 class PrototypeClassifier:
-    def __init__(self, encoder_path, prototypes, class_names, device="cpu"):
+    def __init__(self, encoder, prototypes, class_names, device="cpu", margin_threshold=0.01, backend=None,
+                 cascade=None):
         self.device = device
+        self.margin_threshold = margin_threshold
 
-        self.model = Encoder()
-        self.model.load_state_dict(torch.load(encoder_path, map_location=device))
-        self.model.to(device)
-        self.model.eval()
+        # Accept an already-loaded encoder so callers (MLService) can share
+        # one model instance instead of loading the checkpoint again.
+        self.model = resolve_encoder(encoder, device)
 
-        self.prototypes = {
-            k: v.to(device) for k, v in prototypes.items()
-        }
+        # Embedding backend for the classification path (eager, TorchScript,
+        # ONNX Runtime); Grad-CAM always runs on the eager model.
+        self.backend = backend if backend is not None else EagerBackend(self.model)
 
-        self.class_names = class_names
-
-    def predict(self, image_path, threshold=0.6):
-
-        image = Image.open(image_path).convert("RGB")
-        image = inference_transform(image).unsqueeze(0).to(self.device)
-
-        with torch.no_grad():
-            embedding = self.model(image)
-            embedding = F.normalize(embedding, dim=1)
+        if isinstance(prototypes, PrototypeBank):
+            self.bank = prototypes
+        else:
+            self.bank = PrototypeBank(prototypes, class_names, device)
 
-        similarities = {}
-
-        for label, prototype in self.prototypes.items():
-            prototype = F.normalize(prototype.unsqueeze(0), dim=1)
-            similarity = F.cosine_similarity(embedding, prototype)
-            similarities[label] = similarity.item()
-
-        best_label = max(similarities, key=similarities.get)
-        best_score = similarities[best_label]
+        self.class_names = class_names
 
-        print(f"DEBUG: Best Class: {self.class_names[best_label]} | Score: {best_score:.4f} | Threshold: {threshold:.4f}")
+        # Optional low-resolution early-exit stage (ml.cascade.CascadeStage)
+        self.cascade = cascade
 
-        if best_score < threshold:
-            print(f"DEBUG: Rejected as UNKNOWN (Score {best_score:.4f} < {threshold:.4f})")
-            return "UNKNOWN", float(best_score)
+    def preprocess(self, image):
+        if not isinstance(image, Image.Image):
+            return ingest_image(image, self.device)
+        return inference_transform(image).unsqueeze(0).to(self.device)
 
-        sorted_scores = sorted(similarities.values(), reverse=True)
-        if len(sorted_scores) > 1:
-            margin = sorted_scores[0] - sorted_scores[1]
-            if margin < 0.01: 
-                 print(f"DEBUG: Rejected as UNKNOWN (Ambiguous Margin {margin:.4f})")
-                 return "UNKNOWN", float(best_score)
+    def predict(self, image_path, threshold=0.6):
 
-        return self.class_names[best_label], float(best_score)
+        image = self.preprocess(image_path)
+
+        embedding = self.backend.embed(image)
+
+        labels, scores, margins = self.bank.decide(embedding, threshold, self.margin_threshold)
+        best_label, best_score, margin = labels[0].item(), scores[0].item(), margins[0].item()
+
+        print(f"DEBUG: Score: {best_score:.4f} | Margin: {margin:.4f} | Threshold: {threshold:.4f}")
+
+        if best_label < 0:
+            return "UNKNOWN", best_score
+
+        return self.class_names[best_label], best_score
+
+    def predict_batch(self, images, threshold=0.6):
+        """
+        Classification only, no Grad-CAM, for a [B, 3, 224, 224] tensor.
+        Returns one (label, score, margin) per image; label is "UNKNOWN" when rejected.
+        """
+        return self.predict_embeddings(self.backend.embed(images.to(self.device)), threshold)
+
+    def predict_embeddings(self, embeddings, threshold=0.6):
+        """Open-set prototype matching for [B, D] embeddings produced elsewhere (e.g. on device)"""
+        labels, scores, margins = self.bank.decide(embeddings, threshold, self.margin_threshold)
+        return [
+            (self.class_names[label] if label >= 0 else "UNKNOWN", score, margin)
+            for label, score, margin in zip(labels.tolist(), scores.tolist(), margins.tolist())
+        ]
+
+    def predict_with_cam(self, image, gradcam, threshold=0.6):
+        """
+        Fused classification + Grad-CAM: one forward pass with the target
+        layer activations captured, backward only for the winning prototype.
+        Returns (label, score, margin, cam, cam_coverage); cam is the raw Grad-CAM
+        grid (see GradCAM.grids_from_score), None for UNKNOWN.
+        """
+        return self.predict_batch_with_cam(self.preprocess(image), gradcam, threshold)[0]
+
+    def predict_batch_with_cam(self, images, gradcam, threshold=0.6):
+        """
+        Batched variant of predict_with_cam for a [B, 3, 224, 224] tensor:
+        one forward, one similarity matmul and a single backward over the
+        summed winning-prototype scores of all known samples.
+        """
+        images = images.to(self.device)
+        if self.cascade is not None:
+            return self._predict_batch_cascade(images, gradcam, threshold)
+        return self._predict_batch_full(images, gradcam, threshold)
+
+    def _predict_batch_full(self, images, gradcam, threshold):
+        if self.backend.name != "eager":
+            return self._predict_batch_compiled(images, gradcam, threshold)
+
+        with torch.enable_grad():
+            embeddings = self.model(images)
+            labels, scores, margins = self.bank.decide(
+                embeddings.detach(), threshold, self.margin_threshold
+            )
+
+            known = (labels >= 0).nonzero().flatten()
+            if len(known) == 0:
+                gradcam.discard()
+                cams = None
+            else:
+                winners = self.bank.winning_prototypes(embeddings[known], labels[known])
+                score = (F.normalize(embeddings[known], dim=1) * winners).sum()
+                cams = gradcam.grids_from_score(score)
+
+        return self._build_results(labels, scores, margins, cams)
+
+    def _predict_batch_compiled(self, images, gradcam, threshold):
+        # Classification runs on the compiled backend; only known samples
+        # pay for an eager forward/backward to produce their Grad-CAM.
+        embeddings = self.backend.embed(images).to(self.device)
+        labels, scores, margins = self.bank.decide(embeddings, threshold, self.margin_threshold)
+
+        known = (labels >= 0).nonzero().flatten()
+        cams = {}
+        if len(known) > 0:
+            with torch.enable_grad():
+                eager_embeddings = self.model(images[known])
+                winners = self.bank.winning_prototypes(embeddings[known], labels[known])
+                score = (F.normalize(eager_embeddings, dim=1) * winners).sum()
+                cams = dict(zip(known.tolist(), gradcam.grids_from_score(score)))
+
+        return self._build_results(labels, scores, margins, cams)
+
+    def _predict_batch_cascade(self, images, gradcam, threshold):
+        # Confident rows keep the low-res result and a (coarser) Grad-CAM from
+        # the same pass; the rest escalate to the full 224px path.
+        with torch.enable_grad():
+            embeddings = self.model(self.cascade.downscale(images))
+            labels, scores, margins = self.cascade.bank.decide(
+                embeddings.detach(), threshold, self.margin_threshold
+            )
+
+            accepted = self.cascade.accepts(labels, scores, margins).nonzero().flatten()
+            if len(accepted) == 0:
+                gradcam.discard()
+                cams = []
+            else:
+                winners = self.cascade.bank.winning_prototypes(embeddings[accepted], labels[accepted])
+                score = (F.normalize(embeddings[accepted], dim=1) * winners).sum()
+                batch_cams = gradcam.grids_from_score(score)
+                cams = [batch_cams[i] for i in accepted.tolist()]
+
+        accepted_rows = set(accepted.tolist())
+        escalated = [i for i in range(len(images)) if i not in accepted_rows]
+        self.cascade.record(len(images), len(escalated))
+
+        results = [None] * len(images)
+        early = self._build_results(labels[accepted], scores[accepted], margins[accepted], cams)
+        for i, result in zip(accepted.tolist(), early):
+            results[i] = result
+        if escalated:
+            full = self._predict_batch_full(images[escalated], gradcam, threshold)
+            for i, result in zip(escalated, full):
+                results[i] = result
+        return results
+
+    def _build_results(self, labels, scores, margins, cams):
+        results = []
+        for i, (label, score, margin) in enumerate(zip(labels.tolist(), scores.tolist(), margins.tolist())):
+            if label < 0:
+                results.append(("UNKNOWN", score, margin, None, 0.0))
+            else:
+                # Only the coverage statistic is computed here; the overlay is
+                # rendered from the raw grid when someone asks for it
+                _, cam_coverage = threshold_cam(upsample_cam(cams[i]))
+                results.append((self.class_names[label], score, margin, cams[i], cam_coverage))
+        return results
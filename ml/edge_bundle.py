@@ -0,0 +1,178 @@
+"""
+Edge deployment bundle
+
+Packages everything a device needs to classify offline exactly like the
+server into one versioned zip:
+
+    encoder.ptl      TorchScript Lite encoder (mobile-optimized when this
+                     PyTorch build has XNNPACK)
+    prototypes.f16   normalized prototype rows, float16, row-major [M, D]
+    manifest.json    version, class names, row owners, open-set threshold,
+                     margin threshold, preprocessing and parity report
+
+Devices score an embedding by cosine similarity against every row, take
+each class's best row, and reject as UNKNOWN when the best score is below
+`threshold` or the top-2 margin is below `margin_threshold` (the same rule
+as PrototypeBank.decide). The bundle version matches MLService.model_version,
+so a device can ask the server for prototype rows changed since its bundle.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.jit.mobile import _load_for_lite_interpreter
+from torchvision.datasets import ImageFolder
+from torch.utils.data import DataLoader
+
+from ml.artifacts import load_served_prototypes, prototype_version
+from ml.classifier import PrototypeClassifier
+from ml.encoder import load_encoder
+from ml.prototype_bank import PrototypeBank
+from ml.transforms import inference_transform
+
+# Bump when the bundle layout changes
+EDGE_BUNDLE_FORMAT = 1
+
+
+def class_rows(bank):
+    """Normalized prototype rows of each class as float16 arrays, keyed by class name"""
+    matrix = bank.matrix.detach().cpu().half().numpy()
+    owners = bank.owners.cpu().numpy()
+    return {name: matrix[owners == label] for label, name in enumerate(bank.class_names)}
+
+
+def row_hash(rows):
+    return hashlib.sha256(np.ascontiguousarray(rows, dtype="<f2").tobytes()).hexdigest()[:16]
+
+
+def bundle_version(encoder_hash, bank):
+    return f"{encoder_hash[:16]}-{prototype_version(bank)}"
+
+
+def export_lite(model, path):
+    """Trace, freeze and save for the lite interpreter; returns whether it was mobile-optimized"""
+    example = torch.randn(1, 3, 224, 224)
+    with torch.no_grad():
+        module = torch.jit.freeze(torch.jit.trace(model, example))
+
+    optimized = True
+    try:
+        from torch.utils.mobile_optimizer import optimize_for_mobile
+        module = optimize_for_mobile(module)
+    except RuntimeError as e:
+        # optimize_for_mobile needs an XNNPACK build; the frozen graph still runs on device
+        print(f"  mobile optimization unavailable ({str(e).splitlines()[0][:80]}...); saving frozen graph")
+        optimized = False
+
+    module._save_for_lite_interpreter(path)
+    return optimized
+
+
+def check_parity(model, lite_path, classifier, edge_classifier, threshold, test_dir, batch_size=32):
+    """Server (eager, float32 prototypes) vs device (lite, float16 prototypes) on the test set"""
+    lite = _load_for_lite_interpreter(lite_path)
+    dataset = ImageFolder(test_dir, transform=inference_transform)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+
+    agree = 0
+    min_cosine = 1.0
+    with torch.no_grad():
+        for images, _ in loader:
+            expected = model(images)
+            actual = lite(images)
+            min_cosine = min(min_cosine, F.cosine_similarity(expected, actual).min().item())
+            server = classifier.predict_embeddings(expected, threshold)
+            device = edge_classifier.predict_embeddings(actual, threshold)
+            agree += sum(s[0] == d[0] for s, d in zip(server, device))
+
+    return {"images": len(dataset), "agreement": agree / len(dataset), "min_cosine": min_cosine}
+
+
+def build_edge_bundle(encoder_path, artifact_path, train_dir, test_dir, output_dir, min_agreement):
+    model = load_encoder(encoder_path, "cpu")
+    encoder_hash = model.checkpoint_hash
+    prototypes, class_names, threshold = load_served_prototypes(model, encoder_hash, artifact_path, train_dir)
+
+    bank = PrototypeBank(prototypes, class_names, "cpu")
+    classifier = PrototypeClassifier(model, bank, class_names)
+    rows = class_rows(bank)
+    version = bundle_version(encoder_hash, bank)
+
+    # What a device reconstructs from prototypes.f16
+    edge_bank = PrototypeBank(
+        {label: torch.from_numpy(rows[name].astype(np.float32)) for label, name in enumerate(class_names)},
+        class_names, "cpu"
+    )
+    edge_classifier = PrototypeClassifier(model, edge_bank, class_names)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lite_path = os.path.join(tmp_dir, "encoder.ptl")
+        print("Exporting TorchScript Lite encoder...")
+        mobile_optimized = export_lite(model, lite_path)
+
+        parity = check_parity(model, lite_path, classifier, edge_classifier, threshold, test_dir)
+        print(f"  parity on {parity['images']} test images: label agreement {parity['agreement']:.2%}, "
+              f"min cosine {parity['min_cosine']:.6f}")
+        if parity["agreement"] < min_agreement:
+            print(f"  FAILED: agreement below {min_agreement:.2%}; bundle not written")
+            return None
+
+        manifest = {
+            "format": EDGE_BUNDLE_FORMAT,
+            "version": version,
+            "encoder_version": encoder_hash[:16],
+            "prototype_version": version.split("-", 1)[1],
+            "mobile_optimized": mobile_optimized,
+            "embedding_dim": bank.embedding_dim,
+            "dtype": "float16",
+            "class_names": list(class_names),
+            "row_owners": bank.owners.tolist(),
+            "row_hashes": {name: row_hash(rows[name]) for name in class_names},
+            "threshold": float(threshold),
+            "margin_threshold": classifier.margin_threshold,
+            "input": {
+                "resize": 256, "crop": 224,
+                "mean": [0.485, 0.456, 0.406], "std": [0.229, 0.224, 0.225]
+            },
+            "parity": parity,
+        }
+
+        bundle_path = os.path.join(output_dir, f"edge_bundle-{version}.zip")
+        tmp_bundle = f"{bundle_path}.tmp"
+        with zipfile.ZipFile(tmp_bundle, "w", zipfile.ZIP_DEFLATED) as bundle:
+            bundle.write(lite_path, "encoder.ptl")
+            bundle.writestr("prototypes.f16", np.concatenate([rows[name] for name in class_names]).astype("<f2").tobytes())
+            bundle.writestr("manifest.json", json.dumps(manifest, indent=2))
+        os.replace(tmp_bundle, bundle_path)
+
+    print(f"Wrote {bundle_path} ({os.path.getsize(bundle_path) / 1024 / 1024:.1f} MB)")
+    return bundle_path
+
+
+def read_bundle_manifest(path):
+    with zipfile.ZipFile(path) as bundle:
+        return json.loads(bundle.read("manifest.json"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Package the encoder and prototypes as an edge bundle")
+    parser.add_argument("--encoder", default="ml/encoder_supcon.pth")
+    parser.add_argument("--prototypes", default="ml/prototypes.pt")
+    parser.add_argument("--train-dir", default="data/fewshot/train")
+    parser.add_argument("--test-dir", default="data/fewshot/test")
+    parser.add_argument("--output-dir", default="ml/edge")
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    args = parser.parse_args()
+
+    if build_edge_bundle(
+        args.encoder, args.prototypes, args.train_dir, args.test_dir, args.output_dir, args.min_agreement
+    ) is None:
+        sys.exit(1)
@@ -0,0 +1,262 @@
+"""
+On-disk cache of dataset embeddings
+
+compute_prototypes, compute_open_set_threshold, the evaluation scripts and
+MLService all embed the same data/fewshot images. Embeddings are stored
+per (encoder checkpoint hash, transform id) as an append-only float32 matrix
+read through np.memmap, plus a JSON index mapping each image's content
+sha256 to its row. Only images that are new or changed are decoded and
+embedded; everything else is a row lookup.
+
+Random augmentations (train_transform) are seeded from the image's content
+hash, so an image always gets the same draw and a cached embedding is
+identical to a recomputed one. Models loaded with ml.encoder.load_encoder
+carry the checkpoint hash; other models (e.g. mid-training) are not cached.
+Appends and index writes hold an exclusive lock on a .lock sidecar file and
+first re-read the index, so the API and the ml/ scripts can share a cache.
+"""
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torchvision.datasets import ImageFolder
+from torchvision.datasets.folder import default_loader
+
+from ml.artifacts import file_sha256
+from ml.transforms import inference_transform
+
+# Bump when the cache layout or the per-image seeding changes
+EMBEDDING_CACHE_VERSION = 1
+EMBEDDING_CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache")
+)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def transform_id(transform):
+    # Compose's repr lists every op with its parameters
+    return hashlib.sha256(f"{EMBEDDING_CACHE_VERSION}\0{transform!r}".encode("utf-8")).hexdigest()[:16]
+
+
+def image_seed(sha256):
+    return int(sha256[:15], 16)
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive inter-process lock on the file at path (created if missing)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SeededImages(Dataset):
+    """Images with the transform's random draws seeded by each image's content hash"""
+
+    def __init__(self, paths, hashes, transform):
+        self.paths = paths
+        self.hashes = hashes
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        image = default_loader(self.paths[index])
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(image_seed(self.hashes[index]))
+            return self.transform(image)
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, encoder_hash, transform):
+        name = f"{encoder_hash[:16]}-{transform_id(transform)}"
+        self.data_path = os.path.join(cache_dir, f"{name}.f32")
+        self.index_path = os.path.join(cache_dir, f"{name}.json")
+        self.lock_path = os.path.join(cache_dir, f"{name}.lock")
+        self._lock = threading.Lock()
+        self._dim = None
+        self._rows = {}
+        self._files = {}
+        self._dirty = False
+        self._reload()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def content_hash(self, path):
+        """sha256 of an image file, re-read only when its size or mtime changed"""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        known = self._files.get(key)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        sha256 = file_sha256(path)
+        with self._lock:
+            self._files[key] = [stat.st_size, stat.st_mtime_ns, sha256]
+            self._dirty = True
+        return sha256
+
+    def missing(self, hashes):
+        return [sha256 for sha256 in dict.fromkeys(hashes) if sha256 not in self._rows]
+
+    def append(self, hashes, embeddings):
+        embeddings = np.ascontiguousarray(embeddings, dtype="<f4")
+        with self._lock, file_lock(self.lock_path):
+            # Another process may have appended since the index was last read
+            self._reload()
+            new = [i for i, sha256 in enumerate(hashes) if sha256 not in self._rows]
+            if new:
+                if self._dim is None:
+                    self._dim = embeddings.shape[1]
+                count = len(self._rows)
+                with open(self.data_path, "ab") as f:
+                    # Drop rows of an append that never made it into the index
+                    f.truncate(count * self._dim * 4)
+                    f.write(embeddings[new].tobytes())
+                for offset, i in enumerate(new):
+                    self._rows[hashes[i]] = count + offset
+                self._dirty = True
+            self._write_index()
+
+    def rows(self, hashes):
+        """[N, D] float32 array of cached embeddings, in the order of hashes"""
+        if not hashes:
+            # There may be no data file yet (and no known dimension) to map
+            return np.empty((0, self._dim or 0), dtype="<f4")
+        with self._lock:
+            indices = [self._rows[sha256] for sha256 in hashes]
+            matrix = np.memmap(self.data_path, dtype="<f4", mode="r", shape=(len(self._rows), self._dim))
+        return np.asarray(matrix[indices])
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            with file_lock(self.lock_path):
+                self._reload()
+                self._write_index()
+
+    def _write_index(self):
+        # Callers hold both locks
+        if not self._dirty:
+            return
+        index = {
+            "version": EMBEDDING_CACHE_VERSION,
+            "dim": self._dim,
+            "rows": self._rows,
+            "files": self._files,
+        }
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def _reload(self):
+        """Adopt the rows on disk, keeping content hashes learned since the last read"""
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable embedding cache index {self.index_path}: {e}")
+            return
+        if index.get("version") != EMBEDDING_CACHE_VERSION:
+            return
+
+        rows = index.get("rows", {})
+        dim = index.get("dim")
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        if rows and (dim is None or size < len(rows) * dim * 4 or sorted(rows.values()) != list(range(len(rows)))):
+            print(f"Ignoring inconsistent embedding cache {self.data_path}")
+            return
+        files = index.get("files", {})
+        files.update(self._files)
+        self._dim, self._rows, self._files = dim, rows, files
+
+
+def open_embedding_cache(model, transform, cache_dir=None):
+    """Shared cache for this model's checkpoint and transform, or None if the model has no checkpoint hash"""
+    encoder_hash = getattr(model, "checkpoint_hash", None)
+    cache_dir = cache_dir or EMBEDDING_CACHE_DIR
+    if encoder_hash is None or not cache_dir:
+        return None
+
+    key = (os.path.abspath(cache_dir), encoder_hash, transform_id(transform))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(cache_dir, encoder_hash, transform)
+        return _caches[key]
+
+
+def embed_dataset(model, data_dir, device="cpu", transform=inference_transform, batch_size=32, cache_dir=None):
+    """
+    Embed every image of an ImageFolder directory through the cache.
+    Returns (embeddings [N, D] on device, labels [N], class names).
+    """
+    dataset = ImageFolder(data_dir)
+    paths = [path for path, _ in dataset.samples]
+    labels = torch.tensor([label for _, label in dataset.samples], dtype=torch.long)
+    return embed_files(model, paths, device, transform, batch_size, cache_dir), labels, dataset.classes
+
+
+def embed_files(model, paths, device="cpu", transform=inference_transform, batch_size=32, cache_dir=None):
+    """Embed the given image files through the cache; returns [N, D] on device"""
+    cache = open_embedding_cache(model, transform, cache_dir)
+
+    if cache is None:
+        hashes = [file_sha256(path) for path in paths]
+        return embed_images(model, paths, hashes, transform, device, batch_size)
+
+    hashes = [cache.content_hash(path) for path in paths]
+    missing = cache.missing(hashes)
+    if missing:
+        print(f"Embedding {len(missing)} of {len(paths)} images (rest cached)")
+        first_path = {}
+        for path, sha256 in zip(paths, hashes):
+            first_path.setdefault(sha256, path)
+        embeddings = embed_images(model, [first_path[sha256] for sha256 in missing], missing, transform, device, batch_size)
+        cache.append(missing, embeddings.cpu().numpy())
+    else:
+        # Remember content hashes of files that were only touched
+        cache.save()
+
+    return torch.from_numpy(cache.rows(hashes)).to(device)
+
+
+def embed_images(model, paths, hashes, transform=inference_transform, device="cpu", batch_size=32):
+    loader = DataLoader(SeededImages(paths, hashes, transform), batch_size=batch_size, shuffle=False)
+    embeddings = []
+    with torch.no_grad():
+        for images in loader:
+            embeddings.append(model(images.to(device)))
+    if not embeddings:
+        return torch.empty(0, 0, device=device)
+    return torch.cat(embeddings)
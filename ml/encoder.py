@@ -1,11 +1,15 @@
 import torch
 import torch.nn as nn
 from torchvision import models
+from ml.artifacts import file_sha256
 
 class Encoder(nn.Module):
-    def __init__(self, embedding_dim=128):
+    def __init__(self, embedding_dim=128, pretrained=False):
         super().__init__()
-        backbone = models.mobilenet_v3_small(weights="DEFAULT")
+        # ImageNet weights are only useful as a starting point for fine-tuning;
+        # when a checkpoint is loaded afterwards they would be fetched and then
+        # overwritten, so the default builds the bare architecture offline.
+        backbone = models.mobilenet_v3_small(weights="DEFAULT" if pretrained else None)
         self.feature_extractor = backbone.features
         self.pool = nn.AdaptiveAvgPool2d((1, 1))
         self.embedding = nn.Linear(576, embedding_dim)
@@ -16,3 +20,20 @@ class Encoder(nn.Module):
         x = x.view(x.size(0), -1)
         x = self.embedding(x)
         return x
+
+
+def load_encoder(encoder_path, device="cpu"):
+    model = Encoder()
+    model.load_state_dict(torch.load(encoder_path, map_location=device))
+    model.to(device)
+    model.eval()
+    # Identifies the weights for ml.embedding_cache; not updated if the model is trained further
+    model.checkpoint_hash = file_sha256(encoder_path)
+    return model
+
+
+def resolve_encoder(encoder, device="cpu"):
+    # Callers may pass either a checkpoint path or an already-loaded Encoder
+    if isinstance(encoder, nn.Module):
+        return encoder
+    return load_encoder(encoder, device)
@@ -1,13 +1,22 @@
 import torch
-from torchvision.datasets import ImageFolder
-from torch.utils.data import DataLoader
+from ml.encoder import load_encoder
+from ml.embedding_cache import embed_dataset
 from ml.prototypes import compute_prototypes
 from ml.classifier import PrototypeClassifier
+from ml.transforms import inference_transform
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, ConfusionMatrixDisplay
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 
+def compute_metrics(y_true, y_pred):
+    return {
+        "accuracy": accuracy_score(y_true, y_pred),
+        "precision": precision_score(y_true, y_pred, average='weighted', zero_division=0),
+        "recall": recall_score(y_true, y_pred, average='weighted', zero_division=0),
+        "f1": f1_score(y_true, y_pred, average='weighted', zero_division=0),
+    }
+
 def evaluate_model():
     device = "cuda" if torch.cuda.is_available() else "cpu"
 
@@ -15,44 +24,32 @@ def evaluate_model():
     train_dir = r"data\fewshot\train"
     test_dir = r"data\fewshot\test"
 
+    model = load_encoder(encoder_path, device)
+
     print(f"Loading prototypes from {encoder_path}...")
     prototypes, class_names = compute_prototypes(
-        encoder_path, train_dir, device
+        model, train_dir, device
     )
 
     classifier = PrototypeClassifier(
-        encoder_path, prototypes, class_names, device
+        model, prototypes, class_names, device
     )
 
-    print(f"Loading test data from {test_dir}...")
-    dataset = ImageFolder(test_dir)
+    # Test embeddings come from the shared cache; only new images are embedded
+    print(f"Running inference on test set {test_dir}...")
+    embeddings, labels, _ = embed_dataset(model, test_dir, device, inference_transform)
     
-    y_true = []
-    y_pred = []
-
-    print("Running inference on test set...")
-    total = len(dataset)
-    for i, (image_path, label) in enumerate(dataset.samples):
-        if i % 10 == 0:
-            print(f"Processing {i}/{total} images...")
-        
-        pred, conf = classifier.predict(image_path)
-        true_label = class_names[label]
-        
-        y_true.append(true_label)
-        y_pred.append(pred)
+    y_true = [class_names[label] for label in labels.tolist()]
+    y_pred = [pred for pred, _, _ in classifier.predict_embeddings(embeddings)]
 
     # Metrics
-    accuracy = accuracy_score(y_true, y_pred)
-    precision = precision_score(y_true, y_pred, average='weighted', zero_division=0)
-    recall = recall_score(y_true, y_pred, average='weighted', zero_division=0)
-    f1 = f1_score(y_true, y_pred, average='weighted', zero_division=0)
+    metrics = compute_metrics(y_true, y_pred)
 
     print(f"\nModel Evaluation Metrics:")
-    print(f"Accuracy: {accuracy * 100:.2f}%")
-    print(f"Precision: {precision * 100:.2f}%")
-    print(f"Recall: {recall * 100:.2f}%")
-    print(f"F1-score: {f1 * 100:.2f}%")
+    print(f"Accuracy: {metrics['accuracy'] * 100:.2f}%")
+    print(f"Precision: {metrics['precision'] * 100:.2f}%")
+    print(f"Recall: {metrics['recall'] * 100:.2f}%")
+    print(f"F1-score: {metrics['f1'] * 100:.2f}%")
 
     # Confusion Matrix
     print("\nGenerating Confusion Matrix...")
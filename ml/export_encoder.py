@@ -0,0 +1,91 @@
+import argparse
+import sys
+import torch
+import torch.nn.functional as F
+from torchvision.datasets import ImageFolder
+from torch.utils.data import DataLoader
+
+from ml.artifacts import file_sha256
+from ml.encoder import load_encoder
+from ml.inference_backends import (
+    backend_path, write_export_metadata, TorchScriptBackend, OnnxRuntimeBackend
+)
+from ml.transforms import inference_transform
+
+
+def export_torchscript(model, path):
+    example = torch.randn(1, 3, 224, 224)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced)
+    torch.jit.save(frozen, path)
+
+
+def export_onnx(model, path):
+    example = torch.randn(1, 3, 224, 224)
+    torch.onnx.export(
+        model, example, path,
+        input_names=["input"], output_names=["embedding"],
+        dynamic_axes={"input": {0: "batch"}, "embedding": {0: "batch"}},
+        opset_version=17, dynamo=False
+    )
+
+
+def validate_parity(model, backend, test_dir, batch_size=32):
+    """Compare backend embeddings with eager embeddings on the test set"""
+    dataset = ImageFolder(test_dir, transform=inference_transform)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+
+    max_abs_diff = 0.0
+    min_cosine = 1.0
+    with torch.no_grad():
+        for images, _ in loader:
+            expected = model(images)
+            actual = backend.embed(images)
+            max_abs_diff = max(max_abs_diff, (expected - actual).abs().max().item())
+            min_cosine = min(min_cosine, F.cosine_similarity(expected, actual).min().item())
+
+    return {"images": len(dataset), "max_abs_diff": max_abs_diff, "min_cosine": min_cosine}
+
+
+def export_encoder(encoder_path, backends, test_dir, min_cosine):
+    model = load_encoder(encoder_path, "cpu")
+    encoder_hash = file_sha256(encoder_path)
+    ok = True
+
+    for name in backends:
+        path = backend_path(encoder_path, name)
+        print(f"Exporting {name} encoder to {path}...")
+        if name == "torchscript":
+            export_torchscript(model, path)
+            backend = TorchScriptBackend(path)
+        else:
+            export_onnx(model, path)
+            backend = OnnxRuntimeBackend(path)
+
+        parity = validate_parity(model, backend, test_dir)
+        print(f"  parity on {parity['images']} test images: "
+              f"max |diff| {parity['max_abs_diff']:.2e}, min cosine {parity['min_cosine']:.6f}")
+
+        if parity["min_cosine"] < min_cosine:
+            print(f"  FAILED: min cosine below {min_cosine}; export not marked as valid")
+            ok = False
+            continue
+
+        write_export_metadata(path, {"encoder_hash": encoder_hash, "backend": name, "parity": parity})
+        print(f"  OK: select with INFERENCE_BACKEND={name}")
+
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the encoder to compiled inference backends")
+    parser.add_argument("--encoder", default="ml/encoder_supcon.pth")
+    parser.add_argument("--backend", choices=["torchscript", "onnx", "all"], default="all")
+    parser.add_argument("--test-dir", default="data/fewshot/test")
+    parser.add_argument("--min-cosine", type=float, default=0.9999)
+    args = parser.parse_args()
+
+    backends = ["torchscript", "onnx"] if args.backend == "all" else [args.backend]
+    if not export_encoder(args.encoder, backends, args.test_dir, args.min_cosine):
+        sys.exit(1)
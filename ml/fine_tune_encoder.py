@@ -39,13 +39,17 @@ def fine_tune():
     print(f"Found {num_classes} classes. Training on {len(dataset)} images.")
 
     print("Loading Encoder...")
-    model = Encoder(embedding_dim=128)
+    model = None
     if os.path.exists(encoder_path):
         try:
+            model = Encoder(embedding_dim=128)
             model.load_state_dict(torch.load(encoder_path, map_location=device))
             print("Loaded existing weights.")
         except:
-            print("Could not load existing weights, starting from scratch (ImageNet/Random).")
+            model = None
+            print("Could not load existing weights, starting from scratch (ImageNet).")
+    if model is None:
+        model = Encoder(embedding_dim=128, pretrained=True)
     
     model.to(device)
 
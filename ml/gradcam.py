@@ -1,3 +1,4 @@
+import threading
 import torch
 import torch.nn.functional as F
 import numpy as np
@@ -8,44 +9,79 @@ class GradCAM:
     def __init__(self, model, target_layer):
         self.model = model
         self.target_layer = target_layer
-        self.gradients = None
-        self.activations = None
+        # Activations are kept per thread so a single GradCAM (and a single
+        # shared model) can serve concurrent requests.
+        self._local = threading.local()
         self._register_hooks()
 
     def _register_hooks(self):
         def forward_hook(module, input, output):
-            self.activations = output.detach()
-
-        def backward_hook(module, grad_input, grad_output):
-            self.gradients = grad_output[0].detach()
+            # Only keep the graph-attached activations for grad-enabled
+            # forwards; plain no_grad classification passes skip this.
+            if torch.is_grad_enabled():
+                self._local.activations = output
 
         self.target_layer.register_forward_hook(forward_hook)
-        self.target_layer.register_full_backward_hook(backward_hook)
+
+    def cam_from_score(self, score):
+        return self.cams_from_score(score)[0]
+
+    def cams_from_score(self, score):
+        return [upsample_cam(grid) for grid in self.grids_from_score(score)]
+
+    def grids_from_score(self, score):
+        """
+        Raw CAMs at the target layer's resolution (7x7 for a 224px input),
+        scaled to a max of 1: small enough to store, and upsample_cam turns
+        one into exactly what cams_from_score returns.
+        """
+        activations = self._local.activations
+        self._local.activations = None
+        # Differentiate w.r.t. the activations only, so no parameter .grad
+        # buffers are touched on the shared model. Samples in a batch are
+        # independent in eval mode, so one backward of the summed scores
+        # yields every per-sample gradient at once.
+        gradients = torch.autograd.grad(score, activations)[0]
+        weights = gradients.mean(dim=(2, 3), keepdim=True)
+        grids = (weights * activations.detach()).sum(dim=1)
+        grids = F.relu(grids).cpu().numpy()
+        return [grid / (grid.max() + 1e-8) for grid in grids]
+
+    def discard(self):
+        self._local.activations = None
 
     def generate(self, input_tensor, class_idx):
-        self.model.zero_grad()
-        output = self.model(input_tensor)
-        score = output[:, class_idx]
-        score.backward()
-        weights = self.gradients.mean(dim=(2, 3), keepdim=True)
-        cam = (weights * self.activations).sum(dim=1)
-        cam = F.relu(cam)
-        cam = cam.squeeze().cpu().numpy()
-        cam = cv2.resize(cam, (224, 224))
-        cam = (cam - cam.min()) / (cam.max() + 1e-8)
-        return cam
+        with torch.enable_grad():
+            output = self.model(input_tensor)
+            score = output[:, class_idx].sum()
+            return self.cam_from_score(score)
 
     def generate_from_prototype(self, input_tensor, prototype):
-        self.model.zero_grad()
-        embedding = self.model(input_tensor)
-        embedding_norm = F.normalize(embedding, dim=1)
-        prototype_norm = F.normalize(prototype.unsqueeze(0), dim=1)
-        score = (embedding_norm * prototype_norm).sum()
-        score.backward()
-        weights = self.gradients.mean(dim=(2, 3), keepdim=True)
-        cam = (weights * self.activations).sum(dim=1)
-        cam = F.relu(cam)
-        cam = cam.squeeze().cpu().numpy()
-        cam = cv2.resize(cam, (224, 224))
-        cam = (cam - cam.min()) / (cam.max() + 1e-8)
-        return cam
+        with torch.enable_grad():
+            embedding = self.model(input_tensor)
+            embedding_norm = F.normalize(embedding, dim=1)
+            prototype_norm = F.normalize(prototype.unsqueeze(0), dim=1)
+            score = (embedding_norm * prototype_norm).sum()
+            return self.cam_from_score(score)
+
+
+def threshold_cam(cam, cutoff=0.4):
+    # Filter background noise and report the fraction of the image that
+    # stays activated.
+    cam = cam.copy()
+    cam[cam < cutoff] = 0
+    cam_coverage = float((cam > 0.0).sum() / cam.size)
+    return cam, cam_coverage
+
+
+def upsample_cam(grid, size=224):
+    cam = cv2.resize(np.asarray(grid, dtype=np.float32), (size, size))
+    return (cam - cam.min()) / (cam.max() + 1e-8)
+
+
+def render_overlay(base_rgb, grid, alpha=0.4, colormap=cv2.COLORMAP_JET):
+    """Blend the thresholded CAM heatmap over an RGB crop; returns a BGR image"""
+    cam, _ = threshold_cam(upsample_cam(grid, base_rgb.shape[0]))
+    img_bgr = cv2.cvtColor(base_rgb, cv2.COLOR_RGB2BGR)
+    heatmap = cv2.applyColorMap(np.uint8(255 * cam), colormap)
+    return cv2.addWeighted(img_bgr, 1 - alpha, heatmap, alpha, 0)
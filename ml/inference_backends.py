@@ -0,0 +1,104 @@
+import json
+import os
+import torch
+
+INFERENCE_BACKENDS = ("eager", "torchscript", "onnx", "int8")
+
+
+def backend_path(encoder_path, backend):
+    base, _ = os.path.splitext(encoder_path)
+    if backend == "torchscript":
+        return f"{base}.torchscript.pt"
+    if backend == "onnx":
+        return f"{base}.onnx"
+    if backend == "int8":
+        return f"{base}.int8.torchscript.pt"
+    raise ValueError(f"Unknown exported backend: {backend}")
+
+
+def read_export_metadata(path):
+    metadata_path = f"{path}.json"
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path) as f:
+        return json.load(f)
+
+
+def write_export_metadata(path, metadata):
+    with open(f"{path}.json", "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+class EagerBackend:
+    name = "eager"
+
+    def __init__(self, model):
+        self.model = model
+
+    def embed(self, images):
+        with torch.no_grad():
+            return self.model(images)
+
+
+class TorchScriptBackend:
+    name = "torchscript"
+
+    def __init__(self, path, device="cpu", name=None):
+        if name is not None:
+            self.name = name
+        self.device = device
+        self.model = torch.jit.load(path, map_location=device)
+        self.model.eval()
+
+    def embed(self, images):
+        with torch.inference_mode():
+            return self.model(images.to(self.device)).clone()
+
+
+class OnnxRuntimeBackend:
+    name = "onnx"
+
+    def __init__(self, path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx inference backend requires the onnxruntime package")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def embed(self, images):
+        outputs = self.session.run(None, {self.input_name: images.detach().cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+def load_inference_backend(name, model, encoder_path, encoder_hash=None, device="cpu", num_threads=None):
+    """
+    Build the embedding backend for the classification path. Exported
+    backends must have been produced from the same checkpoint (matching
+    encoder hash); Grad-CAM always keeps using the eager model.
+    """
+    if name == "eager":
+        return EagerBackend(model)
+    if name not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}'. Choose from {INFERENCE_BACKENDS}")
+
+    path = backend_path(encoder_path, name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Exported {name} encoder not found at {path}; run python -m ml.export_encoder")
+
+    metadata = read_export_metadata(path)
+    if encoder_hash is not None and (metadata is None or metadata.get("encoder_hash") != encoder_hash):
+        raise ValueError(f"Exported {name} encoder at {path} was not built from the current checkpoint")
+
+    if name == "torchscript":
+        return TorchScriptBackend(path, device)
+    if name == "int8":
+        # Quantized kernels are CPU-only and must use the engine they were calibrated for
+        torch.backends.quantized.engine = metadata.get("engine", torch.backends.quantized.engine)
+        return TorchScriptBackend(path, "cpu", name="int8")
+    return OnnxRuntimeBackend(path, num_threads)
@@ -0,0 +1,67 @@
+import io
+import numpy as np
+from PIL import Image
+from torchvision import transforms
+
+from ml.transforms import inference_resize, to_model_input
+
+# Shorter side that inference_resize scales to before the center crop
+DECODE_SIZE = 256
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+def decode_image(source, size=DECODE_SIZE):
+    """
+    Decode an upload (bytes or path) straight to RGB. For JPEGs, draft mode
+    lets libjpeg scale by 1/2, 1/4 or 1/8 while decoding, keeping both sides
+    >= size, so a 12MP phone photo is never materialized at full resolution.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        image = Image.open(source)
+        image.draft("RGB", (size, size))
+        return image.convert("RGB")
+    except Exception as e:
+        raise InvalidImageError(f"Could not decode image: {e}")
+
+
+def ingest_image(source, device="cpu"):
+    """Decode once and return the [1, 3, 224, 224] normalized model input"""
+    crop = inference_resize(decode_image(source))
+    return to_model_input(crop).unsqueeze(0).to(device)
+
+
+def overlay_base(source, size=224):
+    """
+    The RGB crop a Grad-CAM overlay is drawn on, rendered at size x size:
+    the same resize + center crop as inference, scaled (224 gives exactly
+    the model's crop).
+    """
+    resize = round(size * DECODE_SIZE / 224)
+    crop = transforms.Compose([transforms.Resize(resize), transforms.CenterCrop(size)])
+    return np.asarray(crop(decode_image(source, resize)))
+
+
+def ingest_frame(source, device="cpu"):
+    """Decode a live camera frame once; returns (input_tensor, dhash)"""
+    image = decode_image(source)
+    return to_model_input(inference_resize(image)).unsqueeze(0).to(device), dhash(image)
+
+
+def dhash(image, hash_size=8):
+    """
+    64-bit difference hash of a decoded image: compares neighbouring pixels
+    of a tiny grayscale thumbnail, so it survives recompression, small
+    exposure changes and sensor noise between consecutive camera frames.
+    """
+    small = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hash_distance(a, b):
+    return bin(a ^ b).count("1")
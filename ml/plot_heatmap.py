@@ -1,9 +1,9 @@
 import torch
-import torch.nn.functional as F
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 from ml.prototypes import compute_prototypes
+from ml.prototype_bank import PrototypeBank
 
 def plot_similarity_heatmap():
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -14,10 +14,10 @@ def plot_similarity_heatmap():
     prototypes, class_names = compute_prototypes(
         encoder_path, train_dir, device
     )
+    bank = PrototypeBank(prototypes, class_names, device)
     sorted_indices = np.argsort(class_names)
     start_names = [class_names[i] for i in sorted_indices]
-    proto_tensor = torch.stack([prototypes[i] for i in sorted_indices])
-    proto_tensor = F.normalize(proto_tensor, dim=1)
+    proto_tensor = bank.class_prototypes()[torch.as_tensor(sorted_indices, device=bank.device)]
     similarity_matrix = torch.mm(proto_tensor, proto_tensor.t()).cpu().numpy()
     plt.figure(figsize=(12, 10))
     plt.imshow(similarity_matrix, cmap='RdYlBu_r', interpolation='nearest')
@@ -0,0 +1,97 @@
+import torch
+import torch.nn.functional as F
+
+
+class PrototypeBank:
+    """
+    Pre-normalized, contiguous prototype matrix with an index-to-name table.
+
+    Each class may own several sub-prototypes (rows); a class scores as the
+    best of its rows. All scoring for a batch of embeddings is a single
+    [B, D] x [D, M] matmul, so cost stays flat as the class count grows.
+    """
+
+    def __init__(self, prototypes, class_names, device="cpu"):
+        rows = []
+        owners = []
+        for label in sorted(prototypes):
+            prototype = prototypes[label].detach().float()
+            if prototype.dim() == 1:
+                prototype = prototype.unsqueeze(0)
+            rows.append(prototype)
+            owners.extend([label] * prototype.shape[0])
+
+        self.device = device
+        self.class_names = list(class_names)
+        self.num_classes = len(self.class_names)
+        self.matrix = F.normalize(torch.cat(rows), dim=1).to(device).contiguous()
+        self.owners = torch.tensor(owners, dtype=torch.long, device=device)
+        self._one_row_per_class = (
+            len(owners) == self.num_classes and owners == list(range(self.num_classes))
+        )
+
+    def __len__(self):
+        return self.num_classes
+
+    @property
+    def embedding_dim(self):
+        return self.matrix.shape[1]
+
+    def name(self, label):
+        return self.class_names[label]
+
+    def row_scores(self, embeddings):
+        embeddings = F.normalize(embeddings.to(self.device), dim=1)
+        return embeddings @ self.matrix.T
+
+    def class_scores(self, embeddings):
+        """Cosine similarity of each embedding to each class, shape [B, C]"""
+        scores = self.row_scores(embeddings)
+        if self._one_row_per_class:
+            return scores
+        out = torch.full(
+            (scores.shape[0], self.num_classes), float("-inf"),
+            dtype=scores.dtype, device=scores.device
+        )
+        return out.scatter_reduce(
+            1, self.owners.expand(scores.shape[0], -1), scores, reduce="amax"
+        )
+
+    def topk(self, embeddings, k=2):
+        k = min(k, self.num_classes)
+        return self.class_scores(embeddings).topk(k, dim=1)
+
+    def decide(self, embeddings, threshold, margin_threshold=0.01):
+        """
+        Open-set decision for a batch of embeddings.
+        Returns (labels, scores, margins); labels is -1 where the sample is
+        rejected as UNKNOWN (best score below threshold or ambiguous margin).
+        """
+        top_scores, top_labels = self.topk(embeddings, k=2)
+        scores = top_scores[:, 0]
+        labels = top_labels[:, 0].clone()
+        if top_scores.shape[1] > 1:
+            margins = top_scores[:, 0] - top_scores[:, 1]
+        else:
+            margins = torch.ones_like(scores)
+
+        unknown = (scores < threshold) | (margins < margin_threshold)
+        labels[unknown] = -1
+        return labels, scores, margins
+
+    def winning_prototypes(self, embeddings, labels):
+        """Best-matching (normalized) sub-prototype row of each given class, shape [B, D]"""
+        labels = torch.as_tensor(labels, device=self.device)
+        if self._one_row_per_class:
+            return self.matrix[labels]
+        scores = self.row_scores(embeddings.detach())
+        scores = scores.masked_fill(self.owners[None, :] != labels[:, None], float("-inf"))
+        return self.matrix[scores.argmax(dim=1)]
+
+    def class_prototypes(self):
+        """One normalized vector per class (mean of its sub-prototypes), shape [C, D]"""
+        if self._one_row_per_class:
+            return self.matrix
+        sums = torch.zeros(self.num_classes, self.embedding_dim, device=self.device)
+        sums.index_add_(0, self.owners, self.matrix)
+        return F.normalize(sums, dim=1)
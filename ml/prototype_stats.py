@@ -0,0 +1,106 @@
+import torch
+
+
+class SimilarityHistogram:
+    """
+    Streaming quantile sketch for cosine similarities: fixed-width bins over
+    [-1, 1]. Insertion is O(1) per value, memory is constant, and quantiles
+    are exact to within one bin width (2 / bins).
+    """
+
+    def __init__(self, bins=4000, counts=None):
+        self.bins = bins
+        self.counts = counts.clone().long() if counts is not None else torch.zeros(bins, dtype=torch.long)
+
+    @property
+    def width(self):
+        return 2.0 / self.bins
+
+    def __len__(self):
+        return int(self.counts.sum().item())
+
+    def add(self, similarities):
+        index = ((similarities.detach().cpu().double().clamp(-1.0, 1.0) + 1.0) / self.width).long()
+        self.counts += torch.bincount(index.clamp(max=self.bins - 1), minlength=self.bins)
+
+    def quantile(self, q):
+        """Like torch.quantile (linear between order statistics), to within one bin"""
+        total = len(self)
+        if total == 0:
+            raise ValueError("empty histogram")
+        rank = q * (total - 1)
+        cumulative = torch.cumsum(self.counts, 0)
+        lower = self._order_statistic(int(rank), cumulative)
+        upper = self._order_statistic(min(int(rank) + 1, total - 1), cumulative)
+        return lower + (rank - int(rank)) * (upper - lower)
+
+    def _order_statistic(self, k, cumulative):
+        # Bin holding the k-th smallest value; its values are taken as evenly spread across it
+        b = int(torch.searchsorted(cumulative, torch.tensor([k + 1])).item())
+        before = cumulative[b - 1].item() if b > 0 else 0
+        return -1.0 + (b + (k - before + 0.5) / self.counts[b].item()) * self.width
+
+    def copy(self):
+        return SimilarityHistogram(self.bins, self.counts)
+
+
+class PrototypeStats:
+    """
+    Running per-class embedding sums and counts (float64), so mean prototypes
+    can absorb new training images without re-embedding the old ones, plus the
+    similarity histogram the open-set threshold is read from.
+    """
+
+    def __init__(self, sums, counts, histogram=None):
+        self.sums = sums
+        self.counts = counts
+        self.histogram = histogram if histogram is not None else SimilarityHistogram()
+
+    @classmethod
+    def from_embeddings(cls, embeddings, labels, class_names):
+        embeddings = embeddings.detach().cpu().double()
+        labels = labels.cpu()
+        sums, counts = {}, {}
+        for label, name in enumerate(class_names):
+            members = embeddings[labels == label]
+            if len(members):
+                sums[name] = members.sum(dim=0)
+                counts[name] = len(members)
+        return cls(sums, counts)
+
+    @property
+    def class_names(self):
+        # Same order as ImageFolder, so incremental and full rebuilds agree on labels
+        return sorted(self.sums)
+
+    def add(self, class_name, embeddings):
+        embeddings = embeddings.detach().cpu().double()
+        if class_name in self.sums:
+            self.sums[class_name] = self.sums[class_name] + embeddings.sum(dim=0)
+            self.counts[class_name] += len(embeddings)
+        else:
+            self.sums[class_name] = embeddings.sum(dim=0)
+            self.counts[class_name] = len(embeddings)
+
+    def prototypes(self):
+        """({label: mean embedding}, class_names), like compute_prototypes"""
+        class_names = self.class_names
+        prototypes = {
+            label: (self.sums[name] / self.counts[name]).float() for label, name in enumerate(class_names)
+        }
+        return prototypes, class_names
+
+    def copy(self):
+        return PrototypeStats(dict(self.sums), dict(self.counts), self.histogram.copy())
+
+    def state_dict(self):
+        return {
+            "sums": {name: total.clone() for name, total in self.sums.items()},
+            "counts": dict(self.counts),
+            "histogram": self.histogram.counts.clone(),
+        }
+
+    @classmethod
+    def from_state_dict(cls, state):
+        histogram = state["histogram"]
+        return cls(dict(state["sums"]), dict(state["counts"]), SimilarityHistogram(len(histogram), histogram))
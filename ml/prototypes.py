@@ -1,38 +1,41 @@
 import torch
-from torchvision.datasets import ImageFolder
-from torch.utils.data import DataLoader
-from ml.encoder import Encoder
+import torch.nn.functional as F
+from ml.encoder import resolve_encoder
+from ml.embedding_cache import embed_dataset
+from ml.prototype_stats import PrototypeStats
 from ml.transforms import train_transform
 import os
 
-def compute_prototypes(encoder_path,data_dir,device="cpu"):
-    model = Encoder()
-    model.load_state_dict(torch.load(encoder_path, map_location=device))
-    model.to(device)
-    model.eval()
+def compute_prototypes(encoder_path,data_dir,device="cpu",num_sub_prototypes=1,transform=train_transform):
+    model = resolve_encoder(encoder_path, device)
 
-    dataset = ImageFolder(data_dir, transform=train_transform)
-    loader = DataLoader(dataset, batch_size=16, shuffle=False)
+    # Cached per image, so only new or changed images go through the encoder
+    embeddings, labels, class_names = embed_dataset(model, data_dir, device, transform)
+
+    if num_sub_prototypes == 1:
+        # Class means via running sums, exactly as MLService updates them incrementally
+        prototypes, _ = PrototypeStats.from_embeddings(embeddings, labels, class_names).prototypes()
+        return {label: prototype.to(embeddings.device) for label, prototype in prototypes.items()}, class_names
 
     prototypes = {}
-    counts = {}
-
-    with torch.no_grad():
-        for images, labels in loader:
-            images = images.to(device)
-            labels = labels.to(device)
-            features = model(images)
-
-            for feature, label in zip(features, labels):
-                label = label.item()
-                if label not in prototypes:
-                    prototypes[label] = feature.clone()
-                    counts[label] = 1
-                else:
-                    prototypes[label] += feature
-                    counts[label] += 1
-
-    for label in prototypes:
-        prototypes[label] /= counts[label]
-
-    return prototypes, dataset.classes
+    for label in labels.unique().tolist():
+        features = embeddings[(labels == label).to(embeddings.device)]
+        prototypes[label] = cluster_sub_prototypes(features, num_sub_prototypes)
+
+    return prototypes, class_names
+
+
+def cluster_sub_prototypes(features, k, iterations=10):
+    # Spherical k-means; returns [k', D] centroids (k' <= k for small classes)
+    features = F.normalize(features, dim=1)
+    k = min(k, features.shape[0])
+    centroids = features[torch.linspace(0, features.shape[0] - 1, k).long()].clone()
+
+    for _ in range(iterations):
+        assignment = (features @ centroids.T).argmax(dim=1)
+        for c in range(k):
+            members = features[assignment == c]
+            if len(members) > 0:
+                centroids[c] = F.normalize(members.mean(dim=0), dim=0)
+
+    return centroids
@@ -0,0 +1,134 @@
+import argparse
+import copy
+import sys
+import torch
+from torchvision.datasets import ImageFolder
+from torch.utils.data import DataLoader
+from torch.ao.quantization import get_default_qconfig_mapping
+# Deliberately FX rather than PT2E: the INT8 backend is served as a traced
+# TorchScript module (torch.jit.load), which convert_fx output exports to
+# directly; PT2E produces torch.export programs instead
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from ml.artifacts import file_sha256, load_served_prototypes
+from ml.embedding_cache import embed_dataset
+from ml.encoder import load_encoder
+from ml.evaluate import compute_metrics
+from ml.inference_backends import backend_path, write_export_metadata
+from ml.prototype_bank import PrototypeBank
+from ml.transforms import inference_transform
+
+
+# The stem and first inverted-residual block see heavy-tailed activations that
+# a per-tensor uint8 scale cannot represent; leaving them in FP32 costs little
+DEFAULT_FP32_MODULES = ("feature_extractor.0", "feature_extractor.1")
+
+
+def quantize_static(model, calibration_loader, engine="x86", fp32_modules=DEFAULT_FP32_MODULES):
+    """FX graph mode post-training static quantization, calibrated on real images"""
+    torch.backends.quantized.engine = engine
+    qconfig_mapping = get_default_qconfig_mapping(engine)
+    for name in fp32_modules:
+        qconfig_mapping.set_module_name(name, None)
+
+    example = torch.randn(1, 3, 224, 224)
+    prepared = prepare_fx(copy.deepcopy(model).eval(), qconfig_mapping, (example,))
+
+    with torch.no_grad():
+        for images, _ in calibration_loader:
+            prepared(images)
+
+    return convert_fx(prepared)
+
+
+def embed_loader(model, loader):
+    embeddings = []
+    labels = []
+    with torch.no_grad():
+        for images, batch_labels in loader:
+            embeddings.append(model(images))
+            labels.append(batch_labels)
+    return torch.cat(embeddings), torch.cat(labels)
+
+
+def score_embeddings(bank, embeddings, labels, threshold):
+    """Closed-set top-1 and open-set (UNKNOWN counts as wrong) metrics from ml.evaluate"""
+    y_true = [bank.name(label) for label in labels.tolist()]
+
+    top1 = bank.topk(embeddings, k=1).indices[:, 0].tolist()
+    closed = compute_metrics(y_true, [bank.name(label) for label in top1])
+
+    decided, _, _ = bank.decide(embeddings, threshold)
+    open_pred = [bank.name(label) if label >= 0 else "UNKNOWN" for label in decided.tolist()]
+    open_set = compute_metrics(y_true, open_pred)
+
+    return {"top1": closed, "open_set": open_set}
+
+
+def quantize_encoder(encoder_path, artifact_path, train_dir, test_dir, tolerance, engine="x86",
+                     fp32_modules=DEFAULT_FP32_MODULES):
+    device = "cpu"
+    model = load_encoder(encoder_path, device)
+
+    print(f"Calibrating INT8 encoder on {train_dir}...")
+    calibration = DataLoader(ImageFolder(train_dir, transform=inference_transform), batch_size=16)
+    quantized = quantize_static(model, calibration, engine, fp32_modules)
+
+    # Serving keeps its FP32 prototypes/threshold and swaps only the query embeddings,
+    # so gate on exactly the bank and threshold MLService serves
+    prototypes, class_names, threshold = load_served_prototypes(model, model.checkpoint_hash, artifact_path, train_dir)
+    bank = PrototypeBank(prototypes, class_names, device)
+
+    # FP32 test embeddings come from the shared cache; the INT8 model has no checkpoint hash
+    fp32_embeddings, labels, _ = embed_dataset(model, test_dir, device, inference_transform)
+    test_loader = DataLoader(ImageFolder(test_dir, transform=inference_transform), batch_size=32)
+    int8_embeddings, _ = embed_loader(quantized, test_loader)
+
+    fp32 = score_embeddings(bank, fp32_embeddings, labels, threshold)
+    int8 = score_embeddings(bank, int8_embeddings, labels, threshold)
+
+    print(f"\n{'Metric':<20}{'FP32':>10}{'INT8':>10}{'Delta':>10}")
+    deltas = {}
+    for mode in ("top1", "open_set"):
+        for metric in ("accuracy", "f1"):
+            delta = int8[mode][metric] - fp32[mode][metric]
+            deltas[f"{mode}_{metric}"] = delta
+            print(f"{mode + ' ' + metric:<20}{fp32[mode][metric] * 100:>9.2f}%{int8[mode][metric] * 100:>9.2f}%{delta * 100:>+9.2f}%")
+
+    accuracy_drop = max(-deltas["top1_accuracy"], -deltas["open_set_accuracy"])
+    if accuracy_drop > tolerance:
+        print(f"\nRefusing to export: accuracy dropped {accuracy_drop * 100:.2f}% (tolerance {tolerance * 100:.2f}%)")
+        return False
+
+    path = backend_path(encoder_path, "int8")
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(quantized, torch.randn(1, 3, 224, 224)))
+    torch.jit.save(scripted, path)
+    write_export_metadata(path, {
+        "encoder_hash": file_sha256(encoder_path),
+        "backend": "int8",
+        "engine": engine,
+        "fp32_modules": list(fp32_modules),
+        "fp32": fp32,
+        "int8": int8,
+    })
+    print(f"\nINT8 encoder saved to {path}; select with INFERENCE_BACKEND=int8")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-training INT8 static quantization of the encoder")
+    parser.add_argument("--encoder", default="ml/encoder_supcon.pth")
+    parser.add_argument("--prototypes", default="ml/prototypes.pt")
+    parser.add_argument("--train-dir", default="data/fewshot/train")
+    parser.add_argument("--test-dir", default="data/fewshot/test")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="max allowed accuracy drop (fraction)")
+    parser.add_argument("--engine", default="x86", choices=["x86", "fbgemm", "qnnpack", "onednn"])
+    parser.add_argument("--fp32-modules", default=",".join(DEFAULT_FP32_MODULES),
+                        help="comma-separated module names kept in FP32 (empty to quantize everything)")
+    args = parser.parse_args()
+
+    fp32_modules = [name for name in args.fp32_modules.split(",") if name]
+    if not quantize_encoder(args.encoder, args.prototypes, args.train_dir, args.test_dir, args.tolerance, args.engine,
+                            fp32_modules=fp32_modules):
+        sys.exit(1)
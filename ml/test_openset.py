@@ -1,7 +1,7 @@
 import torch
-import torch.nn.functional as F
-from ml.encoder import Encoder
+from ml.encoder import load_encoder
 from ml.prototypes import compute_prototypes
+from ml.prototype_bank import PrototypeBank
 from torchvision import transforms
 from PIL import Image
 import os
@@ -11,16 +11,14 @@ def test_openset():
     encoder_path = r"ml\encoder_supcon.pth"
     train_dir = r"data\fewshot\train"
 
+    model = load_encoder(encoder_path, device)
+    prototypes, class_names = compute_prototypes(model, train_dir, device)
+    bank = PrototypeBank(prototypes, class_names, device)
+
     from ml.threshold import compute_open_set_threshold
-    threshold = compute_open_set_threshold(encoder_path, train_dir, device=device)
+    threshold = compute_open_set_threshold(model, train_dir, device=device, bank=bank)
     print(f"Computed Threshold: {threshold:.4f}")
     
-    model = Encoder()
-    model.load_state_dict(torch.load(encoder_path, map_location=device))
-    model.to(device)
-    model.eval()
-    prototypes, class_names = compute_prototypes(encoder_path, train_dir, device)
-    
     transform = transforms.Compose([
         transforms.Resize((224, 224)),
         transforms.ToTensor(),
@@ -34,13 +32,7 @@ def test_openset():
     
     with torch.no_grad():
         emb_known = model(data_known)
-        emb_known = F.normalize(emb_known, dim=1)
-        
-        max_sim = -1
-        for label, proto in prototypes.items():
-            sim = F.cosine_similarity(emb_known, proto.unsqueeze(0).to(device)).item()
-            if sim > max_sim:
-                max_sim = sim
+        max_sim = bank.class_scores(emb_known).max().item()
                 
     print(f"Max Similarity: {max_sim:.4f}")
     if max_sim >= threshold:
@@ -53,13 +45,7 @@ def test_openset():
     
     with torch.no_grad():
         emb_unknown = model(img_unknown)
-        emb_unknown = F.normalize(emb_unknown, dim=1)
-        
-        max_sim_unknown = -1
-        for label, proto in prototypes.items():
-            sim = F.cosine_similarity(emb_unknown, proto.unsqueeze(0).to(device)).item()
-            if sim > max_sim_unknown:
-                max_sim_unknown = sim
+        max_sim_unknown = bank.class_scores(emb_unknown).max().item()
                 
     print(f"Max Similarity: {max_sim_unknown:.4f}")
     if max_sim_unknown >= threshold:
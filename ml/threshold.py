@@ -1,32 +1,27 @@
 import torch
-import torch.nn.functional as F
-from torchvision.datasets import ImageFolder
-from ml.encoder import Encoder
+from ml.encoder import resolve_encoder
+from ml.embedding_cache import embed_dataset
 from ml.prototypes import compute_prototypes
+from ml.prototype_bank import PrototypeBank
 from ml.transforms import train_transform
 
-def compute_open_set_threshold(encoder_path,train_dir,device="cpu",percentile=0.5):
-    model = Encoder()
-    model.load_state_dict(torch.load(encoder_path, map_location=device))
-    model.to(device)
-    model.eval()
+def compute_open_set_threshold(encoder_path,train_dir,device="cpu",percentile=0.5,bank=None):
+    model = resolve_encoder(encoder_path, device)
 
-    prototypes, class_names = compute_prototypes(encoder_path, train_dir, device)
-    dataset = ImageFolder(train_dir, transform=train_transform)
-    similarities = []
+    if bank is None:
+        prototypes, class_names = compute_prototypes(model, train_dir, device)
+        bank = PrototypeBank(prototypes, class_names, device)
 
-    with torch.no_grad():
-        for img, label in dataset:
-            img = img.unsqueeze(0).to(device)
-            emb = model(img)
-            emb = F.normalize(emb, dim=1)
+    # Same cached train_transform embeddings the prototypes were built from
+    embeddings, labels, _ = embed_dataset(model, train_dir, device, train_transform)
+    similarities = own_class_similarities(bank, embeddings, labels)
 
-            proto = prototypes[label].unsqueeze(0).to(device)
-            proto = F.normalize(proto, dim=1)
+    threshold = torch.quantile(similarities,percentile / 100).item()
 
-            sim = F.cosine_similarity(emb, proto)
-            similarities.append(sim.item())
+    return threshold
 
-    threshold = torch.quantile(torch.tensor(similarities),percentile / 100).item()
 
-    return threshold
+def own_class_similarities(bank, embeddings, labels):
+    """Cosine similarity of each embedding to its own class, on CPU"""
+    scores = bank.class_scores(embeddings)
+    return scores.gather(1, labels.to(scores.device).unsqueeze(1)).squeeze(1).cpu()
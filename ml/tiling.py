@@ -0,0 +1,77 @@
+"""
+Tiled inference for drone / high-resolution canopy imagery
+
+A large frame is split into overlapping square tiles at leaf scale; every
+tile is resized to the encoder input, embedded in batches and classified
+against the prototype bank, giving a per-tile disease map instead of one
+label for a 224px center crop. Tiles are cropped from the decoded image
+one batch at a time, so only `batch_size` crops exist at once.
+"""
+import torch
+from PIL import Image
+
+from ml.ingest import decode_image
+from ml.transforms import to_model_input
+
+TILE_SIZE = 512
+TILE_OVERLAP = 0.25
+TILE_BATCH_SIZE = 16
+# Frames are decoded at full resolution up to this many pixels per side
+MAX_SIDE = 8192
+
+
+def decode_for_tiling(source, max_side=MAX_SIDE):
+    # Draft mode only shrinks JPEGs while both sides stay >= max_side
+    image = decode_image(source, max_side)
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    return image
+
+
+def tile_positions(length, tile_size, stride):
+    """Tile offsets along one axis; the last tile is flush with the edge"""
+    if length <= tile_size:
+        return [0]
+    positions = list(range(0, length - tile_size + 1, stride))
+    if positions[-1] != length - tile_size:
+        positions.append(length - tile_size)
+    return positions
+
+
+def tile_grid(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Return (xs, ys, tile_size, stride); tiles never exceed the image's short side"""
+    tile_size = min(tile_size, width, height)
+    stride = max(1, round(tile_size * (1 - overlap)))
+    return tile_positions(width, tile_size, stride), tile_positions(height, tile_size, stride), tile_size, stride
+
+
+def iter_tile_batches(image, xs, ys, tile_size, batch_size=TILE_BATCH_SIZE):
+    """Yield (boxes, [B, 3, 224, 224]) in row-major tile order, cropping lazily"""
+    boxes, tensors = [], []
+    for y in ys:
+        for x in xs:
+            box = (x, y, x + tile_size, y + tile_size)
+            crop = image.crop(box).resize((224, 224), Image.BILINEAR)
+            boxes.append(box)
+            tensors.append(to_model_input(crop))
+            if len(tensors) == batch_size:
+                yield boxes, torch.stack(tensors)
+                boxes, tensors = [], []
+    if tensors:
+        yield boxes, torch.stack(tensors)
+
+
+def classify_tiles(classifier, image, threshold, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                   batch_size=TILE_BATCH_SIZE):
+    """
+    Classify every tile of a decoded image with a PrototypeClassifier.
+    Returns (tiles, xs, ys, tile_size, stride); tiles holds one
+    (x, y, label, score) per tile in row-major order, label "UNKNOWN" for
+    tiles rejected by the open-set threshold (soil, sky, blur).
+    """
+    xs, ys, tile_size, stride = tile_grid(image.width, image.height, tile_size, overlap)
+    tiles = []
+    for boxes, batch in iter_tile_batches(image, xs, ys, tile_size, batch_size):
+        for (x, y, _, _), (label, score, _) in zip(boxes, classifier.predict_batch(batch, threshold)):
+            tiles.append((x, y, label, score))
+    return tiles, xs, ys, tile_size, stride
@@ -10,10 +10,16 @@ train_transform = transforms.Compose([
     transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
 ])
 
-# Inference transform
-inference_transform = transforms.Compose([
+# Inference transform, split so the serving path can decode + crop once and
+# ml.ingest.overlay_base can reproduce the crop for Grad-CAM overlays
+inference_resize = transforms.Compose([
     transforms.Resize(256),
-    transforms.CenterCrop(224),
+    transforms.CenterCrop(224)
+])
+
+to_model_input = transforms.Compose([
     transforms.ToTensor(),
     transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
\ No newline at end of file
+])
+
+inference_transform = transforms.Compose([inference_resize, to_model_input])
\ No newline at end of file
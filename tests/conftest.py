@@ -0,0 +1,172 @@
+"""
+Shared fixtures: the FastAPI app on an in-memory SQLite database with
+authentication stubbed out, and a tiny stand-in encoder so no checkpoint
+or pretrained weights are needed.
+"""
+import io
+import os
+import tempfile
+from contextlib import asynccontextmanager
+
+os.environ.setdefault("DB_USER", "test")
+os.environ.setdefault("DB_PASSWORD", "test")
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp(prefix="agroai-uploads-"))
+os.environ.setdefault("GRADCAM_OUTPUT_DIR", tempfile.mkdtemp(prefix="agroai-gradcam-"))
+os.environ.setdefault("EMBEDDING_CACHE_DIR", tempfile.mkdtemp(prefix="agroai-embeddings-"))
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import database
+
+# Swap MySQL for SQLite before anything opens a session. A file rather than
+# an in-memory database, so I/O executor threads get their own connections
+database.engine = create_engine(
+    f"sqlite:///{tempfile.mkdtemp(prefix='agroai-db-')}/test.db", connect_args={"check_same_thread": False}
+)
+database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=database.engine)
+
+from backend import models
+from backend.advisory_pipeline import advisory_pipeline
+from backend.app import app
+from backend.auth_utils import get_current_active_user, get_current_admin_user, get_current_user
+from backend.inference_batcher import inference_batcher, label_batcher
+from backend.ml_service import ml_service
+from backend.result_cache import ResultCache
+from backend.routers import diagnosis
+from ml.classifier import PrototypeClassifier
+from ml.gradcam import GradCAM
+from ml.prototype_bank import PrototypeBank
+
+EMBEDDING_DIM = 16
+ENCODER_HASH = "ab" * 32
+
+
+def leaf_jpeg(seed=0, size=(320, 240)):
+    """A random-noise photo as JPEG bytes; different seeds give different photos"""
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class TinyEncoder(nn.Module):
+    """
+    Deterministic [B, 3, H, W] -> [B, EMBEDDING_DIM] stand-in for ml.encoder.Encoder.
+    Its feature_extractor downsamples by 32 like MobileNetV3, so Grad-CAM grids
+    are 7x7 at 224px and 4x4 at the 128px cascade size.
+    """
+
+    def __init__(self):
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.feature_extractor = nn.Sequential(nn.Conv2d(3, 8, kernel_size=32, stride=32), nn.ReLU())
+        self.pool = nn.AdaptiveAvgPool2d(2)
+        self.projection = nn.Linear(32, EMBEDDING_DIM)
+        with torch.no_grad():
+            conv = self.feature_extractor[0]
+            conv.weight.copy_(torch.randn(conv.weight.shape, generator=generator) / 32)
+            conv.bias.copy_(torch.randn(conv.bias.shape, generator=generator))
+            self.projection.weight.copy_(torch.randn(EMBEDDING_DIM, 32, generator=generator))
+            self.projection.bias.zero_()
+
+    def forward(self, images):
+        features = self.feature_extractor(images)
+        return nn.functional.normalize(self.projection(self.pool(features).flatten(1)), dim=1)
+
+
+@pytest.fixture
+def db():
+    database.Base.metadata.create_all(bind=database.engine)
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        database.Base.metadata.drop_all(bind=database.engine)
+
+
+@pytest.fixture
+def user(db):
+    user = models.User(email="grower@example.com", username="grower", hashed_password="x", is_admin=True)
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+@asynccontextmanager
+async def batchers_only(app):
+    """Test lifespan: the micro-batchers and advisory tasks, but no model loading"""
+    await inference_batcher.start()
+    await label_batcher.start()
+    yield
+    await inference_batcher.stop()
+    await label_batcher.stop()
+    await advisory_pipeline.stop()
+
+
+@pytest.fixture
+def client(db, user, monkeypatch):
+    def get_test_db():
+        session = database.SessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def get_test_user():
+        return db.get(models.User, user.id)
+
+    app.dependency_overrides[database.get_db] = get_test_db
+    for dependency in (get_current_active_user, get_current_user, get_current_admin_user):
+        app.dependency_overrides[dependency] = get_test_user
+    # One event loop for the whole test, so requests share the running batchers
+    monkeypatch.setattr(app.router, "lifespan_context", batchers_only)
+    monkeypatch.setattr(diagnosis, "result_cache", ResultCache(max_entries=64))
+    with TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def encoder():
+    return TinyEncoder().eval()
+
+
+@pytest.fixture
+def loaded_service(monkeypatch, encoder):
+    """ml_service with random prototypes for three classes, as if initialize() had run"""
+    generator = torch.Generator().manual_seed(1)
+    class_names = ["Blight", "Healthy", "Rust"]
+    prototypes = {label: torch.randn(EMBEDDING_DIM, generator=generator) for label in range(len(class_names))}
+    bank = PrototypeBank(prototypes, class_names, "cpu")
+
+    monkeypatch.setattr(ml_service, "device", "cpu")
+    monkeypatch.setattr(ml_service, "encoder", encoder)
+    monkeypatch.setattr(ml_service, "encoder_hash", ENCODER_HASH)
+    monkeypatch.setattr(ml_service, "prototypes", prototypes)
+    monkeypatch.setattr(ml_service, "class_names", class_names)
+    monkeypatch.setattr(ml_service, "prototype_bank", bank)
+    monkeypatch.setattr(ml_service, "prototype_version", "0" * 16)
+    monkeypatch.setattr(ml_service, "threshold", 0.5)
+    monkeypatch.setattr(ml_service, "gradcam", GradCAM(encoder, encoder.feature_extractor[-1]))
+    monkeypatch.setattr(ml_service, "classifier", PrototypeClassifier(encoder, bank, class_names, "cpu"))
+    return ml_service
+
+
+@pytest.fixture
+def confident_service(monkeypatch, loaded_service):
+    """loaded_service without open-set rejection: every image gets a known label"""
+    monkeypatch.setattr(loaded_service, "threshold", -1.0)
+    monkeypatch.setattr(loaded_service, "classifier", PrototypeClassifier(
+        loaded_service.encoder, loaded_service.prototype_bank, loaded_service.class_names, "cpu",
+        margin_threshold=-1.0
+    ))
+    return loaded_service
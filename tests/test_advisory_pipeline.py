@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+
+from backend import advisory_pipeline as pipeline_module
+from backend import advisory_store as store_module
+from backend.advisory_pipeline import (
+    ADVISORY_FAILED_PREFIX, AdvisoryPipeline, CircuitBreaker, CircuitOpenError
+)
+from backend.advisory_store import AdvisoryStore
+from backend.models import Prediction
+
+
+class Clock:
+    """Replaces the pipeline module's `time`; the real clock (and asyncio's) keep running"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pipeline_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = AdvisoryStore(0.05)
+    monkeypatch.setattr(store_module, "advisory_available", lambda: True)
+    monkeypatch.setattr(pipeline_module, "advisory_store", store)
+    return store
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Async stand-in for the OpenAI call; set .error to make it fail, .delay to make it slow"""
+    class LLM:
+        calls = 0
+        error = None
+        delay = 0.02
+
+        async def generate(self, disease, crop, confidence, severity, timeout=None):
+            self.calls += 1
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return f"{disease}/{severity}/{confidence:.2f}"
+
+    llm = LLM()
+    monkeypatch.setattr(pipeline_module, "generate_ai_advisory_async", llm.generate)
+    return llm
+
+
+def pending_predictions(db, user, count):
+    predictions = [
+        Prediction(user_id=user.id, image_path="x.jpg", disease_name="Rust", confidence_score=0.87,
+                   disease_stage="Mid")
+        for _ in range(count)
+    ]
+    db.add_all(predictions)
+    db.commit()
+    return [prediction.id for prediction in predictions]
+
+
+def advisories(db, ids):
+    db.expire_all()
+    return [db.get(Prediction, prediction_id).ai_advisory for prediction_id in ids]
+
+
+def run_pipeline(pipeline, ids, confidences=None):
+    async def main():
+        for prediction_id, confidence in zip(ids, confidences or [0.87] * len(ids)):
+            pipeline.schedule(prediction_id, "Rust", "Wheat", "Mid", confidence)
+        await asyncio.gather(*pipeline._tasks)
+    asyncio.run(main())
+
+
+def test_breaker_opens_then_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 30
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    # Only a single trial while half-open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # A failed trial re-opens immediately
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_abandoned_trial_frees_the_half_open_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+
+    breaker.before_call()
+    breaker.release()
+
+    breaker.before_call()
+
+
+def test_predictions_waiting_on_one_advisory_share_a_call(db, user, store, llm):
+    ids = pending_predictions(db, user, 3)
+    pipeline = AdvisoryPipeline(4, timeout=5, max_attempts=1, breaker=CircuitBreaker(3, 30))
+
+    # Same bucket, so the same advisory
+    run_pipeline(pipeline, ids, confidences=[0.87, 0.88, 0.86])
+
+    assert llm.calls == 1
+    assert advisories(db, ids) == ["Rust/Mid/0.85"] * 3
+    assert pipeline.stats()["completed"] == 3
+    assert pipeline.stats()["in_flight"] == 0
+
+
+def test_stored_advisories_skip_the_llm(db, user, store, llm):
+    store.save(store.key("Rust", "Wheat", "Mid", 0.87), "stored")
+    ids = pending_predictions(db, user, 1)
+
+    run_pipeline(AdvisoryPipeline(4, timeout=5, max_attempts=1, breaker=CircuitBreaker(3, 30)), ids)
+
+    assert llm.calls == 0
+    assert advisories(db, ids) == ["stored"]
+
+
+def test_failures_are_recorded_and_open_the_breaker(db, user, store, llm):
+    llm.error = RuntimeError("rate limited")
+    ids = pending_predictions(db, user, 2)
+    pipeline = AdvisoryPipeline(4, timeout=5, max_attempts=1, breaker=CircuitBreaker(1, 30))
+
+    run_pipeline(pipeline, ids[:1])
+    # The breaker is open now: the next prediction fails fast without calling the API
+    run_pipeline(pipeline, ids[1:])
+
+    assert llm.calls == 1
+    first, second = advisories(db, ids)
+    assert first == f"{ADVISORY_FAILED_PREFIX}: rate limited"
+    assert second.startswith(ADVISORY_FAILED_PREFIX) and "circuit open" in second
+    assert pipeline.stats()["failed"] == 2
+    assert pipeline.stats()["circuit"] == "open"
+
+
+def test_slow_calls_time_out(db, user, store, llm):
+    llm.delay = 1.0
+    ids = pending_predictions(db, user, 1)
+    pipeline = AdvisoryPipeline(4, timeout=0.05, max_attempts=1, breaker=CircuitBreaker(3, 30))
+
+    run_pipeline(pipeline, ids)
+
+    assert pipeline.stats()["timeouts"] == 1
+    assert advisories(db, ids)[0].startswith(ADVISORY_FAILED_PREFIX)
@@ -0,0 +1,89 @@
+import pytest
+
+from backend import advisory_store as store_module
+from backend.advisory_store import AdvisoryStore
+from backend.models import Advisory
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Stand-in for the OpenAI call; records the prompts it was asked for"""
+    calls = []
+
+    def generate_ai_advisory(disease, crop, confidence, severity):
+        calls.append((disease, crop, confidence, severity))
+        return f"{disease}/{severity}/{confidence:.2f}"
+
+    monkeypatch.setattr(store_module, "advisory_available", lambda: True)
+    monkeypatch.setattr(store_module, "generate_ai_advisory", generate_ai_advisory)
+    return calls
+
+
+def test_confidences_share_a_bucket_by_lower_edge():
+    store = AdvisoryStore(0.05, prompt_version=3)
+
+    assert [store.bucket(c) for c in (0.0, 0.849, 0.85, 0.8999, 0.9, 1.0, 1.7)] == [0, 80, 85, 85, 90, 100, 100]
+    assert store.key("Rust", "Wheat", "Mid", 0.87) == ("Rust", "Wheat", "Mid", 85, 3)
+    assert store.key("Rust", "Wheat", "Mid", 0.87) == store.key("Rust", "Wheat", "Mid", 0.89)
+    assert store.key("Rust", "Wheat", "Mid", 0.87) != store.key("Rust", "Wheat", "Late", 0.87)
+    assert AdvisoryStore(0.05, prompt_version=4).key("Rust", "Wheat", "Mid", 0.87)[-1] == 4
+
+
+def test_one_generation_per_bucket(db, llm):
+    store = AdvisoryStore(0.05)
+
+    first = store.get_or_generate("Rust", "Wheat", "Mid", 0.87)
+    second = store.get_or_generate("Rust", "Wheat", "Mid", 0.86)
+
+    assert first == second == "Rust/Mid/0.85"
+    # The prompt sees the bucket's lower edge, so the advisory fits the whole bucket
+    assert llm == [("Rust", "Wheat", 0.85, "Mid")]
+    assert store.stats()["hits"] == 1
+
+
+def test_other_workers_read_stored_advisories_from_the_db(db, llm):
+    AdvisoryStore(0.05).get_or_generate("Rust", "Wheat", "Mid", 0.87)
+    other = AdvisoryStore(0.05)
+
+    assert other.lookup("Rust", "Wheat", "Mid", 0.87) is None
+    assert other.get_or_generate("Rust", "Wheat", "Mid", 0.88) == "Rust/Mid/0.85"
+    assert len(llm) == 1
+    assert other.stats()["db_hits"] == 1
+    # Now mirrored in memory
+    assert other.lookup("Rust", "Wheat", "Mid", 0.85) == "Rust/Mid/0.85"
+
+
+def test_load_only_mirrors_the_current_prompt_version(db):
+    db.add_all([
+        Advisory(disease_name="Rust", crop="Wheat", disease_stage="Mid", confidence_bucket=85,
+                 prompt_version=1, content="old"),
+        Advisory(disease_name="Rust", crop="Wheat", disease_stage="Mid", confidence_bucket=85,
+                 prompt_version=2, content="current"),
+    ])
+    db.commit()
+    store = AdvisoryStore(0.05, prompt_version=2)
+
+    store.load()
+
+    assert store.stats()["entries"] == 1
+    assert store.lookup("Rust", "Wheat", "Mid", 0.87) == "current"
+
+
+def test_placeholder_replies_are_not_stored(db, monkeypatch):
+    monkeypatch.setattr(store_module, "advisory_available", lambda: False)
+    store = AdvisoryStore(0.05)
+
+    store.get_or_generate("Rust", "Wheat", "Mid", 0.87)
+
+    assert store.stats()["entries"] == 0
+    assert db.query(Advisory).count() == 0
+
+
+def test_combinations_cover_every_reachable_stage():
+    store = AdvisoryStore(0.25)
+
+    combinations = set(store.combinations(["Rust"], "Wheat", threshold=0.5))
+
+    assert {confidence for _, _, _, confidence in combinations} == {0.5, 0.75, 1.0}
+    assert {stage for _, _, stage, confidence in combinations if confidence == 0.75} == {"Early", "Mid", "Late"}
+    assert {stage for _, _, stage, confidence in combinations if confidence == 0.5} == {"Early"}
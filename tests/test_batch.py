@@ -0,0 +1,66 @@
+import io
+import json
+import zipfile
+
+from backend.models import DiseaseHistory, Prediction
+from conftest import leaf_jpeg
+
+URL = "/api/v1/diagnosis/batch"
+
+
+def lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_results_stream_per_image_with_errors_inline(client, db, confident_service):
+    files = [
+        ("files", ("a.jpg", leaf_jpeg(1), "image/jpeg")),
+        ("files", ("b.gif", b"GIF89a" + b"\0" * 64, "image/gif")),
+        ("files", ("c.jpg", leaf_jpeg(3), "image/jpeg")),
+        ("files", ("d.jpg", leaf_jpeg(4)[:200], "image/jpeg")),
+        ("files", ("e.jpg", leaf_jpeg(5), "image/jpeg")),
+    ]
+
+    response = client.post(URL, files=files)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    *items, summary = lines(response)
+    assert summary == {"summary": {"total": 5, "succeeded": 3, "failed": 2}}
+    by_index = {item["index"]: item for item in items}
+    assert sorted(by_index) == [0, 1, 2, 3, 4]
+    assert by_index[1]["filename"] == "b.gif" and "Invalid file type" in by_index[1]["error"]
+    assert by_index[3]["filename"] == "d.jpg" and "Invalid image" in by_index[3]["error"]
+    for index in (0, 2, 4):
+        assert "error" not in by_index[index]
+        assert by_index[index]["disease_name"] in confident_service.class_names
+
+    predictions = db.query(Prediction).all()
+    assert sorted(prediction.id for prediction in predictions) == sorted(
+        by_index[index]["prediction_id"] for index in (0, 2, 4)
+    )
+    assert sum(history.total_detections for history in db.query(DiseaseHistory).all()) == 3
+
+
+def test_zip_archives_only_contribute_their_images(client, confident_service):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("survey/row1.jpg", leaf_jpeg(1))
+        archive.writestr("survey/row2.jpg", leaf_jpeg(2))
+        archive.writestr("survey/notes.txt", "field 7")
+        archive.writestr("__MACOSX/survey/._row1.jpg", b"resource fork")
+        archive.writestr("survey/.hidden.jpg", leaf_jpeg(3))
+
+    response = client.post(URL, files={"archive": ("survey.zip", buffer.getvalue(), "application/zip")})
+
+    *items, summary = lines(response)
+    assert summary["summary"] == {"total": 2, "succeeded": 2, "failed": 0}
+    assert sorted(item["filename"] for item in items) == ["survey/row1.jpg", "survey/row2.jpg"]
+
+
+def test_requests_without_images_are_rejected_up_front(client, loaded_service):
+    assert client.post(URL).status_code == 400
+    not_a_zip = client.post(URL, files={"archive": ("survey.zip", b"not a zip", "application/zip")})
+    assert not_a_zip.status_code == 400
+    wrong_type = client.post(URL, files={"archive": ("survey.tar", b"", "application/x-tar")})
+    assert wrong_type.status_code == 400
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import torch
+
+from ml.calibrate_cascade import search_bounds
+from ml.cascade import CascadeStage
+from ml.classifier import PrototypeClassifier
+
+
+def images(count, seed=0):
+    return torch.rand(count, 3, 224, 224, generator=torch.Generator().manual_seed(seed))
+
+
+def cascade_classifier(service, min_score, min_margin):
+    cascade = CascadeStage(service.prototype_bank, min_score, min_margin, size=128)
+    classifier = PrototypeClassifier(
+        service.encoder, service.prototype_bank, service.class_names, margin_threshold=-1.0, cascade=cascade
+    )
+    return classifier, cascade
+
+
+def test_confident_rows_exit_at_low_resolution(loaded_service):
+    classifier, cascade = cascade_classifier(loaded_service, min_score=-1.0, min_margin=-1.0)
+
+    results = classifier.predict_batch_with_cam(images(4), loaded_service.gradcam, threshold=-1.0)
+
+    # Grad-CAM comes from the same 128px pass
+    assert [np.asarray(grid).shape for _, _, _, grid, _ in results] == [(4, 4)] * 4
+    assert cascade.stats()["images"] == 4
+    assert cascade.stats()["escalated"] == 0
+
+
+def test_uncertain_rows_escalate_to_the_full_path(loaded_service):
+    classifier, cascade = cascade_classifier(loaded_service, min_score=2.0, min_margin=-1.0)
+    full = PrototypeClassifier(
+        loaded_service.encoder, loaded_service.prototype_bank, loaded_service.class_names, margin_threshold=-1.0
+    )
+    batch = images(4)
+
+    results = classifier.predict_batch_with_cam(batch, loaded_service.gradcam, threshold=-1.0)
+    expected = full.predict_batch_with_cam(batch, loaded_service.gradcam, threshold=-1.0)
+
+    assert [result[:3] for result in results] == [result[:3] for result in expected]
+    for (*_, grid, coverage), (*_, expected_grid, expected_coverage) in zip(results, expected):
+        assert np.asarray(grid).shape == (7, 7)
+        assert np.allclose(grid, expected_grid, atol=1e-6)
+        assert coverage == expected_coverage
+    assert cascade.stats()["escalated"] == 4
+    assert cascade.stats()["escalation_rate"] == 1.0
+
+
+def test_bounds_exclude_early_exits_that_change_the_stage():
+    low_scores = torch.linspace(0, 1, 11)
+    low_labels = torch.zeros(11, dtype=torch.long)
+    low_margins = torch.ones(11)
+    same_label = torch.ones(11, dtype=torch.bool)
+    # Labels always agree, but below 0.5 the coarse CAM moves the disease stage
+    same_stage = low_scores >= 0.5
+
+    label_only = search_bounds(low_labels, low_scores, low_margins, same_label, min_agreement=0.99)
+    bounds = search_bounds(low_labels, low_scores, low_margins, same_label & same_stage, min_agreement=0.99)
+
+    assert label_only["escalation_rate"] == 0.0
+    assert 0.4 < bounds["min_score"] <= 0.5 + 1e-6
+    assert bounds["agreement"] == 1.0
+    assert bounds["escalation_rate"] == pytest.approx(5 / 11)
+
+
+def test_no_bounds_when_nothing_agrees():
+    low_scores = torch.linspace(0, 1, 5)
+    assert search_bounds(
+        torch.zeros(5, dtype=torch.long), low_scores, torch.ones(5), torch.zeros(5, dtype=torch.bool), 0.99
+    ) is None
@@ -0,0 +1,81 @@
+import base64
+
+import numpy as np
+import pytest
+import torch
+
+from backend.edge_sync import PrototypeSync
+from backend.routers import diagnosis
+from ml.prototype_bank import PrototypeBank
+
+CLASS_NAMES = ["Blight", "Healthy", "Rust"]
+
+
+def bank(seed, moved=None):
+    generator = torch.Generator().manual_seed(seed)
+    prototypes = {label: torch.randn(8, generator=generator) for label in range(len(CLASS_NAMES))}
+    if moved is not None:
+        prototypes[moved] = prototypes[moved] + 1.0
+    return PrototypeBank(prototypes, CLASS_NAMES, "cpu")
+
+
+@pytest.fixture
+def sync():
+    sync = PrototypeSync(history_size=4)
+    sync.record(bank(0), "enc-v1", "enc", 0.6, 0.01)
+    sync.record(bank(0, moved=1), "enc-v2", "enc", 0.62, 0.01)
+    return sync
+
+
+def test_not_modified_only_for_current_version(sync):
+    assert sync.not_modified("enc-v2")
+    assert not sync.not_modified("enc-v1")
+    assert not sync.not_modified(None)
+
+
+def test_delta_sends_only_changed_classes(sync):
+    table = sync.table("enc-v1")
+    assert table["delta"] and table["base_version"] == "enc-v1"
+    assert list(table["rows"]) == ["Healthy"]
+
+    rows = np.frombuffer(base64.b64decode(table["rows"]["Healthy"]["data"]), dtype="<f2")
+    expected = bank(0, moved=1).matrix[1].half().numpy()
+    assert np.array_equal(rows, expected)
+
+
+def test_unknown_or_foreign_versions_get_the_full_table(sync):
+    for since in (None, "enc-unknown", "other-v1"):
+        table = sync.table(since)
+        assert not table["delta"]
+        assert sorted(table["rows"]) == CLASS_NAMES
+
+    sync.record(bank(0), "other-v1", "other", 0.6, 0.01)
+    # enc-v1 is in the history but was produced by another encoder
+    assert not sync.table("enc-v1")["delta"]
+
+
+def test_history_is_bounded():
+    sync = PrototypeSync(history_size=2)
+    for version in range(3):
+        sync.record(bank(version), f"enc-v{version}", "enc", 0.6, 0.01)
+    assert not sync.table("enc-v0")["delta"]
+    assert sync.table("enc-v1")["delta"]
+
+
+def test_prototypes_endpoint_etag(client, loaded_service, sync, monkeypatch):
+    monkeypatch.setattr(diagnosis, "prototype_sync", sync)
+    url = "/api/v1/diagnosis/edge/prototypes"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"enc-v2"'
+    assert not response.json()["delta"]
+
+    response = client.get(url, headers={"If-None-Match": '"enc-v2"'})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get(url, headers={"If-None-Match": 'W/"enc-v1"'})
+    assert response.status_code == 200
+    assert response.json()["delta"]
+    assert list(response.json()["rows"]) == ["Healthy"]
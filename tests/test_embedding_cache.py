@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+from PIL import Image
+
+from ml.embedding_cache import EmbeddingCache, embed_files
+from ml.transforms import inference_transform, train_transform
+
+
+def vectors(count, offset=0):
+    return np.arange(offset * 4, (offset + count) * 4, dtype=np.float32).reshape(count, 4)
+
+
+def test_rows_round_trip_and_reload(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "ab" * 32, inference_transform)
+    cache.append(["a", "b"], vectors(2))
+
+    reloaded = EmbeddingCache(str(tmp_path), "ab" * 32, inference_transform)
+    assert len(reloaded) == 2
+    assert np.array_equal(reloaded.rows(["b", "a"]), vectors(2)[::-1])
+
+
+def test_rows_of_nothing_without_a_data_file(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "ab" * 32, inference_transform)
+    assert cache.rows([]).shape == (0, 0)
+    cache.append(["a"], vectors(1))
+    assert cache.rows([]).shape == (0, 4)
+
+
+def test_writers_sharing_a_cache_keep_each_others_rows(tmp_path):
+    # Two handles on one cache file behave like two processes
+    first = EmbeddingCache(str(tmp_path), "ab" * 32, inference_transform)
+    second = EmbeddingCache(str(tmp_path), "ab" * 32, inference_transform)
+    first.append(["a", "b"], vectors(2))
+    second.append(["c", "a"], np.stack([vectors(1, 2)[0], vectors(1)[0]]))
+    first.append(["d"], vectors(1, 3))
+
+    merged = EmbeddingCache(str(tmp_path), "ab" * 32, inference_transform)
+    assert len(merged) == 4
+    assert np.array_equal(merged.rows(["a", "b", "c", "d"]), vectors(4))
+
+
+def test_embed_files_caches_seeded_augmentations(tmp_path, encoder):
+    encoder.checkpoint_hash = "cd" * 32
+    paths = []
+    for index in range(3):
+        path = tmp_path / f"{index}.png"
+        Image.fromarray(np.full((40, 40, 3), 60 * index, dtype=np.uint8)).save(path)
+        paths.append(str(path))
+
+    cache_dir = str(tmp_path / "cache")
+    first = embed_files(encoder, paths, transform=train_transform, cache_dir=cache_dir)
+    # Cached rows and a fresh (seeded) augmentation give the same embedding
+    again = embed_files(encoder, paths, transform=train_transform, cache_dir=cache_dir)
+    fresh = embed_files(encoder, paths, transform=train_transform, cache_dir=str(tmp_path / "other"))
+    assert torch.equal(first, again)
+    assert torch.allclose(first, fresh, atol=1e-6)
+    assert embed_files(encoder, [], cache_dir=cache_dir).shape[0] == 0
@@ -0,0 +1,81 @@
+import base64
+import io
+
+import numpy as np
+import pytest
+import torch
+from fastapi import HTTPException
+
+from backend.models import Prediction
+from backend.routers.diagnosis import parse_embedding
+from conftest import EMBEDDING_DIM
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+def encoded(values, dtype):
+    return base64.b64encode(np.asarray(values, dtype=dtype).tobytes()).decode("ascii")
+
+
+def test_parse_embedding_accepts_floats_and_base64():
+    values = np.linspace(-1, 1, EMBEDDING_DIM, dtype=np.float32)
+    expected = torch.from_numpy(values).unsqueeze(0)
+
+    assert torch.equal(parse_embedding(values.tolist(), EMBEDDING_DIM), expected)
+    assert torch.equal(parse_embedding(encoded(values, "<f4"), EMBEDDING_DIM), expected)
+    half = parse_embedding(encoded(values, "<f2"), EMBEDDING_DIM)
+    assert half.shape == (1, EMBEDDING_DIM)
+    assert torch.allclose(half, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize("embedding", [
+    [0.1] * (EMBEDDING_DIM - 1),
+    [0.1] * (EMBEDDING_DIM + 1),
+    [0.0] * EMBEDDING_DIM,
+    [float("nan")] + [0.1] * (EMBEDDING_DIM - 1),
+    "not base64!",
+    base64.b64encode(b"\0" * 3 * EMBEDDING_DIM).decode("ascii"),
+])
+def test_parse_embedding_rejects_bad_payloads(embedding):
+    with pytest.raises(HTTPException) as error:
+        parse_embedding(embedding, EMBEDDING_DIM)
+    assert error.value.status_code == 400
+
+
+def test_embedding_from_another_encoder_is_409(client, loaded_service):
+    response = client.post("/api/v1/diagnosis/predict/embedding", json={
+        "embedding": [0.1] * EMBEDDING_DIM, "encoder_version": "0" * 16
+    })
+    assert response.status_code == 409
+
+
+@pytest.mark.parametrize("payload", [
+    {"embedding": [0.1] * (EMBEDDING_DIM + 3)},
+    {"embedding": [0.1] * EMBEDDING_DIM, "cam_coverage": 1.5},
+])
+def test_invalid_embedding_request_is_400(client, loaded_service, payload):
+    payload["encoder_version"] = loaded_service.encoder_version
+    response = client.post("/api/v1/diagnosis/predict/embedding", json=payload)
+    assert response.status_code == 400
+
+
+def test_embedding_prediction_and_deferred_image(client, loaded_service, monkeypatch, db):
+    # Above any cosine similarity: UNKNOWN, so no advisory is generated
+    monkeypatch.setattr(loaded_service, "threshold", 1.1)
+    response = client.post("/api/v1/diagnosis/predict/embedding", json={
+        "embedding": encoded(np.ones(EMBEDDING_DIM), "<f2"),
+        "encoder_version": loaded_service.encoder_version
+    })
+    assert response.status_code == 201
+    body = response.json()
+    assert body["disease_name"] == "UNKNOWN"
+    assert body["image_filename"] == ""
+
+    image = ("leaf.png", io.BytesIO(PNG_HEADER + b"\0" * 64), "image/png")
+    url = f"/api/v1/diagnosis/predict/{body['prediction_id']}/image"
+    assert client.post(url, files={"file": image}).status_code == 200
+    image[1].seek(0)
+    assert client.post(url, files={"file": image}).status_code == 409
+
+    prediction = db.get(Prediction, body["prediction_id"])
+    assert prediction.image_path and prediction.image_filename
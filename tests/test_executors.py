@@ -0,0 +1,60 @@
+import asyncio
+import io
+
+import pytest
+
+from backend.executors import BoundedExecutor, ExecutorSaturatedError
+from backend.ml_service import ml_service
+from backend.routers import diagnosis
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+def saturated_executor(name):
+    executor = BoundedExecutor(name, max_workers=1, max_queue=0)
+    executor._pending = 1
+    return executor
+
+
+def test_bounded_executor_rejects_when_full():
+    executor = saturated_executor("test")
+    with pytest.raises(ExecutorSaturatedError):
+        asyncio.run(executor.run(lambda: None))
+    assert executor.stats()["rejected"] == 1
+    executor.shutdown()
+
+
+def test_bounded_executor_runs_below_capacity():
+    executor = BoundedExecutor("test", max_workers=1, max_queue=0)
+    assert asyncio.run(executor.run(lambda x: x + 1, 1)) == 2
+    executor.shutdown()
+
+
+def test_lazy_init_on_saturated_ml_executor_is_503(client, monkeypatch):
+    monkeypatch.setattr(ml_service, "classifier", None)
+    monkeypatch.setattr(diagnosis, "ml_executor", saturated_executor("ml"))
+
+    response = client.get("/api/v1/diagnosis/edge/prototypes")
+    assert response.status_code == 503
+    assert "saturated" in response.json()["detail"]
+
+
+def test_failed_lazy_init_is_503(client, monkeypatch):
+    def initialize():
+        raise FileNotFoundError("Encoder model not found")
+
+    monkeypatch.setattr(ml_service, "classifier", None)
+    monkeypatch.setattr(ml_service, "initialize", initialize)
+
+    response = client.get("/api/v1/diagnosis/edge/prototypes")
+    assert response.status_code == 503
+
+
+def test_upload_on_saturated_io_executor_is_503(client, loaded_service, monkeypatch):
+    monkeypatch.setattr(diagnosis, "io_executor", saturated_executor("io"))
+
+    response = client.post(
+        "/api/v1/diagnosis/predict",
+        files={"file": ("leaf.png", io.BytesIO(PNG_HEADER + b"\0" * 64), "image/png")}
+    )
+    assert response.status_code == 503
@@ -0,0 +1,39 @@
+import numpy as np
+import torch
+
+from ml.classifier import PrototypeClassifier
+from ml.gradcam import threshold_cam, upsample_cam
+
+
+def images(count, seed=0):
+    return torch.rand(count, 3, 224, 224, generator=torch.Generator().manual_seed(seed))
+
+
+def test_fused_batch_cams_match_standalone_per_image_cams(loaded_service):
+    classifier = PrototypeClassifier(
+        loaded_service.encoder, loaded_service.prototype_bank, loaded_service.class_names, margin_threshold=-1.0
+    )
+    gradcam = loaded_service.gradcam
+    batch = images(4)
+
+    results = classifier.predict_batch_with_cam(batch, gradcam, threshold=-1.0)
+
+    for i, (name, score, margin, grid, coverage) in enumerate(results):
+        label = loaded_service.class_names.index(name)
+        expected = gradcam.generate_from_prototype(batch[i:i + 1], loaded_service.prototypes[label])
+        assert np.asarray(grid).shape == (7, 7)
+        assert np.allclose(upsample_cam(grid), expected, atol=1e-5)
+        assert coverage == threshold_cam(expected)[1]
+
+
+def test_unknown_rows_skip_the_backward(loaded_service):
+    classifier = PrototypeClassifier(
+        loaded_service.encoder, loaded_service.prototype_bank, loaded_service.class_names
+    )
+    results = classifier.predict_batch_with_cam(images(2), loaded_service.gradcam, threshold=2.0)
+
+    assert [(name, grid, coverage) for name, _, _, grid, coverage in results] == [
+        ("UNKNOWN", None, 0.0), ("UNKNOWN", None, 0.0)
+    ]
+    # The captured activations are dropped instead of leaking into the next request
+    assert loaded_service.gradcam._local.activations is None
@@ -0,0 +1,80 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend.gradcam_cache import GradcamCache
+from backend.models import Prediction
+from backend.routers import diagnosis
+
+GRID = np.linspace(0, 1, 49, dtype=np.float32).reshape(7, 7).tolist()
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = str(tmp_path / "leaf.jpg")
+    Image.new("RGB", (320, 240), (40, 160, 60)).save(path)
+    return path
+
+
+def test_renders_once_then_serves_the_cached_file(tmp_path, image_path):
+    cache = GradcamCache(str(tmp_path / "cache"), max_entries=8)
+
+    path = cache.get_or_render(1, image_path, GRID, 224, 0.4, "jet")
+    again = cache.get_or_render(1, image_path, GRID, 224, 0.4, "jet")
+
+    assert again == path
+    assert cv2.imread(path).shape == (224, 224, 3)
+    assert cache.stats()["renders"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_each_rendering_option_is_its_own_entry(tmp_path, image_path):
+    cache = GradcamCache(str(tmp_path / "cache"), max_entries=8)
+
+    paths = {
+        cache.get_or_render(1, image_path, GRID, 224, 0.4, "jet"),
+        cache.get_or_render(1, image_path, GRID, 448, 0.4, "jet"),
+        cache.get_or_render(1, image_path, GRID, 224, 0.6, "jet"),
+        cache.get_or_render(1, image_path, GRID, 224, 0.4, "viridis"),
+    }
+
+    assert len(paths) == 4
+    assert cv2.imread(cache.path(1, 448, 0.4, "jet")).shape == (448, 448, 3)
+
+
+def test_evicts_the_least_recently_served_overlays(tmp_path, image_path):
+    cache = GradcamCache(str(tmp_path / "cache"), max_entries=2)
+    first = cache.get_or_render(1, image_path, GRID, 224, 0.4, "jet")
+    second = cache.get_or_render(2, image_path, GRID, 224, 0.4, "jet")
+    os.utime(first, (1000, 1000))
+    os.utime(second, (2000, 2000))
+
+    # Serving the older overlay makes it the most recent one
+    cache.get_or_render(1, image_path, GRID, 224, 0.4, "jet")
+    third = cache.get_or_render(3, image_path, GRID, 224, 0.4, "jet")
+
+    assert os.path.exists(first) and os.path.exists(third)
+    assert not os.path.exists(second)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_endpoint_renders_from_the_stored_grid(client, db, user, image_path, tmp_path, monkeypatch):
+    cache = GradcamCache(str(tmp_path / "cache"), max_entries=8)
+    monkeypatch.setattr(diagnosis, "gradcam_cache", cache)
+    prediction = Prediction(user_id=user.id, image_path=image_path, disease_name="Rust", cam_grid=GRID)
+    db.add(prediction)
+    db.commit()
+
+    url = f"/api/v1/diagnosis/gradcam/{prediction.id}"
+
+    first = client.get(url, params={"size": 128})
+    second = client.get(url, params={"size": 128})
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers["content-type"] == "image/jpeg"
+    assert first.content == second.content
+    assert cache.stats()["renders"] == 1 and cache.stats()["hits"] == 1
+    assert client.get(url, params={"colormap": "plaid"}).status_code == 400
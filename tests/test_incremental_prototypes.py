@@ -0,0 +1,107 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from backend import ml_service as ml_service_module
+from backend.config import settings
+from backend.edge_sync import PrototypeSync
+from backend.ml_service import ml_service
+from backend.result_cache import ResultCache
+from ml.inference_backends import EagerBackend
+from ml.prototype_stats import PrototypeStats, SimilarityHistogram
+
+
+def test_stats_added_in_parts_match_one_pass():
+    generator = torch.Generator().manual_seed(0)
+    embeddings = torch.randn(30, 8, generator=generator)
+    labels = torch.arange(30) % 3
+    class_names = ["a", "b", "c"]
+
+    full, _ = PrototypeStats.from_embeddings(embeddings, labels, class_names).prototypes()
+    stats = PrototypeStats.from_embeddings(embeddings[:12], labels[:12], class_names)
+    for label, name in enumerate(class_names):
+        stats.add(name, embeddings[12:][labels[12:] == label])
+    incremental, names = stats.prototypes()
+
+    assert names == class_names
+    for label in full:
+        assert torch.allclose(incremental[label], full[label], atol=1e-6)
+
+
+def test_new_class_is_ordered_like_image_folder():
+    stats = PrototypeStats.from_embeddings(torch.ones(2, 4), torch.tensor([0, 1]), ["b", "d"])
+    stats.add("c", torch.zeros(1, 4))
+    prototypes, class_names = stats.prototypes()
+    assert class_names == ["b", "c", "d"]
+    assert torch.equal(prototypes[1], torch.zeros(4))
+
+
+def test_state_dict_round_trip():
+    stats = PrototypeStats.from_embeddings(torch.randn(6, 4), torch.tensor([0, 0, 1, 1, 2, 2]), ["a", "b", "c"])
+    stats.histogram.add(torch.rand(6))
+    restored = PrototypeStats.from_state_dict(stats.state_dict())
+    assert restored.counts == stats.counts
+    assert torch.equal(restored.histogram.counts, stats.histogram.counts)
+
+
+@pytest.mark.parametrize("q", [0.0, 0.005, 0.1, 0.5, 0.99, 1.0])
+def test_histogram_quantile_within_one_bin(q):
+    similarities = torch.rand(5000, generator=torch.Generator().manual_seed(1), dtype=torch.float64) * 1.6 - 0.6
+    histogram = SimilarityHistogram()
+    histogram.add(similarities)
+    assert abs(histogram.quantile(q) - torch.quantile(similarities, q).item()) <= histogram.width
+
+
+def write_images(directory, class_name, count, offset=0):
+    os.makedirs(os.path.join(directory, class_name), exist_ok=True)
+    paths = []
+    base = np.array([sum(map(ord, class_name)) % 200, 80, 160], dtype=np.int64)
+    for index in range(offset, offset + count):
+        rng = np.random.default_rng(index + 100 * len(class_name))
+        pixels = np.clip(base + rng.integers(-50, 50, size=(48, 48, 3)), 0, 255).astype(np.uint8)
+        path = os.path.join(directory, class_name, f"{index}.png")
+        Image.fromarray(pixels).save(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def fresh_service(monkeypatch, encoder):
+    monkeypatch.setattr(ml_service, "device", "cpu")
+    monkeypatch.setattr(ml_service, "encoder", encoder)
+    monkeypatch.setattr(ml_service, "encoder_hash", "cd" * 32)
+    monkeypatch.setattr(ml_service, "inference_backend", EagerBackend(encoder))
+    monkeypatch.setattr(ml_service, "cascade", None)
+    for name in ("classifier", "prototypes", "class_names", "prototype_bank", "prototype_version",
+                 "threshold", "prototype_stats"):
+        monkeypatch.setattr(ml_service, name, getattr(ml_service, name))
+    monkeypatch.setattr(settings, "PROTOTYPES_PER_CLASS", 1)
+    monkeypatch.setattr(ml_service_module, "result_cache", ResultCache(max_entries=0))
+    monkeypatch.setattr(ml_service_module, "prototype_sync", PrototypeSync(history_size=2))
+    return ml_service
+
+
+@pytest.mark.parametrize("class_name", ["Healthy", "Mildew"])
+def test_incremental_update_matches_full_rebuild(tmp_path, fresh_service, monkeypatch, class_name):
+    base_dir, full_dir = str(tmp_path / "base"), str(tmp_path / "full")
+    for name in ("Blight", "Healthy", "Rust"):
+        write_images(base_dir, name, 4)
+    shutil.copytree(base_dir, full_dir)
+    added = write_images(full_dir, class_name, 3, offset=10)
+    monkeypatch.setattr(settings, "TRAIN_DATA_DIR", full_dir)
+
+    expected, expected_names, expected_threshold, _ = fresh_service._build_prototypes(full_dir)
+
+    prototypes, class_names, threshold, stats = fresh_service._build_prototypes(base_dir)
+    fresh_service._swap_model(prototypes, class_names, threshold, stats, None)
+    fresh_service.add_training_images(class_name, added)
+
+    assert fresh_service.class_names == expected_names
+    for label in expected:
+        assert torch.allclose(fresh_service.prototypes[label], expected[label], atol=1e-6)
+    # Older similarities are not re-scored, so only the threshold is approximate
+    assert abs(fresh_service.threshold - expected_threshold) < 0.1
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend import inference_batcher as batcher_module
+from backend.executors import BoundedExecutor
+from backend.inference_batcher import InferenceBatcher
+
+
+@pytest.fixture(autouse=True)
+def executor(monkeypatch):
+    executor = BoundedExecutor("ml", max_workers=2, max_queue=16)
+    monkeypatch.setattr(batcher_module, "ml_executor", executor)
+    yield executor
+    executor.shutdown()
+
+
+def run_batcher(batcher, coroutine):
+    async def main():
+        try:
+            return await coroutine()
+        finally:
+            await batcher.stop()
+    return asyncio.run(main())
+
+
+def test_results_fan_out_to_their_requests():
+    batches = []
+
+    def handler(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = InferenceBatcher(handler, max_batch_size=8, max_wait_ms=20, max_in_flight=1)
+
+    async def submit_all():
+        return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+
+    assert run_batcher(batcher, submit_all) == [0, 10, 20, 30, 40]
+    assert sorted(item for batch in batches for item in batch) == list(range(5))
+    assert len(batches) < 5
+
+
+def test_full_batch_flushes_without_waiting():
+    batcher = InferenceBatcher(lambda items: items, max_batch_size=4, max_wait_ms=10_000, max_in_flight=1)
+
+    async def submit_all():
+        start = time.monotonic()
+        await asyncio.gather(*(batcher.submit(i) for i in range(4)))
+        return time.monotonic() - start
+
+    assert run_batcher(batcher, submit_all) < 5
+    assert batcher.stats()["batch_size_counts"] == {4: 1}
+
+
+def test_partial_batch_flushes_after_max_wait():
+    batcher = InferenceBatcher(lambda items: items, max_batch_size=16, max_wait_ms=50, max_in_flight=1)
+
+    async def submit_all():
+        start = time.monotonic()
+        await asyncio.gather(batcher.submit(1), batcher.submit(2))
+        return time.monotonic() - start
+
+    elapsed = run_batcher(batcher, submit_all)
+    assert 0.04 <= elapsed < 5
+    assert batcher.stats()["batch_size_counts"] == {2: 1}
+
+
+def test_handler_failure_reaches_every_request_and_batcher_recovers():
+    calls = []
+
+    def handler(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise RuntimeError("out of memory")
+        return items
+
+    batcher = InferenceBatcher(handler, max_batch_size=8, max_wait_ms=20, max_in_flight=1)
+
+    async def submit_all():
+        failed = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+        return failed, await batcher.submit(3)
+
+    failed, recovered = run_batcher(batcher, submit_all)
+    assert all(isinstance(result, RuntimeError) for result in failed)
+    assert recovered == 3
+
+
+def test_batches_overlap_up_to_max_in_flight():
+    # Each batch waits for the other at the barrier; run one at a time, both would time out
+    barrier = threading.Barrier(2, timeout=5)
+
+    def handler(items):
+        barrier.wait()
+        return items
+
+    batcher = InferenceBatcher(handler, max_batch_size=1, max_wait_ms=1, max_in_flight=2)
+
+    async def submit_all():
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"))
+
+    assert run_batcher(batcher, submit_all) == ["a", "b"]
+    assert batcher.stats()["batches"] == 2
@@ -0,0 +1,64 @@
+import io
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from ml.ingest import InvalidImageError, decode_image, ingest_image, overlay_base
+from ml.transforms import inference_transform
+
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+
+
+def photo(width, height, format="JPEG"):
+    """A smooth synthetic photo, so JPEG and downscaling artefacts stay small"""
+    x = np.linspace(0, 1, width)[None, :]
+    y = np.linspace(0, 1, height)[:, None]
+    pixels = np.stack([x * np.ones_like(y), y * np.ones_like(x), (x + y) / 2], axis=2)
+    buffer = io.BytesIO()
+    Image.fromarray(np.uint8(pixels * 255)).save(buffer, format=format, quality=95)
+    return buffer.getvalue()
+
+
+def test_large_jpegs_decode_in_draft_mode():
+    # 1/4 scale is the smallest libjpeg scale that keeps both sides >= 256
+    assert decode_image(photo(2048, 1536)).size == (512, 384)
+    # Non-JPEG formats ignore the draft request and decode at full size
+    assert decode_image(photo(600, 400, format="PNG")).size == (600, 400)
+
+
+def test_draft_decode_matches_a_full_decode():
+    data = photo(2048, 1536)
+    full = inference_transform(Image.open(io.BytesIO(data)).convert("RGB")).unsqueeze(0)
+
+    tensor = ingest_image(data)
+
+    assert tensor.shape == (1, 3, 224, 224)
+    assert (tensor - full).abs().mean() < 0.02
+
+
+def test_overlay_base_is_the_model_crop():
+    data = photo(2048, 1536)
+    pixels = (ingest_image(data)[0] * STD + MEAN) * 255
+
+    base = overlay_base(data)
+
+    assert base.shape == (224, 224, 3) and base.dtype == np.uint8
+    assert np.abs(pixels.permute(1, 2, 0).numpy() - base).max() < 0.01
+
+
+def test_larger_overlay_bases_cover_the_same_crop():
+    data = photo(2048, 1536)
+    base = overlay_base(data)
+    large = overlay_base(data, size=448)
+
+    assert large.shape == (448, 448, 3)
+    shrunk = np.asarray(Image.fromarray(large).resize((224, 224), Image.BILINEAR), dtype=np.int16)
+    assert np.abs(shrunk - base).mean() < 2
+
+
+def test_undecodable_uploads_are_rejected():
+    with pytest.raises(InvalidImageError):
+        decode_image(b"not an image")
@@ -0,0 +1,57 @@
+import math
+
+import pytest
+
+from backend.app import app
+from backend.auth_utils import get_current_active_user, get_current_user
+from backend.config import settings
+from backend.ml_service import ml_service
+from conftest import leaf_jpeg
+
+URL = "/api/v1/diagnosis/predict"
+
+
+@pytest.fixture
+def cold_service(monkeypatch):
+    """ml_service before its first load, with a failing _load_models; .count counts its calls"""
+    class Loads:
+        count = 0
+
+    loads = Loads()
+
+    def load_models():
+        loads.count += 1
+        raise RuntimeError("checkpoint missing")
+
+    monkeypatch.setattr(ml_service, "classifier", None)
+    monkeypatch.setattr(ml_service, "init_failed_at", None)
+    monkeypatch.setattr(ml_service, "_load_models", load_models)
+    return loads
+
+
+def post(client):
+    return client.post(URL, files={"file": ("leaf.jpg", leaf_jpeg(), "image/jpeg")})
+
+
+def test_anonymous_requests_never_load_the_models(client, cold_service):
+    app.dependency_overrides.pop(get_current_active_user)
+    app.dependency_overrides.pop(get_current_user)
+
+    assert post(client).status_code == 401
+    assert cold_service.count == 0
+
+
+def test_failed_load_backs_off_before_retrying(client, cold_service, monkeypatch):
+    first = post(client)
+    second = post(client)
+
+    assert first.status_code == second.status_code == 503
+    assert first.headers["Retry-After"] == str(math.ceil(settings.ML_INIT_RETRY_S))
+    assert 0 < int(second.headers["Retry-After"]) <= math.ceil(settings.ML_INIT_RETRY_S)
+    # The second request did not re-run the load that just failed
+    assert cold_service.count == 1
+
+    # Once the cooldown has passed the next request tries again
+    monkeypatch.setattr(ml_service, "init_failed_at", ml_service.init_failed_at - settings.ML_INIT_RETRY_S)
+    assert post(client).status_code == 503
+    assert cold_service.count == 2
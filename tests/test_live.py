@@ -0,0 +1,100 @@
+import io
+
+import pytest
+from PIL import Image
+from starlette.websockets import WebSocketDisconnect
+
+from backend.auth_utils import create_access_token
+from backend.ml_service import ml_service
+from backend.models import Prediction
+from conftest import leaf_jpeg
+from ml.ingest import hash_distance, ingest_frame
+
+URL = "/api/v1/diagnosis/live"
+
+
+def recompressed(frame, quality=85):
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(frame)).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def live(client, user, confident_service):
+    token = create_access_token({"sub": str(user.id)})
+    with client.websocket_connect(f"{URL}?token={token}") as websocket:
+        yield websocket
+
+
+def test_invalid_tokens_are_refused(client, confident_service):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"{URL}?token=not-a-token") as websocket:
+            websocket.receive_json()
+    assert closed.value.code == 1008
+
+
+def test_closes_with_try_again_later_while_models_cannot_load(client, user, monkeypatch):
+    def load_models():
+        raise RuntimeError("checkpoint missing")
+
+    monkeypatch.setattr(ml_service, "classifier", None)
+    monkeypatch.setattr(ml_service, "init_failed_at", None)
+    monkeypatch.setattr(ml_service, "_load_models", load_models)
+    token = create_access_token({"sub": str(user.id)})
+
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"{URL}?token={token}") as websocket:
+            websocket.receive_json()
+    assert closed.value.code == 1013
+
+
+def test_near_identical_frames_reuse_the_last_label(live):
+    frame = leaf_jpeg(1, size=(640, 480))
+    other = leaf_jpeg(2, size=(640, 480))
+    # Recompression flips a few hash bits, a different scene most of them
+    assert hash_distance(ingest_frame(frame)[1], ingest_frame(recompressed(frame))[1]) <= 2
+    assert hash_distance(ingest_frame(frame)[1], ingest_frame(other)[1]) > 16
+
+    results = []
+    for data in (frame, recompressed(frame), other):
+        live.send_bytes(data)
+        results.append(live.receive_json())
+
+    assert [(result["frame"], result["duplicate"]) for result in results] == [(1, False), (2, True), (3, False)]
+    assert results[1]["disease_name"] == results[0]["disease_name"]
+    assert results[1]["confidence_score"] == results[0]["confidence_score"]
+    live.send_text('{"type": "stats"}')
+    assert live.receive_json() == {
+        "type": "stats", "received": 3, "classified": 2, "duplicates": 1, "dropped": 0
+    }
+
+
+def test_bad_frames_only_cost_their_own_result(live):
+    live.send_bytes(b"GIF89a" + b"\0" * 64)
+    assert live.receive_json()["type"] == "error"
+    live.send_bytes(leaf_jpeg()[:200])
+    assert live.receive_json() == {
+        "type": "error", "frame": 2,
+        "detail": "Invalid image file. The file is corrupted or not a valid image."
+    }
+
+    live.send_bytes(leaf_jpeg())
+    assert live.receive_json()["type"] == "result"
+
+
+def test_only_captures_are_stored(live, db):
+    live.send_text('{"type": "capture"}')
+    assert live.receive_json() == {"type": "error", "detail": "No frame to capture yet"}
+
+    live.send_bytes(leaf_jpeg())
+    result = live.receive_json()
+    assert db.query(Prediction).count() == 0
+
+    live.send_text('{"type": "capture", "notes": "row 4"}')
+    captured = live.receive_json()
+
+    assert captured["type"] == "captured"
+    assert captured["disease_name"] == result["disease_name"]
+    prediction = db.get(Prediction, captured["prediction_id"])
+    assert prediction.notes == "row 4"
+    assert db.query(Prediction).count() == 1
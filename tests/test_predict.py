@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from backend.config import settings
+from backend.models import DiseaseHistory, Prediction
+from conftest import leaf_jpeg
+
+URL = "/api/v1/diagnosis/predict"
+
+
+def upload_count():
+    return len(os.listdir(settings.UPLOAD_DIR))
+
+
+def test_predict_classifies_and_stores_the_upload(client, db, confident_service):
+    data = leaf_jpeg()
+
+    response = client.post(URL, files={"file": ("leaf.jpg", data, "image/jpeg")})
+
+    assert response.status_code == 201
+    body = response.json()
+    expected = confident_service.classifier.predict_with_cam(data, confident_service.gradcam, -1.0)
+    assert body["disease_name"] == expected[0]
+    assert abs(body["confidence_score"] - expected[1]) < 1e-5
+    assert abs(body["cam_coverage"] - expected[4]) < 1e-5
+    assert not body["is_unknown"]
+    assert body["gradcam_path"] == f"/api/v1/diagnosis/gradcam/{body['prediction_id']}"
+    # No stored advisory yet: generated in the background
+    assert body["advisory_status"] == "pending"
+
+    prediction = db.get(Prediction, body["prediction_id"])
+    assert prediction.disease_name == expected[0]
+    assert np.allclose(prediction.cam_grid, expected[3], atol=1e-4)
+    assert os.path.exists(prediction.image_path)
+    history = db.query(DiseaseHistory).filter(DiseaseHistory.disease_name == expected[0]).one()
+    assert history.total_detections == 1
+
+
+def test_concurrent_uploads_each_get_their_own_result(client, confident_service):
+    photos = [leaf_jpeg(seed) for seed in range(6)]
+
+    def post(data):
+        return client.post(URL, files={"file": ("leaf.jpg", data, "image/jpeg")})
+
+    # Requests overlap on the event loop and are micro-batched together
+    with ThreadPoolExecutor(max_workers=len(photos)) as pool:
+        responses = list(pool.map(post, photos))
+
+    assert [response.status_code for response in responses] == [201] * len(photos)
+    for data, response in zip(photos, responses):
+        expected = confident_service.classifier.predict_with_cam(data, confident_service.gradcam, -1.0)
+        assert response.json()["disease_name"] == expected[0]
+        assert abs(response.json()["confidence_score"] - expected[1]) < 1e-5
+
+
+def test_unknown_predictions_have_no_advisory_or_overlay(client, loaded_service, monkeypatch):
+    monkeypatch.setattr(loaded_service, "threshold", 2.0)
+
+    response = client.post(URL, files={"file": ("leaf.jpg", leaf_jpeg(), "image/jpeg")})
+
+    assert response.status_code == 201
+    body = response.json()
+    assert body["is_unknown"]
+    assert body["disease_stage"] == "Unknown"
+    assert body["gradcam_path"] == ""
+    assert body["ai_advisory"] == "" and body["advisory_status"] == "ready"
+
+
+def test_undecodable_upload_is_400_and_removed(client, loaded_service):
+    before = upload_count()
+    # Valid JPEG signature, truncated body
+    data = leaf_jpeg()[:200]
+
+    response = client.post(URL, files={"file": ("leaf.jpg", data, "image/jpeg")})
+
+    assert response.status_code == 400
+    assert upload_count() == before
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from backend import advisory_pipeline as pipeline_module
+from backend import advisory_store as store_module
+from backend.advisory_pipeline import AdvisoryPipeline, CircuitBreaker
+from backend.advisory_store import AdvisoryStore
+from backend.models import Prediction
+from backend.routers import diagnosis
+from conftest import leaf_jpeg
+
+URL = "/api/v1/diagnosis/predict/stream"
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = AdvisoryStore(0.05)
+    monkeypatch.setattr(store_module, "advisory_available", lambda: True)
+    monkeypatch.setattr(diagnosis, "advisory_store", store)
+    monkeypatch.setattr(pipeline_module, "advisory_store", store)
+    monkeypatch.setattr(diagnosis, "advisory_pipeline", AdvisoryPipeline(2, 5, 1, CircuitBreaker(3, 30)))
+    return store
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Streams a fixed advisory in two chunks; set .error to fail after the first"""
+    class LLM:
+        error = None
+
+        async def stream(self, disease, crop, confidence, severity, timeout=None):
+            yield "Spray "
+            if self.error is not None:
+                raise self.error
+            yield "copper."
+
+    llm = LLM()
+    monkeypatch.setattr(pipeline_module, "stream_ai_advisory", llm.stream)
+    return llm
+
+
+def events(response):
+    parsed = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        parsed.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return parsed
+
+
+def post(client, data):
+    return client.post(URL, files={"file": ("leaf.jpg", data, "image/jpeg")})
+
+
+def test_stages_arrive_in_pipeline_order(client, db, confident_service, store, llm):
+    response = post(client, leaf_jpeg())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    stream = events(response)
+    assert [event for event, _ in stream] == [
+        "accepted", "classification", "assessment", "gradcam", "advisory_token", "advisory_token", "done"
+    ]
+    data = dict(stream[:4])
+    assert data["accepted"]["image_filename"].endswith(".jpg")
+    assert data["classification"]["disease_name"] in confident_service.class_names
+    assert data["assessment"]["disease_stage"] in ("Early", "Mid", "Late")
+    prediction_id = data["gradcam"]["prediction_id"]
+    assert data["gradcam"]["gradcam_url"] == f"/api/v1/diagnosis/gradcam/{prediction_id}"
+    assert [chunk["content"] for event, chunk in stream if event == "advisory_token"] == ["Spray ", "copper."]
+    assert stream[-1][1]["prediction_id"] == prediction_id
+
+    db.expire_all()
+    assert db.get(Prediction, prediction_id).ai_advisory == "Spray copper."
+
+
+def test_stored_advisories_arrive_in_one_event(client, confident_service, store, llm):
+    data = leaf_jpeg()
+    post(client, data)
+
+    # The advisory of the first request is stored now
+    stream = events(post(client, data))
+
+    assert [event for event, _ in stream] == [
+        "accepted", "classification", "assessment", "gradcam", "advisory", "done"
+    ]
+    assert stream[4][1]["content"] == "Spray copper."
+
+
+def test_advisory_failure_still_finishes_the_stream(client, db, confident_service, store, llm):
+    llm.error = RuntimeError("connection reset")
+
+    stream = events(post(client, leaf_jpeg()))
+
+    assert [event for event, _ in stream][-3:] == ["advisory_token", "advisory_failed", "done"]
+    assert "connection reset" in stream[-2][1]["detail"]
+    db.expire_all()
+    assert db.get(Prediction, stream[-1][1]["prediction_id"]).ai_advisory.startswith("AI advisory generation failed")
+
+
+def test_undecodable_image_ends_with_an_error_event(client, loaded_service):
+    stream = events(post(client, leaf_jpeg()[:200]))
+
+    assert [event for event, _ in stream] == ["accepted", "error"]
+    assert "Invalid image" in stream[1][1]["detail"]
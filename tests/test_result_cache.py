@@ -0,0 +1,49 @@
+import os
+
+from backend.result_cache import ResultCache
+
+RESULT = {"disease_name": "Rust", "confidence_score": 0.9}
+
+
+def test_results_are_keyed_by_model_version():
+    cache = ResultCache(max_entries=8)
+    cache.put("sha", "v1", RESULT)
+
+    assert cache.get("sha", "v1") == RESULT
+    assert cache.get("sha", "v2") is None
+    assert cache.get("other", "v1") is None
+
+
+def test_lookups_do_not_evict_other_versions(tmp_path):
+    # A request still finishing on the previous model must not wipe the current one
+    cache = ResultCache(max_entries=8, disk_dir=str(tmp_path))
+    cache.put("sha", "v2", RESULT)
+    cache.put("sha", "v1", {"disease_name": "Blight"})
+    assert cache.get("sha", "v1") == {"disease_name": "Blight"}
+
+    assert cache.get("sha", "v2") == RESULT
+    assert sorted(os.listdir(tmp_path)) == ["v1", "v2"]
+
+
+def test_retain_version_drops_older_versions(tmp_path):
+    cache = ResultCache(max_entries=8, disk_dir=str(tmp_path))
+    cache.put("sha", "v1", RESULT)
+    cache.retain_version("v2")
+
+    assert cache.get("sha", "v1") is None
+    assert os.listdir(tmp_path) == []
+    assert cache.stats()["model_version"] == "v2"
+
+
+def test_disk_entries_survive_a_restart(tmp_path):
+    ResultCache(max_entries=8, disk_dir=str(tmp_path)).put("sha", "v1", RESULT)
+
+    cache = ResultCache(max_entries=8, disk_dir=str(tmp_path))
+    assert cache.get("sha", "v1") == RESULT
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_results_with_a_missing_gradcam_are_misses(tmp_path):
+    cache = ResultCache(max_entries=8)
+    cache.put("sha", "v1", dict(RESULT, gradcam_path=str(tmp_path / "gone.png")))
+    assert cache.get("sha", "v1") is None
@@ -0,0 +1,84 @@
+import io
+
+import pytest
+import torch
+from PIL import Image
+
+from backend.config import settings
+from conftest import leaf_jpeg
+from ml.tiling import classify_tiles, iter_tile_batches, tile_grid, tile_positions
+from ml.transforms import to_model_input
+
+URL = "/api/v1/diagnosis/predict/tiled"
+
+
+@pytest.mark.parametrize("length, tile_size, stride, expected", [
+    (100, 100, 75, [0]),
+    (80, 100, 75, [0]),
+    (175, 100, 75, [0, 75]),
+    # The last tile is moved back to end flush with the edge
+    (200, 100, 75, [0, 75, 100]),
+    (1000, 512, 384, [0, 384, 488]),
+])
+def test_tile_positions_cover_the_edges(length, tile_size, stride, expected):
+    assert tile_positions(length, tile_size, stride) == expected
+
+
+def test_tiles_never_exceed_the_short_side():
+    xs, ys, tile_size, stride = tile_grid(1200, 300, tile_size=512, overlap=0.25)
+
+    assert (tile_size, stride, ys) == (300, 225, [0])
+    assert xs == [0, 225, 450, 675, 900]
+    assert tile_grid(640, 480, tile_size=128, overlap=0.0)[3] == 128
+
+
+def test_tile_batches_crop_lazily_in_row_major_order():
+    image = Image.new("RGB", (300, 200))
+    xs, ys, tile_size, _ = tile_grid(300, 200, tile_size=100, overlap=0.0)
+
+    batches = list(iter_tile_batches(image, xs, ys, tile_size, batch_size=4))
+
+    assert [len(boxes) for boxes, _ in batches] == [4, 2]
+    assert batches[0][1].shape == (4, 3, 224, 224)
+    assert [box[:2] for boxes, _ in batches for box in boxes] == [
+        (0, 0), (100, 0), (200, 0), (0, 100), (100, 100), (200, 100)
+    ]
+
+
+def test_each_tile_is_classified_on_its_own_crop(confident_service):
+    classifier = confident_service.classifier
+    image = Image.open(io.BytesIO(leaf_jpeg(size=(512, 256)))).convert("RGB")
+
+    tiles, xs, ys, _, _ = classify_tiles(classifier, image, -1.0, tile_size=256, overlap=0.0, batch_size=1)
+
+    assert (xs, ys) == ([0, 256], [0])
+    crops = [image.crop((x, 0, x + 256, 256)).resize((224, 224), Image.BILINEAR) for x in xs]
+    expected = classifier.predict_batch(torch.stack([to_model_input(crop) for crop in crops]), -1.0)
+    assert [name for _, _, name, _ in tiles] == [name for name, _, _ in expected]
+    assert [score for _, _, _, score in tiles] == pytest.approx([score for _, score, _ in expected], abs=1e-5)
+
+
+def test_endpoint_returns_a_disease_map(client, confident_service):
+    data = leaf_jpeg(size=(640, 400))
+
+    response = client.post(URL, params={"tile_size": 200, "overlap": 0.0},
+                           files={"file": ("field.jpg", data, "image/jpeg")})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["rows"], body["columns"], body["tile_size"]) == (2, 4, 200)
+    assert len(body["tiles"]) == 8
+    assert [len(row) for row in body["disease_map"]] == [4, 4]
+    assert sum(body["counts"].values()) == 8
+    assert body["tiles"][5]["row"] == 1 and body["tiles"][5]["column"] == 1
+    assert (body["tiles"][5]["x"], body["tiles"][5]["y"]) == (200, 200)
+
+
+def test_too_many_tiles_is_400(client, confident_service, monkeypatch):
+    monkeypatch.setattr(settings, "TILED_MAX_TILES", 4)
+
+    response = client.post(URL, params={"tile_size": 100, "overlap": 0.0},
+                           files={"file": ("field.jpg", leaf_jpeg(size=(640, 400)), "image/jpeg")})
+
+    assert response.status_code == 400
+    assert "Too many tiles" in response.json()["detail"]
@@ -0,0 +1,53 @@
+import io
+import os
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from backend.uploads import stage_upload, store_upload
+
+JPEG_HEADER = b"\xff\xd8\xff\xe0"
+
+
+def upload(data, filename="leaf.jpg"):
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+
+def test_stage_upload_hashes_and_sizes(tmp_path):
+    data = JPEG_HEADER + os.urandom(1000)
+    tmp_upload, sha256, size = stage_upload(upload(data), str(tmp_path))
+
+    with open(tmp_upload, "rb") as f:
+        assert f.read() == data
+    assert size == len(data)
+    assert len(sha256) == 64
+
+
+@pytest.mark.parametrize("data", [b"GIF89a" + b"\0" * 32, b"not an image at all", b""])
+def test_stage_upload_rejects_missing_signature(tmp_path, data):
+    with pytest.raises(HTTPException) as error:
+        stage_upload(upload(data), str(tmp_path))
+    assert error.value.status_code == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_stage_upload_rejects_oversized_body(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        stage_upload(upload(JPEG_HEADER + b"\0" * 200), str(tmp_path), max_size=100)
+    assert error.value.status_code == 400
+    assert "too large" in error.value.detail
+    assert os.listdir(tmp_path) == []
+
+
+def test_store_upload_publishes_under_filename(tmp_path):
+    path, _ = store_upload(upload(JPEG_HEADER + b"\0" * 16), str(tmp_path), "leaf.jpg")
+    assert path == os.path.join(str(tmp_path), "leaf.jpg")
+    assert os.listdir(tmp_path) == ["leaf.jpg"]
+
+
+def test_predict_rejects_disguised_upload(client, loaded_service):
+    response = client.post(
+        "/api/v1/diagnosis/predict",
+        files={"file": ("leaf.jpg", io.BytesIO(b"MZ\x90\x00 executable"), "image/jpeg")}
+    )
+    assert response.status_code == 400